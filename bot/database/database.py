@@ -1,314 +1,82 @@
 import aiosqlite
 import logging
+import time
+from bot.database.pool import ConnectionPool, parse_pragmas
+from bot.database.write_queue import WriteQueue
+from bot.database.migrations import migrate, LATEST_VERSION
+from bot.services.media_store import image_urls
+from config import (
+    DB_POOL_SIZE, DB_ACQUIRE_TIMEOUT, DB_PRAGMAS,
+    DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE, DB_BUSY_TIMEOUT_MS,
+    DB_WRITE_FLUSH_MS, DB_WRITE_BATCH_SIZE,
+)
 
 DB_NAME = "bot.db"
 
-async def create_tables():
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Users table
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER UNIQUE,
-                username TEXT,
-                language TEXT,
-                session_string TEXT,
-                status TEXT DEFAULT 'active',
-                phone TEXT,
-                role TEXT DEFAULT 'client',
-                rating REAL DEFAULT 5.0,
-                deals_count INTEGER DEFAULT 0
-            )
-        """)
-        
-        # Verification codes table
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS verification_codes (
-                phone TEXT PRIMARY KEY,
-                code TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Templates table
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS templates (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                content TEXT,
-                media_type TEXT,
-                caption TEXT,
-                entities TEXT,
-                FOREIGN KEY(user_id) REFERENCES users(id)
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS scheduled_tasks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                template_id INTEGER,
-                target_groups TEXT, -- JSON list of group IDs
-                run_time TEXT,
-                start_time TEXT,
-                end_time TEXT,
-                interval_minutes INTEGER,
-                last_run TIMESTAMP,
-                is_active BOOLEAN DEFAULT 1,
-                FOREIGN KEY(user_id) REFERENCES users(id),
-                FOREIGN KEY(template_id) REFERENCES templates(id)
-            )
-        """)
-        # миграция для старых таблиц без новых колонок
-        await _ensure_column(db, "scheduled_tasks", "start_time", "TEXT")
-        await _ensure_column(db, "scheduled_tasks", "end_time", "TEXT")
-        await _ensure_column(db, "scheduled_tasks", "interval_minutes", "INTEGER")
-        await _ensure_column(db, "scheduled_tasks", "last_run", "TIMESTAMP")
-        await _ensure_column(db, "scheduled_tasks", "is_active", "BOOLEAN DEFAULT 1")
-        
-        # Migration for templates
-        await _ensure_column(db, "templates", "caption", "TEXT")
-        await _ensure_column(db, "templates", "entities", "TEXT")
-        await _ensure_column(db, "templates", "name", "TEXT")
-        await _ensure_column(db, "users", "display_name", "TEXT")
-        await _ensure_column(db, "users", "username", "TEXT")
-        
-        # Market rates table
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS market_rates (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                currency_pair TEXT,
-                rate_buy REAL,
-                rate_sell REAL,
-                source_group TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Monitored chats table
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS monitored_chats (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                chat_id INTEGER,
-                chat_title TEXT,
-                FOREIGN KEY(user_id) REFERENCES users(id)
-            )
-        """)
-        
-        await db.commit()
-        # Spam settings table
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS spam_settings (
-                chat_id INTEGER PRIMARY KEY,
-                block_links BOOLEAN DEFAULT 0,
-                block_keywords TEXT DEFAULT '', -- comma separated
-                flood_max_msgs INTEGER DEFAULT 0, -- 0 = disabled
-                flood_window INTEGER DEFAULT 60, -- seconds
-                flood_mute_time INTEGER DEFAULT 300, -- seconds
-                action TEXT DEFAULT 'ban'
-            )
-        """)
-
-        # Banned users challenge table
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS banned_users (
-                user_id INTEGER,
-                chat_id INTEGER,
-                attempts_left INTEGER DEFAULT 2,
-                correct_answer INTEGER,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (user_id, chat_id)
-            )
-        """)
-        
-        await db.commit()
-        await db.commit()
-        
-        # Migrations for spam_settings
-        await _ensure_column(db, "spam_settings", "flood_max_msgs", "INTEGER DEFAULT 0")
-        await _ensure_column(db, "spam_settings", "flood_window", "INTEGER DEFAULT 60")
-        await _ensure_column(db, "spam_settings", "flood_mute_time", "INTEGER DEFAULT 300")
-
-        # P2P Exchange Tables
-        await _ensure_column(db, "users", "role", "TEXT DEFAULT 'client'")
-        await _ensure_column(db, "users", "rating", "REAL DEFAULT 5.0")
-        await _ensure_column(db, "users", "deals_count", "INTEGER DEFAULT 0")
-
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                amount REAL,
-                currency TEXT,
-                location TEXT,
-                delivery_type TEXT, -- 'delivery' or 'pickup'
-                status TEXT DEFAULT 'active', -- 'active', 'closed'
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(user_id) REFERENCES users(telegram_id)
-            )
-        """)
 
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS bids (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                order_id INTEGER,
-                exchanger_id INTEGER,
-                rate REAL,
-                time_estimate TEXT,
-                comment TEXT,
-                status TEXT DEFAULT 'pending', -- 'pending', 'accepted', 'rejected'
-                message_id INTEGER, -- Telegram message ID for smart deletion
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(order_id) REFERENCES orders(id),
-                FOREIGN KEY(exchanger_id) REFERENCES users(telegram_id)
-            )
-        """)
-        await _ensure_column(db, "bids", "status", "TEXT DEFAULT 'pending'")
-        await _ensure_column(db, "bids", "message_id", "INTEGER")
-
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS market_posts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                type TEXT, -- 'buy' or 'sell'
-                amount REAL,
-                currency TEXT,
-                rate REAL,
-                location TEXT,
-                description TEXT,
-                image_data TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(user_id) REFERENCES users(telegram_id)
-        )
-        """)
-        await _ensure_column(db, "market_posts", "image_data", "TEXT")
+def _storage_pragmas() -> dict:
+    """WAL + mmap + кэш страниц; DB_PRAGMAS перекрывает значения по умолчанию."""
+    pragmas = {
+        "journal_mode": DB_JOURNAL_MODE,
+        "synchronous": DB_SYNCHRONOUS,
+        "cache_size": -DB_CACHE_SIZE_KB,  # отрицательное значение = KiB
+        "mmap_size": DB_MMAP_SIZE,
+        "busy_timeout": DB_BUSY_TIMEOUT_MS,
+    }
+    pragmas.update(parse_pragmas(DB_PRAGMAS))
+    return pragmas
 
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS categories (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE,
-                created_by INTEGER,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
 
-        # Add category to market_posts
-        await _ensure_column(db, "market_posts", "category", "TEXT")
+# Общий пул соединений: читатели + один сериализованный писатель
+pool = ConnectionPool(DB_NAME, size=DB_POOL_SIZE, acquire_timeout=DB_ACQUIRE_TIMEOUT, pragmas=_storage_pragmas())
+# Мелкие частые записи группируются в одну транзакцию
+write_queue = WriteQueue(pool, flush_interval=DB_WRITE_FLUSH_MS / 1000, max_batch=DB_WRITE_BATCH_SIZE)
 
-        # Web accounts for login/password auth
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS web_accounts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nickname TEXT UNIQUE NOT NULL,
-                name TEXT,
-                password_hash TEXT NOT NULL,
-                telegram_id INTEGER,
-                phone TEXT,
-                role TEXT DEFAULT 'client',
-                is_seller_verified INTEGER DEFAULT 0,
-                avatar_url TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
 
-        # Verification codes for web-to-bot linking
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS web_verification_codes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                account_id INTEGER,
-                code TEXT NOT NULL,
-                verified INTEGER DEFAULT 0,
-                telegram_id INTEGER,
-                phone TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(account_id) REFERENCES web_accounts(id)
-            )
-        """)
+async def close_db():
+    await write_queue.close()
+    await pool.close()
 
-        # Seller verification codes (alphabetic)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS seller_codes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER,
-                code TEXT NOT NULL,
-                used INTEGER DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
 
-        # Bot verification codes (bot sends to user, user enters on site)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS bot_verification_codes (
-                telegram_id INTEGER PRIMARY KEY,
-                phone TEXT NOT NULL,
-                code TEXT NOT NULL,
-                used INTEGER DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+# Горячие запросы: функции берут SQL из констант, зарегистрированных здесь,
+# поэтому check_hot_query_plans проверяет ровно тот текст, который выполняется.
+HOT_QUERIES: dict[str, tuple[str, tuple]] = {}
 
-        # Reviews table
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS reviews (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                from_user_id INTEGER NOT NULL,
-                to_user_id INTEGER NOT NULL,
-                post_id INTEGER,
-                deal_id INTEGER,
-                rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),
-                comment TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(from_user_id) REFERENCES web_accounts(id),
-                FOREIGN KEY(to_user_id) REFERENCES web_accounts(id)
-            )
-        """)
 
-        # Deals table (completed exchanges)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS deals (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                request_id INTEGER,
-                offer_id INTEGER,
-                client_id INTEGER NOT NULL,
-                exchanger_id INTEGER NOT NULL,
-                rate TEXT,
-                location TEXT,
-                status TEXT DEFAULT 'pending',
-                ticket_sent INTEGER DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+def _hot(name: str, sql: str, sample_params: tuple = ()) -> str:
+    """Зарегистрировать SQL горячего запроса (с примером параметров для EXPLAIN); возвращает sql."""
+    HOT_QUERIES[name] = (sql, sample_params)
+    return sql
 
-        # Avatar column for web_accounts
-        await _ensure_column(db, "web_accounts", "avatar_url", "TEXT")
 
-        # Seller codes table
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS seller_codes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER NOT NULL,
-                code TEXT NOT NULL,
-                used INTEGER DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+async def checkpoint_db():
+    """Перенести WAL в основной файл (перед выгрузкой бэкапа)."""
+    async with pool.write() as db:
+        await db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
 
-        await db.commit()
-        logging.info("Tables created successfully")
+async def create_tables():
+    """Применить недостающие миграции (при актуальной схеме — одна проверка версии)."""
+    async with pool.write() as db:
+        applied = await migrate(db)
+    if applied:
+        logging.info(f"Applied {applied} migration(s), schema version {LATEST_VERSION}")
+    else:
+        logging.info(f"Schema is up to date (version {LATEST_VERSION})")
 
 async def add_user(telegram_id: int, language: str):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("""
             INSERT OR IGNORE INTO users (telegram_id, language)
             VALUES (?, ?)
         """, (telegram_id, language))
+        # пользователь снова пишет боту — значит, больше не заблокировал его
         await db.execute("""
-            UPDATE users SET language = ? WHERE telegram_id = ?
+            UPDATE users SET language = ?, bot_blocked_at = NULL WHERE telegram_id = ?
         """, (language, telegram_id))
         await db.commit()
 
 async def update_user_session(telegram_id: int, session_string: str, phone: str):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("""
             UPDATE users 
             SET session_string = ?, phone = ?, status = 'active'
@@ -316,62 +84,82 @@ async def update_user_session(telegram_id: int, session_string: str, phone: str)
         """, (session_string, phone, telegram_id))
         await db.commit()
 
+_GET_USER_SQL = _hot("get_user", "SELECT * FROM users WHERE telegram_id = ?", (1,))
+
 async def get_user(telegram_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,)) as cursor:
+    async with pool.read() as db:
+        async with db.execute(_GET_USER_SQL, (telegram_id,)) as cursor:
             return await cursor.fetchone()
 
 async def add_monitored_chat(user_id: int, chat_id: int, chat_title: str):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("""
             INSERT OR IGNORE INTO monitored_chats (user_id, chat_id, chat_title)
             VALUES (?, ?, ?)
         """, (user_id, chat_id, chat_title))
         await db.commit()
 
+_MONITORED_CHATS_SQL = _hot("get_monitored_chats", "SELECT chat_id FROM monitored_chats WHERE user_id = ?", (1,))
+
 async def get_monitored_chats(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT chat_id FROM monitored_chats WHERE user_id = ?", (user_id,)) as cursor:
+    async with pool.read() as db:
+        async with db.execute(_MONITORED_CHATS_SQL, (user_id,)) as cursor:
             rows = await cursor.fetchall()
             return [row[0] for row in rows]
 
 async def get_monitored_chats_full(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute("SELECT chat_id, chat_title FROM monitored_chats WHERE user_id = ?", (user_id,)) as cursor:
             rows = await cursor.fetchall()
             return [{"chat_id": row["chat_id"], "chat_title": row["chat_title"]} for row in rows]
 
 async def clear_monitored_chats(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("DELETE FROM monitored_chats WHERE user_id = ?", (user_id,))
         await db.commit()
 
 async def remove_monitored_chat(user_id: int, chat_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("DELETE FROM monitored_chats WHERE user_id = ? AND chat_id = ?", (user_id, chat_id))
         await db.commit()
 async def add_market_rate(currency_pair: str, rate: float, source_group: str):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("""
-            INSERT INTO market_rates (currency_pair, rate_buy, source_group)
-            VALUES (?, ?, ?)
-        """, (currency_pair, rate, source_group))
-        await db.commit()
+    await add_market_rates([(currency_pair, None, rate, source_group, int(time.time()))])
+
+async def add_market_rates(rates: list):
+    """
+    Пачка уличных курсов одной записью очереди: rates — [(pair, side, rate, source_group, ts)],
+    side — 'buy' / 'sell' / None. Пишет и в market_rates, и в историю (source = 'street').
+    """
+    if not rates:
+        return
+    await write_queue.submit_many([
+        ("""
+            INSERT INTO market_rates (currency_pair, rate_buy, rate_sell, source_group, timestamp)
+            VALUES (?, ?, ?, ?, datetime(?, 'unixepoch'))
+        """, [
+            (pair, rate if side != "sell" else None, rate if side == "sell" else None, group, ts)
+            for pair, side, rate, group, ts in rates
+        ]),
+        *_rate_point_statements([("street", pair, ts, rate) for pair, _, rate, _, ts in rates]),
+    ])
+
+# Средний курс покупки за последние 24 часа (pair, avg, unix-время последнего курса);
+# окно — по индексу idx_market_rates_ts_pair
+_AVERAGE_RATES_SQL = _hot("get_average_rates", """
+    SELECT currency_pair, AVG(rate_buy), CAST(strftime('%s', MAX(timestamp)) AS INTEGER)
+    FROM market_rates
+    WHERE timestamp >= datetime(?, 'unixepoch') AND rate_buy IS NOT NULL
+    GROUP BY currency_pair
+""", (0,))
 
 async def get_average_rates():
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Получаем средний курс за последние 24 часа
-        async with db.execute("""
-            SELECT currency_pair, AVG(rate_buy) 
-            FROM market_rates 
-            WHERE timestamp >= datetime('now', '-1 day')
-            GROUP BY currency_pair
-        """) as cursor:
+    async with pool.read() as db:
+        async with db.execute(_AVERAGE_RATES_SQL, (int(time.time()) - 86400,)) as cursor:
             return await cursor.fetchall()
 
 async def add_template(user_id: int, content: str, media_type: str, caption: str = None, entities: str = None, name: str = None):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         cursor = await db.execute("""
             INSERT INTO templates (user_id, content, media_type, caption, entities, name)
             VALUES (?, ?, ?, ?, ?, ?)
@@ -380,7 +168,7 @@ async def add_template(user_id: int, content: str, media_type: str, caption: str
         return cursor.lastrowid
 
 async def get_user_templates(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         async with db.execute("SELECT id, content, media_type, caption, entities, name FROM templates WHERE user_id = ?", (user_id,)) as cursor:
             return await cursor.fetchall()
 
@@ -388,24 +176,26 @@ async def get_user_templates(user_id: int):
 
 
 async def get_template(template_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute("SELECT * FROM templates WHERE id = ?", (template_id,)) as cursor:
             return await cursor.fetchone()
 
 async def deactivate_task(task_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("UPDATE scheduled_tasks SET is_active = 0 WHERE id = ?", (task_id,))
         await db.commit()
 
 async def delete_template(user_id: int, template_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("DELETE FROM templates WHERE id = ? AND user_id = ?", (template_id, user_id))
+    async with pool.write() as db:
+        cursor = await db.execute("DELETE FROM templates WHERE id = ? AND user_id = ?", (template_id, user_id))
         await db.execute("DELETE FROM scheduled_tasks WHERE template_id = ? AND user_id = ?", (template_id, user_id))
+        if cursor.rowcount:
+            await db.execute("DELETE FROM media_uploads WHERE template_id = ?", (template_id,))
         await db.commit()
 
 async def add_scheduled_task(user_id: int, template_id: int, target_groups: str, start_time: str, end_time: str, interval_minutes: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         cursor = await db.execute(
             """
             INSERT INTO scheduled_tasks (user_id, template_id, target_groups, start_time, end_time, interval_minutes, run_time)
@@ -417,21 +207,21 @@ async def add_scheduled_task(user_id: int, template_id: int, target_groups: str,
         return cursor.lastrowid
 
 
+_SCHEDULED_TASKS_SQL = _hot("get_scheduled_tasks", """
+    SELECT id, user_id, template_id, target_groups, start_time, end_time, interval_minutes
+    FROM scheduled_tasks
+    WHERE is_active = 1
+""")
+
 async def get_scheduled_tasks():
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
-        async with db.execute(
-            """
-            SELECT id, user_id, template_id, target_groups, start_time, end_time, interval_minutes
-            FROM scheduled_tasks
-            WHERE is_active = 1
-            """
-        ) as cursor:
+        async with db.execute(_SCHEDULED_TASKS_SQL) as cursor:
             return await cursor.fetchall()
 
 
 async def get_user_active_tasks(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute(
             """
@@ -445,27 +235,43 @@ async def get_user_active_tasks(user_id: int):
 
 
 async def update_last_run(task_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE scheduled_tasks SET last_run = CURRENT_TIMESTAMP WHERE id = ?", (task_id,))
-        await db.commit()
+    await write_queue.submit("UPDATE scheduled_tasks SET last_run = CURRENT_TIMESTAMP WHERE id = ?", (task_id,))
 
 
-async def _ensure_column(db, table: str, column: str, definition: str):
-    """Добавить колонку, если её ещё нет (простой миграционный хелпер)."""
-    async with db.execute(f"PRAGMA table_info({table})") as cursor:
-        cols = [row[1] for row in await cursor.fetchall()]
-    if column not in cols:
-        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
-        await db.commit()
+# Горячие запросы и пример параметров для EXPLAIN QUERY PLAN
+
+async def check_hot_query_plans(db=None) -> dict:
+    """
+    EXPLAIN QUERY PLAN для HOT_QUERIES.
+    Возвращает {query_name: [строки плана с полным SCAN]} — пусто, если всё идёт по индексам.
+    """
+    if db is None:
+        async with pool.read() as db:
+            return await check_hot_query_plans(db)
+
+    problems = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        async with db.execute(f"EXPLAIN QUERY PLAN {sql}", params) as cursor:
+            plan = [row[3] for row in await cursor.fetchall()]
+        scans = [
+            detail for detail in plan
+            if detail.startswith("SCAN ") and "USING INDEX" not in detail and "USING COVERING INDEX" not in detail
+        ]
+        if scans:
+            problems[name] = scans
+    return problems
+
+
+_SPAM_SETTINGS_SQL = _hot("get_spam_settings", "SELECT * FROM spam_settings WHERE chat_id = ?", (1,))
 
 async def get_spam_settings(chat_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM spam_settings WHERE chat_id = ?", (chat_id,)) as cursor:
+        async with db.execute(_SPAM_SETTINGS_SQL, (chat_id,)) as cursor:
             return await cursor.fetchone()
 
 async def update_spam_settings(chat_id: int, block_links: bool, block_keywords: str, flood_max_msgs: int = 0, flood_window: int = 60, flood_mute_time: int = 300):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("""
             INSERT INTO spam_settings (chat_id, block_links, block_keywords, flood_max_msgs, flood_window, flood_mute_time)
             VALUES (?, ?, ?, ?, ?, ?)
@@ -479,38 +285,38 @@ async def update_spam_settings(chat_id: int, block_links: bool, block_keywords:
         await db.commit()
 
 async def add_banned_user_challenge(user_id: int, chat_id: int, correct_answer: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("""
             INSERT OR REPLACE INTO banned_users (user_id, chat_id, attempts_left, correct_answer)
             VALUES (?, ?, 2, ?)
         """, (user_id, chat_id, correct_answer))
         await db.commit()
 
+_BANNED_USER_SQL = _hot("get_banned_user_challenge", "SELECT * FROM banned_users WHERE user_id = ? AND chat_id = ?", (1, 1))
+
 async def get_banned_user_challenge(user_id: int, chat_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM banned_users WHERE user_id = ? AND chat_id = ?", (user_id, chat_id)) as cursor:
+        async with db.execute(_BANNED_USER_SQL, (user_id, chat_id)) as cursor:
             return await cursor.fetchone()
 
 async def update_banned_attempts(user_id: int, chat_id: int, attempts: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE banned_users SET attempts_left = ? WHERE user_id = ? AND chat_id = ?", (attempts, user_id, chat_id))
-        await db.commit()
+    await write_queue.submit("UPDATE banned_users SET attempts_left = ? WHERE user_id = ? AND chat_id = ?", (attempts, user_id, chat_id))
 
 async def remove_banned_user_challenge(user_id: int, chat_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("DELETE FROM banned_users WHERE user_id = ? AND chat_id = ?", (user_id, chat_id))
         await db.commit()
 
 # --- P2P Exchange Functions ---
 
 async def update_user_role(telegram_id: int, role: str):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("UPDATE users SET role = ? WHERE telegram_id = ?", (role, telegram_id))
         await db.commit()
 
 async def create_order(user_id: int, amount: float, currency: str, location: str, delivery_type: str):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         cursor = await db.execute("""
             INSERT INTO orders (user_id, amount, currency, location, delivery_type)
             VALUES (?, ?, ?, ?, ?)
@@ -518,20 +324,69 @@ async def create_order(user_id: int, amount: float, currency: str, location: str
         await db.commit()
         return cursor.lastrowid
 
-async def get_active_orders():
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM orders WHERE status = 'active' ORDER BY created_at DESC") as cursor:
-            return [dict(row) for row in await cursor.fetchall()]
+# Проекции для списков: только поля, которые рисует лента/карточка.
+# Детальные запросы (get_order, get_market_post) по-прежнему берут всю строку.
+ORDER_SUMMARY_COLUMNS = "id, user_id, amount, currency, location, delivery_type, status, created_at"
+BID_SUMMARY_COLUMNS = "b.id, b.order_id, b.exchanger_id, b.rate, b.time_estimate, b.comment, b.status, b.created_at"
+# image_data остаётся только для внешних URL — data:URL (старые, не перенесённые в /media) в ленту не тащим
+MARKET_POST_SUMMARY_COLUMNS = """
+    id, user_id, type, amount, currency, rate, location, description, category, created_at, image_key,
+    CASE WHEN image_data LIKE 'data:%' THEN NULL ELSE image_data END AS image_data
+"""
+
+
+async def _fetch_dicts(db, sql: str, params: tuple = ()) -> list[dict]:
+    """SELECT -> список dict; имена колонок берём из cursor.description один раз на запрос."""
+    async with db.execute(sql, params) as cursor:
+        columns = [c[0] for c in cursor.description]
+        rows = await cursor.fetchall()
+    return [dict(zip(columns, row)) for row in rows]
 
-async def get_user_orders(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC", (user_id,)) as cursor:
-            return [dict(row) for row in await cursor.fetchall()]
+
+def _keyset(before, alias: str = ""):
+    """
+    Keyset-пагинация по (created_at, id) для ORDER BY created_at DESC, id DESC.
+    before — (created_at, id) последней строки предыдущей страницы.
+    """
+    if not before:
+        return "1", ()
+    return f"({alias}created_at, {alias}id) < (?, ?)", (before[0], before[1])
+
+
+def _hot_paged(name: str, template: str, params: tuple, alias: str = "") -> str:
+    """Страничный запрос ({page} — условие _keyset): проверяются и первая страница, и следующие."""
+    _hot(f"{name} (first page)", template.format(page=_keyset(None, alias)[0]), (*params, 50))
+    page, page_params = _keyset(("2100-01-01", 1), alias)
+    _hot(name, template.format(page=page), (*params, *page_params, 50))
+    return template
+
+
+_ACTIVE_ORDERS_SQL = _hot_paged("get_active_orders", f"""
+    SELECT {ORDER_SUMMARY_COLUMNS} FROM orders
+    WHERE status = 'active' AND {{page}}
+    ORDER BY created_at DESC, id DESC
+    LIMIT ?
+""", ())
+
+async def get_active_orders(limit: int = -1, before: tuple = None):
+    page, page_params = _keyset(before)
+    async with pool.read() as db:
+        return await _fetch_dicts(db, _ACTIVE_ORDERS_SQL.format(page=page), (*page_params, limit))
+
+_USER_ORDERS_SQL = _hot_paged("get_user_orders", f"""
+    SELECT {ORDER_SUMMARY_COLUMNS} FROM orders
+    WHERE user_id = ? AND {{page}}
+    ORDER BY created_at DESC, id DESC
+    LIMIT ?
+""", (1,))
+
+async def get_user_orders(user_id: int, limit: int = -1, before: tuple = None):
+    page, page_params = _keyset(before)
+    async with pool.read() as db:
+        return await _fetch_dicts(db, _USER_ORDERS_SQL.format(page=page), (user_id, *page_params, limit))
 
 async def get_order(order_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute("""
             SELECT o.*, u.phone, u.username 
@@ -544,12 +399,12 @@ async def get_order(order_id: int):
 
 async def cancel_order(order_id: int):
     """Cancel an order"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("UPDATE orders SET status = 'cancelled' WHERE id = ?", (order_id,))
         await db.commit()
 
 async def place_bid(order_id: int, exchanger_id: int, rate: float, time_estimate: str, comment: str):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         cursor = await db.execute("""
             INSERT INTO bids (order_id, exchanger_id, rate, time_estimate, comment)
             VALUES (?, ?, ?, ?, ?)
@@ -558,7 +413,7 @@ async def place_bid(order_id: int, exchanger_id: int, rate: float, time_estimate
         return cursor.lastrowid
 
 async def accept_bid(bid_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         # Get bid details first
         db.row_factory = aiosqlite.Row
         async with db.execute("SELECT * FROM bids WHERE id = ?", (bid_id,)) as cursor:
@@ -579,97 +434,121 @@ async def accept_bid(bid_id: int):
         await db.commit()
         return bid
 
+# Join with users to get exchanger info (rating, name/id)
+# Note: users table doesn't have name, we rely on telegram_id or fetch from bot
+_ORDER_BIDS_SQL = _hot("get_order_bids", f"""
+    SELECT {BID_SUMMARY_COLUMNS}, u.rating, u.deals_count
+    FROM bids b
+    LEFT JOIN users u ON b.exchanger_id = u.telegram_id
+    WHERE b.order_id = ?
+    ORDER BY b.rate DESC
+""", (1,))
+
 async def get_order_bids(order_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        # Join with users to get exchanger info (rating, name/id)
-        # Note: users table doesn't have name, we rely on telegram_id or fetch from bot
-        async with db.execute("""
-            SELECT b.*, u.rating, u.deals_count 
-            FROM bids b
-            LEFT JOIN users u ON b.exchanger_id = u.telegram_id
-            WHERE b.order_id = ?
-            ORDER BY b.rate DESC
-        """, (order_id,)) as cursor:
-            return [dict(row) for row in await cursor.fetchall()]
+    async with pool.read() as db:
+        return await _fetch_dicts(db, _ORDER_BIDS_SQL, (order_id,))
 
 async def update_bid_message_id(bid_id: int, message_id: int):
     """Store the Telegram message ID for a bid notification"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE bids SET message_id = ? WHERE id = ?", (message_id, bid_id))
-        await db.commit()
+    await write_queue.submit("UPDATE bids SET message_id = ? WHERE id = ?", (message_id, bid_id))
+
+_CLEAR_COMPLETED_BIDS_SQL = _hot(
+    "clear_completed_bids", "DELETE FROM bids WHERE exchanger_id = ? AND status IN ('accepted', 'rejected')", (1,)
+)
 
 async def clear_completed_bids(user_id: int):
     """Delete completed/rejected bids for a user"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute(
-            "DELETE FROM bids WHERE exchanger_id = ? AND status IN ('accepted', 'rejected')",
-            (user_id,)
-        )
+    async with pool.write() as db:
+        await db.execute(_CLEAR_COMPLETED_BIDS_SQL, (user_id,))
         await db.commit()
 
+_REJECTED_BIDS_SQL = _hot("get_rejected_bids_with_messages", """
+    SELECT id, exchanger_id, message_id, order_id
+    FROM bids
+    WHERE order_id = ? AND id != ? AND message_id IS NOT NULL
+""", (1, 1))
+
 async def get_rejected_bids_with_messages(order_id: int, accepted_bid_id: int):
     """Get all rejected bids with their message_ids for cleanup"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
-        async with db.execute("""
-            SELECT id, exchanger_id, message_id, order_id 
-            FROM bids 
-            WHERE order_id = ? AND id != ? AND message_id IS NOT NULL
-        """, (order_id, accepted_bid_id)) as cursor:
+        async with db.execute(_REJECTED_BIDS_SQL, (order_id, accepted_bid_id)) as cursor:
             return [dict(row) for row in await cursor.fetchall()]
 
 async def get_order_client_id(order_id: int):
     """Get the client's telegram ID for an order"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         async with db.execute("SELECT user_id FROM orders WHERE id = ?", (order_id,)) as cursor:
             row = await cursor.fetchone()
             return row[0] if row else None
 
-async def get_user_bids(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        # Join with orders to get order details
-        async with db.execute("""
-            SELECT b.*, o.amount, o.currency, o.location, o.status as order_status
-            FROM bids b
-            JOIN orders o ON b.order_id = o.id
-            WHERE b.exchanger_id = ?
-            ORDER BY b.created_at DESC
-        """, (user_id,)) as cursor:
-            return [dict(row) for row in await cursor.fetchall()]
-
-async def create_market_post(user_id: int, p_type: str, amount: float, currency: str, rate: float, location: str, description: str, category: str = None, image_data: str = None):
-    async with aiosqlite.connect(DB_NAME) as db:
+# Join with orders to get order details
+_USER_BIDS_SQL = _hot_paged("get_user_bids", f"""
+    SELECT {BID_SUMMARY_COLUMNS}, o.amount, o.currency, o.location, o.status as order_status
+    FROM bids b
+    JOIN orders o ON b.order_id = o.id
+    WHERE b.exchanger_id = ? AND {{page}}
+    ORDER BY b.created_at DESC, b.id DESC
+    LIMIT ?
+""", (1,), alias="b.")
+
+async def get_user_bids(user_id: int, limit: int = -1, before: tuple = None):
+    page, page_params = _keyset(before, "b.")
+    async with pool.read() as db:
+        return await _fetch_dicts(db, _USER_BIDS_SQL.format(page=page), (user_id, *page_params, limit))
+
+async def create_market_post(user_id: int, p_type: str, amount: float, currency: str, rate: float, location: str, description: str, category: str = None, image_key: str = None):
+    async with pool.write() as db:
         await db.execute("""
-            INSERT INTO market_posts (user_id, type, amount, currency, rate, location, description, category, image_data)
+            INSERT INTO market_posts (user_id, type, amount, currency, rate, location, description, category, image_key)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (user_id, p_type, amount, currency, rate, location, description, category, image_data))
+        """, (user_id, p_type, amount, currency, rate, location, description, category, image_key))
         await db.commit()
 
-async def get_market_posts():
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM market_posts ORDER BY created_at DESC LIMIT 50") as cursor:
-            return [dict(row) for row in await cursor.fetchall()]
+
+def _market_post(row) -> dict:
+    """Строка market_posts -> dict; вместо байтов картинки — ссылки на /media (внешний URL — как есть)."""
+    post = dict(row)
+    ref = post.pop("image_key", None)
+    if ref:
+        post["image_data"], post["image_thumb"] = image_urls(ref)
+    return post
+
+
+_MARKET_POSTS_SQL = _hot_paged("get_market_posts", f"""
+    SELECT {MARKET_POST_SUMMARY_COLUMNS} FROM market_posts
+    WHERE {{page}}
+    ORDER BY created_at DESC, id DESC
+    LIMIT ?
+""", ())
+
+async def get_market_posts(limit: int = 50, before: tuple = None):
+    page, page_params = _keyset(before)
+    async with pool.read() as db:
+        rows = await _fetch_dicts(db, _MARKET_POSTS_SQL.format(page=page), (*page_params, limit))
+    return [_market_post(row) for row in rows]
+
+# Get from web_accounts (Bot-First registration) - include language from users table
+_WEB_EXCHANGERS_SQL = _hot("get_exchangers_by_location", """
+    SELECT w.telegram_id, COALESCE(u.language, 'ru') as language
+    FROM web_accounts w
+    LEFT JOIN users u ON w.telegram_id = u.telegram_id
+    WHERE w.role = 'exchanger' AND w.telegram_id IS NOT NULL
+""")
+# Also get from old users table for backwards compatibility
+_USER_EXCHANGERS_SQL = _hot(
+    "get_exchangers_by_location (users)",
+    "SELECT telegram_id, COALESCE(language, 'ru') as language FROM users WHERE role = 'exchanger'",
+)
 
 async def get_exchangers_by_location(location: str = None):
     """Get all exchangers - checks both users and web_accounts tables"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
-        # Get from web_accounts (Bot-First registration) - include language from users table
-        async with db.execute("""
-            SELECT w.telegram_id, COALESCE(u.language, 'ru') as language 
-            FROM web_accounts w
-            LEFT JOIN users u ON w.telegram_id = u.telegram_id
-            WHERE w.role = 'exchanger' AND w.telegram_id IS NOT NULL
-        """) as cursor:
+        async with db.execute(_WEB_EXCHANGERS_SQL) as cursor:
             web_exchangers = [dict(row) for row in await cursor.fetchall()]
-        
-        # Also get from old users table for backwards compatibility
-        async with db.execute("""
-            SELECT telegram_id, COALESCE(language, 'ru') as language FROM users WHERE role = 'exchanger'
-        """) as cursor:
+
+        async with db.execute(_USER_EXCHANGERS_SQL) as cursor:
             old_exchangers = [dict(row) for row in await cursor.fetchall()]
         
         # Combine and deduplicate
@@ -682,7 +561,7 @@ async def get_exchangers_by_location(location: str = None):
         return result
 
 async def save_verification_code(phone: str, code: str):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("""
             INSERT OR REPLACE INTO verification_codes (phone, code, created_at)
             VALUES (?, ?, CURRENT_TIMESTAMP)
@@ -690,7 +569,7 @@ async def save_verification_code(phone: str, code: str):
         await db.commit()
 
 async def verify_code(phone: str, code: str):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         async with db.execute("SELECT code FROM verification_codes WHERE phone = ?", (phone,)) as cursor:
             row = await cursor.fetchone()
             if row and row[0] == code:
@@ -701,7 +580,7 @@ async def verify_code(phone: str, code: str):
 
 async def save_verification_code_by_user(user_id: int, code: str, phone: str):
     """Save verification code linked to user_id"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         # Use code itself as the key for easy lookup
         await db.execute("""
             INSERT OR REPLACE INTO verification_codes (phone, code, created_at)
@@ -713,7 +592,7 @@ async def save_verification_code_by_user(user_id: int, code: str, phone: str):
 
 async def verify_code_by_user(user_id: int, code: str) -> bool:
     """Verify code submitted by user through bot - code is the key"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         # Look up by code itself
         async with db.execute("SELECT code FROM verification_codes WHERE phone = ?", (f"code_{code}",)) as cursor:
             row = await cursor.fetchone()
@@ -729,20 +608,20 @@ async def verify_code_by_user(user_id: int, code: str) -> bool:
 
 async def is_code_verified(code: str) -> bool:
     """Check if code has been verified via bot"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         async with db.execute("SELECT 1 FROM verification_codes WHERE phone = ?", (f"verified_{code}",)) as cursor:
             row = await cursor.fetchone()
             return row is not None
 
 async def is_user_verified(user_id: int) -> bool:
     """Check if user completed verification"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         async with db.execute("SELECT status FROM users WHERE telegram_id = ?", (user_id,)) as cursor:
             row = await cursor.fetchone()
             return row and row[0] == 'verified'
 
 async def update_user_profile(telegram_id: int, phone: str, username: str, name: str = None):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("""
             UPDATE users 
             SET phone = ?, username = ?, display_name = COALESCE(?, display_name) 
@@ -751,7 +630,7 @@ async def update_user_profile(telegram_id: int, phone: str, username: str, name:
         await db.commit()
 
 async def create_category(name: str, created_by: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         try:
             await db.execute("INSERT INTO categories (name, created_by) VALUES (?, ?)", (name, created_by))
             await db.commit()
@@ -760,30 +639,39 @@ async def create_category(name: str, created_by: int):
             return False
 
 async def get_categories():
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute("SELECT name FROM categories ORDER BY created_at DESC") as cursor:
             return [row['name'] for row in await cursor.fetchall()]
 
+_USER_ORDER_COUNT_SQL = _hot("get_user_stats", "SELECT COUNT(*) FROM orders WHERE user_id = ? AND status = ?", (1, "active"))
+
 async def get_user_stats(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT COUNT(*) FROM orders WHERE user_id = ? AND status = 'active'", (user_id,)) as cursor:
+    async with pool.read() as db:
+        async with db.execute(_USER_ORDER_COUNT_SQL, (user_id, "active")) as cursor:
             active = (await cursor.fetchone())[0]
-        
-        async with db.execute("SELECT COUNT(*) FROM orders WHERE user_id = ? AND status = 'closed'", (user_id,)) as cursor:
+
+        async with db.execute(_USER_ORDER_COUNT_SQL, (user_id, "closed")) as cursor:
             completed = (await cursor.fetchone())[0]
             
         return {'active': active, 'completed': completed}
 
-async def get_user_market_posts(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM market_posts WHERE user_id = ? ORDER BY created_at DESC", (user_id,)) as cursor:
-            return [dict(row) for row in await cursor.fetchall()]
+_USER_MARKET_POSTS_SQL = _hot_paged("get_user_market_posts", f"""
+    SELECT {MARKET_POST_SUMMARY_COLUMNS} FROM market_posts
+    WHERE user_id = ? AND {{page}}
+    ORDER BY created_at DESC, id DESC
+    LIMIT ?
+""", (1,))
+
+async def get_user_market_posts(user_id: int, limit: int = -1, before: tuple = None):
+    page, page_params = _keyset(before)
+    async with pool.read() as db:
+        rows = await _fetch_dicts(db, _USER_MARKET_POSTS_SQL.format(page=page), (user_id, *page_params, limit))
+    return [_market_post(row) for row in rows]
 
 async def get_market_post(post_id: int):
     """Get single market post by ID with author info"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute("""
             SELECT mp.*, u.username as author_username, u.display_name as author_name
@@ -792,10 +680,10 @@ async def get_market_post(post_id: int):
             WHERE mp.id = ?
         """, (post_id,)) as cursor:
             row = await cursor.fetchone()
-            return dict(row) if row else None
+            return _market_post(row) if row else None
 
-async def update_market_post(post_id: int, user_id: int, amount: float, rate: float, description: str, p_type: str = None, currency: str = None, location: str = None, category: str = None, image_data: str = None):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def update_market_post(post_id: int, user_id: int, amount: float, rate: float, description: str, p_type: str = None, currency: str = None, location: str = None, category: str = None, image_key: str = None):
+    async with pool.write() as db:
         # Construct query dynamically based on provided fields
         fields = []
         values = []
@@ -820,9 +708,10 @@ async def update_market_post(post_id: int, user_id: int, amount: float, rate: fl
         if category is not None:
             fields.append("category = ?")
             values.append(category)
-        if image_data is not None:
-            fields.append("image_data = ?")
-            values.append(image_data)
+        if image_key is not None:
+            fields.append("image_key = ?")
+            values.append(image_key)
+            fields.append("image_data = NULL")
         
         if not fields:
             return
@@ -835,7 +724,7 @@ async def update_market_post(post_id: int, user_id: int, amount: float, rate: fl
         await db.commit()
 
 async def delete_market_post(post_id: int, user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("DELETE FROM market_posts WHERE id = ? AND user_id = ?", (post_id, user_id))
         await db.commit()
 
@@ -859,7 +748,7 @@ def generate_alpha_code(length: int = 7) -> str:
 
 async def get_user_by_telegram_id(telegram_id: int) -> dict:
     """Get user account by telegram_id (for Bot-First flow)"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute(
             "SELECT * FROM web_accounts WHERE telegram_id = ?",
@@ -887,7 +776,7 @@ async def register_user_via_bot(telegram_id: int, nickname: str, password: str,
     
     password_hash = hash_password(password)
     
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         # Create web account with telegram_id pre-linked
         cursor = await db.execute(
             """INSERT INTO web_accounts (nickname, name, password_hash, telegram_id, role) 
@@ -915,7 +804,7 @@ async def register_user_via_bot(telegram_id: int, nickname: str, password: str,
 
 async def get_telegram_id_by_account(account_id: int) -> int:
     """Get telegram_id linked to a web account (for Become Seller 2FA)"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         cursor = await db.execute(
             "SELECT telegram_id FROM web_accounts WHERE id = ?",
             (account_id,)
@@ -925,7 +814,7 @@ async def get_telegram_id_by_account(account_id: int) -> int:
 
 
 async def check_nickname_exists(nickname: str) -> bool:
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         cursor = await db.execute("SELECT id FROM web_accounts WHERE LOWER(nickname) = LOWER(?)", (nickname,))
         row = await cursor.fetchone()
         return row is not None
@@ -937,7 +826,7 @@ async def register_web_account(nickname: str, name: str, password: str) -> dict:
     
     password_hash = hash_password(password)
     
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         cursor = await db.execute(
             "INSERT INTO web_accounts (nickname, name, password_hash) VALUES (?, ?, ?)",
             (nickname, name, password_hash)
@@ -964,7 +853,7 @@ async def login_web_account(nickname: str, password: str) -> dict:
     """Login with nickname and password"""
     password_hash = hash_password(password)
     
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute(
             "SELECT * FROM web_accounts WHERE LOWER(nickname) = LOWER(?) AND password_hash = ?",
@@ -989,21 +878,20 @@ async def login_web_account(nickname: str, password: str) -> dict:
 
 async def update_avatar(account_id: int, avatar_url: str):
     """Update avatar URL for account"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute(
             "UPDATE web_accounts SET avatar_url = ? WHERE id = ?",
             (avatar_url, account_id)
         )
         await db.commit()
 
+_WEB_ACCOUNT_BY_TG_SQL = _hot("get_web_account_by_telegram_id", "SELECT * FROM web_accounts WHERE telegram_id = ?", (1,))
+
 async def get_web_account_by_telegram_id(telegram_id: int):
     """Get web account by telegram ID"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
-            "SELECT * FROM web_accounts WHERE telegram_id = ?",
-            (telegram_id,)
-        )
+        cursor = await db.execute(_WEB_ACCOUNT_BY_TG_SQL, (telegram_id,))
         row = await cursor.fetchone()
         return dict(row) if row else None
 
@@ -1013,7 +901,7 @@ async def get_user_reviews(user_id: int):
 
 async def verify_code_from_bot(code: str, telegram_id: int, phone: str) -> dict:
     """Bot verifies the code and links Telegram account"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         # Find the code
         cursor = await db.execute(
             "SELECT id, account_id FROM web_verification_codes WHERE code = ? AND verified = 0",
@@ -1043,7 +931,7 @@ async def verify_code_from_bot(code: str, telegram_id: int, phone: str) -> dict:
 
 async def check_code_verified(code: str) -> dict:
     """Check if verification code was verified by bot"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute(
             """SELECT wv.verified, wv.telegram_id, wv.phone, wa.nickname, wa.name, wa.role 
@@ -1068,7 +956,7 @@ async def check_code_verified(code: str) -> dict:
         return {"verified": False}
 
 async def get_account_by_id(account_id: int) -> dict:
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("SELECT * FROM web_accounts WHERE id = ?", (account_id,))
         row = await cursor.fetchone()
@@ -1081,7 +969,7 @@ async def get_account_by_id(account_id: int) -> dict:
 async def generate_seller_code(telegram_id: int) -> str:
     """Generate alphabetic code for seller verification"""
     code = generate_alpha_code(7)
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute(
             "INSERT INTO seller_codes (telegram_id, code) VALUES (?, ?)",
             (telegram_id, code)
@@ -1094,7 +982,7 @@ async def verify_seller_code(code: str, account_id: int = None, telegram_id: int
     import logging
     logging.info(f"verify_seller_code called: code={code}, account_id={account_id}, telegram_id={telegram_id}")
     
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         # Find unused code (don't check telegram_id match - user might use different device)
         cursor = await db.execute(
             "SELECT id, telegram_id FROM seller_codes WHERE LOWER(code) = LOWER(?) AND used = 0",
@@ -1136,7 +1024,7 @@ async def verify_seller_code(code: str, account_id: int = None, telegram_id: int
 async def generate_bot_verification_code(telegram_id: int, phone: str) -> str:
     """Bot generates code and sends to user. User will enter this on website."""
     code = generate_numeric_code(6)
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         # Store the code
         await db.execute(
             "INSERT OR REPLACE INTO bot_verification_codes (telegram_id, phone, code, created_at) VALUES (?, ?, ?, datetime('now'))",
@@ -1147,7 +1035,7 @@ async def generate_bot_verification_code(telegram_id: int, phone: str) -> str:
 
 async def verify_bot_code(code: str, account_id: int = None) -> dict:
     """User enters code on website. Link phone to account."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         cursor = await db.execute(
             "SELECT telegram_id, phone FROM bot_verification_codes WHERE code = ? AND used = 0",
             (code,)
@@ -1174,7 +1062,7 @@ async def verify_bot_code(code: str, account_id: int = None) -> dict:
 
 async def is_phone_registered(phone: str) -> bool:
     """Check if phone number is already registered"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         # Clean phone number
         clean_phone = phone.replace('+', '').replace(' ', '').replace('-', '')
         cursor = await db.execute(
@@ -1188,7 +1076,7 @@ async def is_phone_registered(phone: str) -> bool:
 
 async def delete_all_posts():
     """Admin function to clear all market posts"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("DELETE FROM market_posts")
         await db.commit()
         cursor = await db.execute("SELECT changes()")
@@ -1199,35 +1087,37 @@ async def delete_all_posts():
 
 async def add_review(from_user_id: int, to_user_id: int, rating: int, comment: str = None, post_id: int = None, deal_id: int = None):
     """Add a review for a user"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute(
             "INSERT INTO reviews (from_user_id, to_user_id, rating, comment, post_id, deal_id) VALUES (?, ?, ?, ?, ?, ?)",
             (from_user_id, to_user_id, rating, comment, post_id, deal_id)
         )
         await db.commit()
 
+_USER_REVIEWS_SQL = _hot("get_user_reviews", """
+    SELECT r.*, wa.nickname as from_nickname, wa.name as from_name
+    FROM reviews r
+    LEFT JOIN web_accounts wa ON r.from_user_id = wa.id
+    WHERE r.to_user_id = ?
+    ORDER BY r.created_at DESC
+""", (1,))
+
 async def get_user_reviews(user_id: int):
     """Get all reviews for a user"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
-            """SELECT r.*, wa.nickname as from_nickname, wa.name as from_name 
-               FROM reviews r 
-               LEFT JOIN web_accounts wa ON r.from_user_id = wa.id 
-               WHERE r.to_user_id = ? 
-               ORDER BY r.created_at DESC""",
-            (user_id,)
-        )
+        cursor = await db.execute(_USER_REVIEWS_SQL, (user_id,))
         rows = await cursor.fetchall()
         return [dict(row) for row in rows]
 
+_USER_RATING_SQL = _hot(
+    "get_user_rating", "SELECT AVG(rating) as avg_rating, COUNT(*) as count FROM reviews WHERE to_user_id = ?", (1,)
+)
+
 async def get_user_rating(user_id: int) -> dict:
     """Get average rating and count for user"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute(
-            "SELECT AVG(rating) as avg_rating, COUNT(*) as count FROM reviews WHERE to_user_id = ?",
-            (user_id,)
-        )
+    async with pool.read() as db:
+        cursor = await db.execute(_USER_RATING_SQL, (user_id,))
         row = await cursor.fetchone()
         return {"rating": row[0] or 5.0, "count": row[1] or 0}
 
@@ -1235,7 +1125,7 @@ async def get_user_rating(user_id: int) -> dict:
 
 async def get_public_profile(user_id: int) -> dict:
     """Get public profile data for a user"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute(
             "SELECT id, nickname, name, role, avatar_url, created_at FROM web_accounts WHERE id = ?",
@@ -1244,20 +1134,19 @@ async def get_public_profile(user_id: int) -> dict:
         row = await cursor.fetchone()
         if not row:
             return None
-        
+
         profile = dict(row)
-        
-        # Get rating
-        rating_data = await get_user_rating(user_id)
-        profile['rating'] = rating_data['rating']
-        profile['review_count'] = rating_data['count']
-        
-        return profile
+
+    # Get rating (outside the block so we don't hold two pool connections at once)
+    rating_data = await get_user_rating(user_id)
+    profile['rating'] = rating_data['rating']
+    profile['review_count'] = rating_data['count']
+
+    return profile
 
 async def get_user_posts(user_id: int):
     """Get all posts by a user"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with pool.read() as db:
         # Try to get by web account id first
         cursor = await db.execute(
             "SELECT telegram_id FROM web_accounts WHERE id = ?",
@@ -1266,16 +1155,16 @@ async def get_user_posts(user_id: int):
         row = await cursor.fetchone()
         telegram_id = row[0] if row else user_id
         
-        cursor = await db.execute(
-            "SELECT * FROM market_posts WHERE user_id = ? ORDER BY created_at DESC",
+        rows = await _fetch_dicts(
+            db,
+            f"SELECT {MARKET_POST_SUMMARY_COLUMNS} FROM market_posts WHERE user_id = ? ORDER BY created_at DESC",
             (telegram_id,)
         )
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
+    return [_market_post(row) for row in rows]
 
 async def update_avatar(user_id: int, avatar_url: str):
     """Update user avatar"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute(
             "UPDATE web_accounts SET avatar_url = ? WHERE id = ?",
             (avatar_url, user_id)
@@ -1286,7 +1175,7 @@ async def update_avatar(user_id: int, avatar_url: str):
 
 async def create_deal(client_id: int, exchanger_id: int, rate: str, location: str, request_id: int = None, offer_id: int = None):
     """Create a new deal"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         cursor = await db.execute(
             "INSERT INTO deals (client_id, exchanger_id, rate, location, request_id, offer_id, status) VALUES (?, ?, ?, ?, ?, ?, 'confirmed')",
             (client_id, exchanger_id, rate, location, request_id, offer_id)
@@ -1297,7 +1186,7 @@ async def create_deal(client_id: int, exchanger_id: int, rate: str, location: st
 
 async def get_deal(deal_id: int):
     """Get deal by ID"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("SELECT * FROM deals WHERE id = ?", (deal_id,))
         row = await cursor.fetchone()
@@ -1305,7 +1194,7 @@ async def get_deal(deal_id: int):
 
 async def mark_ticket_sent(deal_id: int):
     """Mark that ticket was sent for deal"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("UPDATE deals SET ticket_sent = 1 WHERE id = ?", (deal_id,))
         await db.commit()
 
@@ -1318,7 +1207,7 @@ async def generate_seller_code(telegram_id: int) -> str:
     # Generate 7-character alphabetic code
     code = ''.join(random.choices(string.ascii_uppercase, k=7))
     
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         # Delete old codes for this user
         await db.execute("DELETE FROM seller_codes WHERE telegram_id = ?", (telegram_id,))
         # Insert new code
@@ -1329,3 +1218,294 @@ async def generate_seller_code(telegram_id: int) -> str:
         await db.commit()
     
     return code
+
+
+# ============= BROADCAST JOBS =============
+
+async def create_broadcast_job(admin_id: int, text: str) -> int:
+    """Создать рассылку и зафиксировать список получателей (без заблокировавших бота)."""
+    async with pool.write() as db:
+        cursor = await db.execute(
+            "INSERT INTO broadcast_jobs (admin_id, text) VALUES (?, ?)",
+            (admin_id, text)
+        )
+        job_id = cursor.lastrowid
+        cursor = await db.execute("""
+            INSERT INTO broadcast_recipients (job_id, position, telegram_id)
+            SELECT ?, ROW_NUMBER() OVER (ORDER BY telegram_id), telegram_id
+            FROM users
+            WHERE telegram_id IS NOT NULL AND bot_blocked_at IS NULL
+        """, (job_id,))
+        await db.execute("UPDATE broadcast_jobs SET total = ? WHERE id = ?", (cursor.rowcount, job_id))
+        await db.commit()
+        return job_id
+
+async def get_broadcast_job(job_id: int):
+    async with pool.read() as db:
+        rows = await _fetch_dicts(db, "SELECT * FROM broadcast_jobs WHERE id = ?", (job_id,))
+    return rows[0] if rows else None
+
+async def get_running_broadcast_jobs():
+    async with pool.read() as db:
+        return await _fetch_dicts(db, "SELECT * FROM broadcast_jobs WHERE status = 'running' ORDER BY id")
+
+async def set_broadcast_progress_message(job_id: int, message_id: int):
+    async with pool.write() as db:
+        await db.execute("UPDATE broadcast_jobs SET progress_message_id = ? WHERE id = ?", (message_id, job_id))
+        await db.commit()
+
+_BROADCAST_BATCH_SQL = _hot("get_broadcast_batch", """
+    SELECT position, telegram_id FROM broadcast_recipients
+    WHERE job_id = ? AND position > ? AND status = 'pending'
+    ORDER BY position
+    LIMIT ?
+""", (1, 0, 100))
+
+async def get_broadcast_batch(job_id: int, after_position: int, limit: int):
+    """Следующие необработанные получатели после курсора: [(position, telegram_id)]."""
+    async with pool.read() as db:
+        async with db.execute(_BROADCAST_BATCH_SQL, (job_id, after_position, limit)) as cursor:
+            return await cursor.fetchall()
+
+async def save_broadcast_results(job_id: int, results: list, cursor: int):
+    """
+    results — [(position, telegram_id, status, error)].
+    Статусы получателей, счётчики и курсор пишутся одной транзакцией;
+    заблокировавшие бота помечаются в users.
+    """
+    counts = {'sent': 0, 'failed': 0, 'blocked': 0}
+    for _, _, status, _ in results:
+        counts[status] += 1
+    blocked = [(telegram_id,) for _, telegram_id, status, _ in results if status == 'blocked']
+
+    async with pool.write() as db:
+        await db.executemany(
+            "UPDATE broadcast_recipients SET status = ?, error = ? WHERE job_id = ? AND position = ?",
+            [(status, error, job_id, position) for position, _, status, error in results]
+        )
+        await db.execute("""
+            UPDATE broadcast_jobs
+            SET sent = sent + ?, failed = failed + ?, blocked = blocked + ?, cursor = MAX(cursor, ?)
+            WHERE id = ?
+        """, (counts['sent'], counts['failed'], counts['blocked'], cursor, job_id))
+        if blocked:
+            await db.executemany(
+                "UPDATE users SET bot_blocked_at = CURRENT_TIMESTAMP WHERE telegram_id = ?",
+                blocked
+            )
+        await db.commit()
+
+async def finish_broadcast_job(job_id: int, status: str = 'done'):
+    async with pool.write() as db:
+        await db.execute(
+            "UPDATE broadcast_jobs SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (status, job_id)
+        )
+        await db.commit()
+
+async def get_broadcast_breakdown(job_id: int) -> dict:
+    """Причины неудач: {'blocked': 12, 'chat_not_found': 3, ...}."""
+    async with pool.read() as db:
+        async with db.execute("""
+            SELECT COALESCE(error, status), COUNT(*) FROM broadcast_recipients
+            WHERE job_id = ? AND status IN ('failed', 'blocked')
+            GROUP BY 1
+        """, (job_id,)) as cursor:
+            return {reason: count for reason, count in await cursor.fetchall()}
+
+
+# ============= RATE HISTORY =============
+
+# Разрешения агрегатов: имя -> длина корзины в секундах
+RATE_RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+
+_ROLLUP_UPSERT = """
+    INSERT INTO rate_rollups (source, pair, resolution, bucket, open, high, low, close, sum, count, open_ts, close_ts)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?)
+    ON CONFLICT (source, pair, resolution, bucket) DO UPDATE SET
+        open = CASE WHEN excluded.open_ts < open_ts THEN excluded.open ELSE open END,
+        open_ts = MIN(open_ts, excluded.open_ts),
+        close = CASE WHEN excluded.close_ts >= close_ts THEN excluded.close ELSE close END,
+        close_ts = MAX(close_ts, excluded.close_ts),
+        high = MAX(high, excluded.high),
+        low = MIN(low, excluded.low),
+        sum = sum + excluded.sum,
+        count = count + 1
+"""
+
+async def add_rate_points(points: list):
+    """
+    points — [(source, pair, ts, value)].
+    Сырые точки и агрегаты всех разрешений пишутся одной транзакцией.
+    """
+    points = [p for p in points if p[3] is not None]
+    if points:
+        await write_queue.submit_many(_rate_point_statements(points))
+
+def _rate_point_statements(points: list) -> list:
+    """[(sql, [params])] для write_queue.submit_many: сырые точки + upsert агрегатов."""
+    rollups = [
+        (source, pair, name, ts - ts % size, value, value, value, value, value, ts, ts)
+        for source, pair, ts, value in points
+        for name, size in RATE_RESOLUTIONS.items()
+    ]
+    return [
+        ("INSERT INTO rate_points (source, pair, ts, value) VALUES (?, ?, ?, ?)", points),
+        (_ROLLUP_UPSERT, rollups),
+    ]
+
+_RATE_POINTS_SQL = _hot("get_rate_history (raw)", """
+    SELECT ts, value FROM rate_points
+    WHERE source = ? AND pair = ? AND ts >= ? AND ts < ?
+    ORDER BY ts
+    LIMIT ?
+""", ("street", "USD/UZS", 0, 1, 100))
+_RATE_ROLLUPS_SQL = _hot("get_rate_history", """
+    SELECT bucket AS ts, open, high, low, close, sum / count AS avg, count
+    FROM rate_rollups
+    WHERE source = ? AND pair = ? AND resolution = ? AND bucket >= ? AND bucket < ?
+    ORDER BY bucket
+    LIMIT ?
+""", ("street", "USD/UZS", "1h", 0, 1, 100))
+
+async def get_rate_history(source: str, pair: str, resolution: str, start: int, end: int, limit: int = 1000):
+    """
+    Ряд за [start, end). resolution: 'raw' | '1m' | '1h' | '1d'.
+    Для агрегатов — {ts, open, high, low, close, avg, count}, для raw — {ts, value}.
+    """
+    async with pool.read() as db:
+        if resolution == "raw":
+            return await _fetch_dicts(db, _RATE_POINTS_SQL, (source, pair, start, end, limit))
+        return await _fetch_dicts(db, _RATE_ROLLUPS_SQL, (source, pair, resolution, start, end, limit))
+
+async def get_rate_series():
+    """Какие ряды вообще есть: [{source, pair, last_ts}] (по дневным агрегатам)."""
+    async with pool.read() as db:
+        return await _fetch_dicts(db, """
+            SELECT source, pair, MAX(close_ts) AS last_ts
+            FROM rate_rollups
+            WHERE resolution = '1d'
+            GROUP BY source, pair
+            ORDER BY source, pair
+        """)
+
+async def prune_rate_history(retention: dict) -> int:
+    """
+    retention — {'raw' | '1m' | '1h' | '1d': секунды хранения}; 0 или отсутствие — хранить всегда.
+    Возвращает число удалённых строк.
+    """
+    now = int(time.time())
+    deleted = 0
+    async with pool.write() as db:
+        if retention.get("raw"):
+            cursor = await db.execute("DELETE FROM rate_points WHERE ts < ?", (now - retention["raw"],))
+            deleted += cursor.rowcount
+        for name in RATE_RESOLUTIONS:
+            if retention.get(name):
+                cursor = await db.execute(
+                    "DELETE FROM rate_rollups WHERE resolution = ? AND bucket < ?",
+                    (name, now - retention[name])
+                )
+                deleted += cursor.rowcount
+        await db.commit()
+    return deleted
+
+
+# ============= STREET RATE INGESTION =============
+
+async def get_rate_ingest_chats():
+    """
+    Отслеживаемые чаты, которые можно читать userbot-клиентом владельца:
+    [{chat_id, chat_title, user_id, session_string, last_message_id}] — по одной строке на чат.
+    """
+    async with pool.read() as db:
+        rows = await _fetch_dicts(db, """
+            SELECT m.chat_id, m.chat_title, u.telegram_id AS user_id, u.session_string,
+                   COALESCE(s.last_message_id, 0) AS last_message_id
+            FROM monitored_chats m
+            JOIN users u ON u.telegram_id = m.user_id
+            LEFT JOIN rate_ingest_chats s ON s.chat_id = m.chat_id
+            WHERE u.session_string IS NOT NULL AND u.status = 'active'
+            ORDER BY m.chat_id, m.id
+        """)
+    chats = {}
+    for row in rows:
+        chats.setdefault(row["chat_id"], row)  # чат у нескольких владельцев читаем один раз
+    return list(chats.values())
+
+async def save_rate_ingest_progress(progress: list):
+    """
+    progress — [(chat_id, chat_title, last_message_id, messages, rated_messages, rates, skipped, last_rate_at)],
+    счётчики прибавляются к сохранённым.
+    """
+    if not progress:
+        return
+    async with pool.write() as db:
+        await db.executemany("""
+            INSERT INTO rate_ingest_chats
+                (chat_id, chat_title, last_message_id, messages, rated_messages, rates, skipped, last_rate_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (chat_id) DO UPDATE SET
+                chat_title = COALESCE(excluded.chat_title, chat_title),
+                last_message_id = MAX(last_message_id, excluded.last_message_id),
+                messages = messages + excluded.messages,
+                rated_messages = rated_messages + excluded.rated_messages,
+                rates = rates + excluded.rates,
+                skipped = skipped + excluded.skipped,
+                last_rate_at = COALESCE(MAX(last_rate_at, excluded.last_rate_at), last_rate_at, excluded.last_rate_at),
+                updated_at = CURRENT_TIMESTAMP
+        """, progress)
+        await db.commit()
+
+async def get_rate_ingest_stats(limit: int = 20):
+    """Чаты-источники по числу найденных курсов."""
+    async with pool.read() as db:
+        return await _fetch_dicts(db, """
+            SELECT chat_id, chat_title, messages, rated_messages, rates, skipped, last_rate_at
+            FROM rate_ingest_chats
+            ORDER BY rates DESC, messages DESC
+            LIMIT ?
+        """, (limit,))
+
+
+# ============= UPLOADED MEDIA CACHE =============
+
+async def get_uploaded_media(account_id: int, template_id: int, file_key: str) -> str | None:
+    async with pool.read() as db:
+        async with db.execute("""
+            SELECT file_id FROM media_uploads
+            WHERE account_id = ? AND template_id = ? AND file_key = ?
+        """, (account_id, template_id, file_key)) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+async def save_uploaded_media(account_id: int, template_id: int, file_key: str, media_type: str, file_id: str):
+    async with pool.write() as db:
+        # старые загрузки этого шаблона (медиа сменилось) больше не нужны
+        await db.execute("""
+            DELETE FROM media_uploads WHERE account_id = ? AND template_id = ? AND file_key != ?
+        """, (account_id, template_id, file_key))
+        await db.execute("""
+            INSERT INTO media_uploads (account_id, template_id, file_key, media_type, file_id)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (account_id, template_id, file_key) DO UPDATE SET
+                file_id = excluded.file_id,
+                media_type = excluded.media_type,
+                created_at = CURRENT_TIMESTAMP
+        """, (account_id, template_id, file_key, media_type, file_id))
+        await db.commit()
+
+async def touch_uploaded_media(account_id: int, template_id: int, file_key: str, uses: int):
+    await write_queue.submit("""
+        UPDATE media_uploads SET uses = uses + ?, last_used_at = CURRENT_TIMESTAMP
+        WHERE account_id = ? AND template_id = ? AND file_key = ?
+    """, (uses, account_id, template_id, file_key))
+
+async def invalidate_uploaded_media(account_id: int, template_id: int):
+    """Telegram отверг сохранённый file_id — при следующей отправке файл загрузится заново."""
+    async with pool.write() as db:
+        await db.execute(
+            "DELETE FROM media_uploads WHERE account_id = ? AND template_id = ?",
+            (account_id, template_id)
+        )
+        await db.commit()
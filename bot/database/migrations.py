@@ -0,0 +1,542 @@
+import logging
+import sqlite3
+
+# Вторичные индексы для горячих запросов: (имя, таблица, колонки)
+INDEXES = [
+    ("idx_orders_status_created", "orders", "status, created_at"),
+    ("idx_orders_user_created", "orders", "user_id, created_at"),
+    ("idx_bids_order", "bids", "order_id"),
+    ("idx_bids_exchanger_status", "bids", "exchanger_id, status"),
+    ("idx_market_posts_created", "market_posts", "created_at"),
+    ("idx_market_posts_user_created", "market_posts", "user_id, created_at"),
+    ("idx_monitored_chats_user", "monitored_chats", "user_id"),
+    ("idx_scheduled_tasks_active", "scheduled_tasks", "is_active"),
+    ("idx_web_accounts_telegram", "web_accounts", "telegram_id"),
+    ("idx_web_accounts_role", "web_accounts", "role, telegram_id"),
+    ("idx_users_role", "users", "role"),
+    ("idx_reviews_to_user", "reviews", "to_user_id"),
+    ("idx_market_rates_ts_pair", "market_rates", "timestamp, currency_pair"),
+]
+
+
+async def _ensure_column(db, table: str, column: str, definition: str):
+    """Добавить колонку, если её ещё нет (для баз, созданных до миграций)."""
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        cols = [row[1] for row in await cursor.fetchall()]
+    if column not in cols:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+async def _m001_base_schema(db):
+    """Базовая схема. Идемпотентна: старые базы без schema_version догоняются через _ensure_column."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE,
+            username TEXT,
+            language TEXT,
+            session_string TEXT,
+            status TEXT DEFAULT 'active',
+            phone TEXT,
+            role TEXT DEFAULT 'client',
+            rating REAL DEFAULT 5.0,
+            deals_count INTEGER DEFAULT 0
+        )
+    """)
+    await _ensure_column(db, "users", "display_name", "TEXT")
+    await _ensure_column(db, "users", "username", "TEXT")
+    await _ensure_column(db, "users", "role", "TEXT DEFAULT 'client'")
+    await _ensure_column(db, "users", "rating", "REAL DEFAULT 5.0")
+    await _ensure_column(db, "users", "deals_count", "INTEGER DEFAULT 0")
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS verification_codes (
+            phone TEXT PRIMARY KEY,
+            code TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            content TEXT,
+            media_type TEXT,
+            caption TEXT,
+            entities TEXT,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+    await _ensure_column(db, "templates", "caption", "TEXT")
+    await _ensure_column(db, "templates", "entities", "TEXT")
+    await _ensure_column(db, "templates", "name", "TEXT")
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS scheduled_tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            template_id INTEGER,
+            target_groups TEXT, -- JSON list of group IDs
+            run_time TEXT,
+            start_time TEXT,
+            end_time TEXT,
+            interval_minutes INTEGER,
+            last_run TIMESTAMP,
+            is_active BOOLEAN DEFAULT 1,
+            FOREIGN KEY(user_id) REFERENCES users(id),
+            FOREIGN KEY(template_id) REFERENCES templates(id)
+        )
+    """)
+    await _ensure_column(db, "scheduled_tasks", "start_time", "TEXT")
+    await _ensure_column(db, "scheduled_tasks", "end_time", "TEXT")
+    await _ensure_column(db, "scheduled_tasks", "interval_minutes", "INTEGER")
+    await _ensure_column(db, "scheduled_tasks", "last_run", "TIMESTAMP")
+    await _ensure_column(db, "scheduled_tasks", "is_active", "BOOLEAN DEFAULT 1")
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS market_rates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            currency_pair TEXT,
+            rate_buy REAL,
+            rate_sell REAL,
+            source_group TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS monitored_chats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            chat_id INTEGER,
+            chat_title TEXT,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS spam_settings (
+            chat_id INTEGER PRIMARY KEY,
+            block_links BOOLEAN DEFAULT 0,
+            block_keywords TEXT DEFAULT '', -- comma separated
+            flood_max_msgs INTEGER DEFAULT 0, -- 0 = disabled
+            flood_window INTEGER DEFAULT 60, -- seconds
+            flood_mute_time INTEGER DEFAULT 300, -- seconds
+            action TEXT DEFAULT 'ban'
+        )
+    """)
+    await _ensure_column(db, "spam_settings", "flood_max_msgs", "INTEGER DEFAULT 0")
+    await _ensure_column(db, "spam_settings", "flood_window", "INTEGER DEFAULT 60")
+    await _ensure_column(db, "spam_settings", "flood_mute_time", "INTEGER DEFAULT 300")
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS banned_users (
+            user_id INTEGER,
+            chat_id INTEGER,
+            attempts_left INTEGER DEFAULT 2,
+            correct_answer INTEGER,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, chat_id)
+        )
+    """)
+
+    # P2P Exchange Tables
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount REAL,
+            currency TEXT,
+            location TEXT,
+            delivery_type TEXT, -- 'delivery' or 'pickup'
+            status TEXT DEFAULT 'active', -- 'active', 'closed'
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(telegram_id)
+        )
+    """)
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS bids (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER,
+            exchanger_id INTEGER,
+            rate REAL,
+            time_estimate TEXT,
+            comment TEXT,
+            status TEXT DEFAULT 'pending', -- 'pending', 'accepted', 'rejected'
+            message_id INTEGER, -- Telegram message ID for smart deletion
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(order_id) REFERENCES orders(id),
+            FOREIGN KEY(exchanger_id) REFERENCES users(telegram_id)
+        )
+    """)
+    await _ensure_column(db, "bids", "status", "TEXT DEFAULT 'pending'")
+    await _ensure_column(db, "bids", "message_id", "INTEGER")
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS market_posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            type TEXT, -- 'buy' or 'sell'
+            amount REAL,
+            currency TEXT,
+            rate REAL,
+            location TEXT,
+            description TEXT,
+            image_data TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(telegram_id)
+        )
+    """)
+    await _ensure_column(db, "market_posts", "image_data", "TEXT")
+    await _ensure_column(db, "market_posts", "category", "TEXT")
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE,
+            created_by INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Web accounts for login/password auth
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS web_accounts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nickname TEXT UNIQUE NOT NULL,
+            name TEXT,
+            password_hash TEXT NOT NULL,
+            telegram_id INTEGER,
+            phone TEXT,
+            role TEXT DEFAULT 'client',
+            is_seller_verified INTEGER DEFAULT 0,
+            avatar_url TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await _ensure_column(db, "web_accounts", "avatar_url", "TEXT")
+
+    # Verification codes for web-to-bot linking
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS web_verification_codes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_id INTEGER,
+            code TEXT NOT NULL,
+            verified INTEGER DEFAULT 0,
+            telegram_id INTEGER,
+            phone TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(account_id) REFERENCES web_accounts(id)
+        )
+    """)
+
+    # Seller verification codes (alphabetic)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS seller_codes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER,
+            code TEXT NOT NULL,
+            used INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Bot verification codes (bot sends to user, user enters on site)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS bot_verification_codes (
+            telegram_id INTEGER PRIMARY KEY,
+            phone TEXT NOT NULL,
+            code TEXT NOT NULL,
+            used INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS reviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_user_id INTEGER NOT NULL,
+            to_user_id INTEGER NOT NULL,
+            post_id INTEGER,
+            deal_id INTEGER,
+            rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),
+            comment TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(from_user_id) REFERENCES web_accounts(id),
+            FOREIGN KEY(to_user_id) REFERENCES web_accounts(id)
+        )
+    """)
+
+    # Deals table (completed exchanges)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS deals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            request_id INTEGER,
+            offer_id INTEGER,
+            client_id INTEGER NOT NULL,
+            exchanger_id INTEGER NOT NULL,
+            rate TEXT,
+            location TEXT,
+            status TEXT DEFAULT 'pending',
+            ticket_sent INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+async def _m002_indexes(db):
+    for name, table, columns in INDEXES:
+        await db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+async def _m003_market_post_images(db):
+    """Картинки объявлений переезжают из market_posts.image_data в файловое хранилище."""
+    from bot.services.media_store import save_data_url, MediaError
+
+    await _ensure_column(db, "market_posts", "image_key", "TEXT")
+    async with db.execute(
+        "SELECT id, image_data FROM market_posts WHERE image_data IS NOT NULL AND image_data != ''"
+    ) as cursor:
+        rows = await cursor.fetchall()
+
+    moved = 0
+    for post_id, image_data in rows:
+        try:
+            key = save_data_url(image_data)
+        except MediaError as e:
+            logging.warning(f"Post {post_id}: image left in place ({e})")
+            continue
+        await db.execute(
+            "UPDATE market_posts SET image_key = ?, image_data = NULL WHERE id = ?",
+            (key, post_id)
+        )
+        moved += 1
+    if rows:
+        logging.info(f"Moved {moved}/{len(rows)} post images to the media store")
+
+
+async def _m004_bids_keyset_index(db):
+    # /api/bids/my листается по (created_at, id) внутри exchanger_id
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bids_exchanger_created ON bids (exchanger_id, created_at)")
+
+
+async def _m005_broadcast_jobs(db):
+    # пользователи, заблокировавшие бота: рассылки их пропускают, /start снимает отметку
+    await _ensure_column(db, "users", "bot_blocked_at", "DATETIME")
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            progress_message_id INTEGER, -- сообщение админу, которое обновляется по ходу
+            text TEXT,
+            status TEXT DEFAULT 'running', -- 'running', 'done', 'cancelled'
+            total INTEGER DEFAULT 0,
+            cursor INTEGER DEFAULT 0, -- все получатели с position <= cursor уже обработаны
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            blocked INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            job_id INTEGER,
+            position INTEGER,
+            telegram_id INTEGER,
+            status TEXT DEFAULT 'pending', -- 'pending', 'sent', 'failed', 'blocked'
+            error TEXT, -- категория ошибки для сводки
+            PRIMARY KEY (job_id, position)
+        ) WITHOUT ROWID
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status)")
+
+
+async def _m006_rate_history(db):
+    # сырые точки курсов из всех источников; ts — unix-время в секундах (UTC)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS rate_points (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT, -- 'fastforex', 'binance_p2p_buy', 'binance_p2p_sell', 'street'
+            pair TEXT,
+            ts INTEGER,
+            value REAL
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_rate_points_series ON rate_points (source, pair, ts)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_rate_points_ts ON rate_points (ts)")
+
+    # агрегаты по корзинам '1m' / '1h' / '1d', обновляются при каждой записи точки
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS rate_rollups (
+            source TEXT,
+            pair TEXT,
+            resolution TEXT,
+            bucket INTEGER, -- начало корзины, unix-время
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            sum REAL,
+            count INTEGER,
+            open_ts INTEGER, -- время точек open/close, чтобы точки не по порядку не ломали OHLC
+            close_ts INTEGER,
+            PRIMARY KEY (source, pair, resolution, bucket)
+        ) WITHOUT ROWID
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_rate_rollups_resolution ON rate_rollups (resolution, bucket)")
+
+
+
+async def _m007_rate_ingest(db):
+    # состояние сбора уличных курсов по чатам: до какого сообщения прочитано и сколько дало курсов
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS rate_ingest_chats (
+            chat_id INTEGER PRIMARY KEY,
+            chat_title TEXT,
+            last_message_id INTEGER DEFAULT 0,
+            messages INTEGER DEFAULT 0, -- прочитано сообщений
+            rated_messages INTEGER DEFAULT 0, -- из них с курсами
+            rates INTEGER DEFAULT 0, -- найдено курсов
+            skipped INTEGER DEFAULT 0, -- не успели прочитать (чат писал быстрее опроса)
+            last_rate_at INTEGER, -- unix-время последнего курса
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+
+async def _m008_media_uploads(db):
+    # file_id медиа шаблона, уже загруженного userbot-аккаунтом: повторные рассылки не грузят файл заново
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS media_uploads (
+            account_id INTEGER, -- telegram_id владельца userbot-сессии
+            template_id INTEGER,
+            media_hash TEXT, -- хэш медиа шаблона: другой файл — другой ключ
+            media_type TEXT,
+            file_id TEXT, -- file_id Pyrogram после первой загрузки
+            uses INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_used_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (account_id, template_id, media_hash)
+        ) WITHOUT ROWID
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_media_uploads_template ON media_uploads (template_id)")
+
+
+async def _m009_backfill_street_history(db):
+    """Уличные курсы, записанные до появления истории (миграция 6), переносятся в rate_points и агрегаты."""
+    from bot.database.database import _rate_point_statements
+
+    # с появлением истории каждый курс пишется в обе таблицы — переносим только более старые строки
+    async with db.execute("SELECT MIN(ts) FROM rate_points WHERE source = 'street'") as cursor:
+        first_ts = (await cursor.fetchone())[0]
+    async with db.execute("""
+        SELECT currency_pair, ts, value FROM (
+            SELECT currency_pair, CAST(strftime('%s', timestamp) AS INTEGER) AS ts, COALESCE(rate_buy, rate_sell) AS value
+            FROM market_rates
+        )
+        WHERE ts IS NOT NULL AND value IS NOT NULL AND (? IS NULL OR ts < ?)
+    """, (first_ts, first_ts)) as cursor:
+        rows = await cursor.fetchall()
+
+    for sql, params in _rate_point_statements([("street", pair, ts, value) for pair, ts, value in rows]):
+        if params:
+            await db.executemany(sql, params)
+    if rows:
+        logging.info(f"Backfilled {len(rows)} street rates into rate history")
+
+
+async def _m010_lookup_indexes(db):
+    """Индексы для точечных поисков вне HOT_QUERIES: коды подтверждения, логин, шаблоны."""
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_templates_user ON templates (user_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_template ON scheduled_tasks (template_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_web_accounts_nickname_lower ON web_accounts (LOWER(nickname))")
+    # то же выражение, что в is_phone_registered, — иначе индекс не подхватится
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_web_accounts_phone_digits
+        ON web_accounts (REPLACE(REPLACE(REPLACE(phone, '+', ''), ' ', ''), '-', ''))
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_web_verification_codes_code ON web_verification_codes (code)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_seller_codes_code_lower ON seller_codes (LOWER(code))")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_seller_codes_telegram ON seller_codes (telegram_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bot_verification_codes_code ON bot_verification_codes (code)")
+
+
+async def _m011_media_uploads_file_key(db):
+    """media_uploads.media_hash -> file_key: ключ строится из file_id Bot API, а не из содержимого файла."""
+    async with db.execute("PRAGMA table_info(media_uploads)") as cursor:
+        cols = [row[1] for row in await cursor.fetchall()]
+    if "media_hash" in cols:
+        await db.execute("ALTER TABLE media_uploads RENAME COLUMN media_hash TO file_key")
+
+
+# Упорядоченный список миграций: (версия, описание, функция).
+# Новые шаги добавляются только в конец; уже выпущенные не меняются.
+MIGRATIONS = [
+    (1, "base schema", _m001_base_schema),
+    (2, "hot query indexes", _m002_indexes),
+    (3, "market post images to media store", _m003_market_post_images),
+    (4, "bids keyset index", _m004_bids_keyset_index),
+    (5, "broadcast jobs", _m005_broadcast_jobs),
+    (6, "rate history", _m006_rate_history),
+    (7, "street rate ingestion", _m007_rate_ingest),
+    (8, "uploaded media cache", _m008_media_uploads),
+    (9, "street rate history backfill", _m009_backfill_street_history),
+    (10, "lookup indexes", _m010_lookup_indexes),
+    (11, "media_uploads file key column", _m011_media_uploads_file_key),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def _current_version(db) -> int:
+    try:
+        async with db.execute("SELECT MAX(version) FROM schema_version") as cursor:
+            row = await cursor.fetchone()
+    except sqlite3.OperationalError:
+        # таблицы ещё нет — база новая или создана до миграций
+        return 0
+    return row[0] or 0
+
+
+async def migrate(db) -> int:
+    """
+    Довести схему до LATEST_VERSION. Возвращает число применённых шагов.
+
+    Если схема актуальна — один SELECT и выход. Иначе всё выполняется в
+    транзакции BEGIN IMMEDIATE: второй экземпляр бота ждёт блокировку записи,
+    затем перечитывает версию и ничего не повторяет.
+    """
+    if await _current_version(db) >= LATEST_VERSION:
+        return 0
+
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        current = await _current_version(db)
+        applied = 0
+        for version, description, step in MIGRATIONS:
+            if version <= current:
+                continue
+            logging.info(f"Applying migration {version}: {description}")
+            await step(db)
+            await db.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            applied += 1
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    return applied
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+
+class ConnectionPool:
+    """
+    Долгоживущие соединения с SQLite вместо aiosqlite.connect() на каждый вызов.
+
+    Читатели берут соединение из ограниченного пула, все записи идут через
+    одно соединение-писатель под asyncio.Lock (SQLite всё равно допускает
+    только одного писателя). Соединения открываются лениво.
+    """
+
+    def __init__(self, db_path: str, size: int = 4, acquire_timeout: float = 10.0, pragmas: dict | None = None):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.acquire_timeout = acquire_timeout
+        self.pragmas = dict(pragmas or {})
+
+        self._readers: asyncio.Queue | None = None
+        self._opened = 0
+        self._open_lock: asyncio.Lock | None = None
+        self._writer: aiosqlite.Connection | None = None
+        self._writer_lock: asyncio.Lock | None = None
+        self._all: list[aiosqlite.Connection] = []
+
+    def _ensure_primitives(self):
+        # asyncio-примитивы создаём внутри работающего loop'а
+        if self._readers is None:
+            self._readers = asyncio.Queue()
+            self._open_lock = asyncio.Lock()
+            self._writer_lock = asyncio.Lock()
+
+    async def _connect(self) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self.db_path)
+        for name, value in self.pragmas.items():
+            await db.execute(f"PRAGMA {name} = {value}")
+        self._all.append(db)
+        return db
+
+    async def _reset(self, db: aiosqlite.Connection):
+        """Вернуть соединение в исходное состояние перед повторным использованием."""
+        db.row_factory = None
+        if db.in_transaction:
+            await db.rollback()
+
+    async def _acquire_reader(self) -> aiosqlite.Connection:
+        self._ensure_primitives()
+        try:
+            return self._readers.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+
+        async with self._open_lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return await self._connect()
+                except Exception:
+                    self._opened -= 1
+                    raise
+
+        try:
+            return await asyncio.wait_for(self._readers.get(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(
+                f"DB pool: no free reader connection after {self.acquire_timeout}s (size={self.size})"
+            ) from None
+
+    @asynccontextmanager
+    async def read(self):
+        """Соединение для SELECT-запросов."""
+        db = await self._acquire_reader()
+        try:
+            yield db
+        finally:
+            try:
+                await self._reset(db)
+                self._readers.put_nowait(db)
+            except Exception as e:
+                logging.error(f"DB pool: dropping broken reader connection: {e}")
+                self._opened -= 1
+                await self._discard(db)
+
+    @asynccontextmanager
+    async def write(self):
+        """Единственное соединение-писатель; вызовы сериализуются."""
+        self._ensure_primitives()
+        try:
+            await asyncio.wait_for(self._writer_lock.acquire(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"DB pool: writer is busy for more than {self.acquire_timeout}s") from None
+
+        try:
+            if self._writer is None:
+                self._writer = await self._connect()
+            db = self._writer
+            try:
+                yield db
+            finally:
+                try:
+                    await self._reset(db)
+                except Exception as e:
+                    logging.error(f"DB pool: dropping broken writer connection: {e}")
+                    self._writer = None
+                    await self._discard(db)
+        finally:
+            self._writer_lock.release()
+
+    async def _discard(self, db: aiosqlite.Connection):
+        if db in self._all:
+            self._all.remove(db)
+        try:
+            await db.close()
+        except Exception:
+            pass
+
+    async def close(self):
+        """Закрыть все соединения (при остановке бота)."""
+        for db in list(self._all):
+            await self._discard(db)
+        self._readers = None
+        self._open_lock = None
+        self._writer_lock = None
+        self._writer = None
+        self._opened = 0
+
+
+def parse_pragmas(raw: str) -> dict:
+    """'busy_timeout=5000,cache_size=-8000' -> {'busy_timeout': '5000', 'cache_size': '-8000'}"""
+    pragmas = {}
+    for item in (raw or "").split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        name, value = name.strip(), value.strip()
+        if name and value:
+            pragmas[name] = value
+    return pragmas
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from itertools import groupby
+
+
+class WriteQueue:
+    """
+    Очередь мелких записей (update_last_run, add_market_rate и т.п.).
+
+    Записи копятся несколько миллисекунд и уходят одной транзакцией через
+    соединение-писатель пула. submit() ждёт фиксации, поэтому чтение сразу
+    после записи видит новые данные.
+    """
+
+    def __init__(self, pool, flush_interval: float = 0.005, max_batch: int = 200, max_pending: int = 10000):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.max_batch = max(1, max_batch)
+        self.max_pending = max_pending
+
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+
+        self.batches = 0
+        self.writes = 0
+        self.failed = 0
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def _ensure_worker(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def submit(self, sql: str, params: tuple = ()):
+        """Поставить запись в очередь и дождаться её коммита."""
+        return await self.submit_many([(sql, [params])])
+
+    async def submit_many(self, statements: list):
+        """
+        Несколько запросов [(sql, [params, ...])] как одна запись: они попадают
+        в одну пачку (одну транзакцию) и не разделяются между пачками.
+        """
+        statements = [(sql, list(rows)) for sql, rows in statements if rows]
+        if not statements:
+            return
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((statements, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._flush(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _flush(self, batch):
+        try:
+            async with self.pool.write() as db:
+                # подряд идущие одинаковые запросы -> один executemany
+                steps = [step for statements, _ in batch for step in statements]
+                for sql, items in groupby(steps, key=lambda step: step[0]):
+                    await db.executemany(sql, [params for _, rows in items for params in rows])
+                await db.commit()
+        except Exception as e:
+            logging.warning(f"Write batch of {len(batch)} failed ({e}); retrying one by one")
+            await self._flush_each(batch)
+            return
+
+        self.batches += 1
+        self.writes += len(batch)
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    async def _flush_each(self, batch):
+        for statements, future in batch:
+            try:
+                async with self.pool.write() as db:
+                    for sql, rows in statements:
+                        await db.executemany(sql, rows)
+                    await db.commit()
+                self.writes += 1
+                if not future.done():
+                    future.set_result(None)
+            except Exception as e:
+                self.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+
+    async def close(self):
+        """Дописать всё, что осталось в очереди, и остановить воркер."""
+        if self._queue is not None and self._worker is not None and not self._worker.done():
+            await self._queue.join()
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+        self._queue = None
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "batches": self.batches,
+            "writes": self.writes,
+            "failed": self.failed,
+        }
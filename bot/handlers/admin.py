@@ -1,11 +1,17 @@
-import aiosqlite
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from config import ADMIN_IDS
-from bot.database.database import DB_NAME
+from bot.database.database import DB_NAME, pool, checkpoint_db
 from bot.keyboards.main_menu import get_main_menu_keyboard
+from bot.services.ws_hub import hub
+from bot.services.notifier import notifier
+from bot.services.broadcast import start_broadcast, cancel_broadcast, running_broadcasts
+from bot.services.rate_ingest import rate_ingestor
+from bot.services.parser import ai_parser
+from bot.services.send_pacer import send_pacer
+from bot.services.chat_activity import chat_activity
 
 router = Router()
 
@@ -20,6 +26,8 @@ async def menu_admin(callback: types.CallbackQuery):
         "🛠 <b>Админ-панель</b>\n\n"
         "/stats — статистика\n"
         "/broadcast — рассылка по всем пользователям\n"
+        "/broadcast_stop — остановить рассылку\n"
+        "/rate_sources — чаты-источники уличных курсов\n"
         "/export_db — скачать базу данных\n"
         "/clearall — <b>очистить всех пользователей и посты</b>"
     )
@@ -35,6 +43,8 @@ async def cmd_admin(message: types.Message):
         "🛠 <b>Админ-панель</b>\n\n"
         "/stats — статистика\n"
         "/broadcast — рассылка по всем пользователям\n"
+        "/broadcast_stop — остановить рассылку\n"
+        "/rate_sources — чаты-источники уличных курсов\n"
         "/export_db — скачать базу данных\n"
         "/clearall — <b>очистить всех пользователей и посты</b>"
     )
@@ -46,13 +56,54 @@ async def cmd_stats(message: types.Message):
     if message.from_user.id not in ADMIN_IDS:
         return
 
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         async with db.execute("SELECT COUNT(*) FROM users") as cursor:
             total_users = (await cursor.fetchone())[0]
         async with db.execute("SELECT COUNT(*) FROM users WHERE session_string IS NOT NULL") as cursor:
             active_users = (await cursor.fetchone())[0]
 
-    await message.answer(f"📊 Статистика:\nВсего пользователей: {total_users}\nАвторизованы: {active_users}")
+    ws = hub.stats()
+    nt = notifier.stats()
+    ri = rate_ingestor.stats()
+    ai = ai_parser.stats()
+    sp = send_pacer.stats()
+    ca = chat_activity.stats()
+    await message.answer(
+        f"📊 Статистика:\nВсего пользователей: {total_users}\nАвторизованы: {active_users}\n\n"
+        f"WebSocket: клиентов {ws['clients']}, в очередях {ws['queued']} (макс. {ws['max_queue_depth']}), "
+        f"потеряно {ws['dropped']}, отключено медленных {ws['slow_disconnects']}\n"
+        f"Уведомления: в очереди {nt['backlog']}, отправлено {nt['sent']} "
+        f"({nt['sent_last_minute']}/мин), ошибок {nt['failed']}, повторов {nt['retried']}, "
+        f"флуд-лимитов {nt['rate_limited']}\n"
+        f"Уличные курсы: чатов {ri['chats']}, сообщений {ri['messages']}, курсов {ri['rates']}, "
+        f"в очереди {ri['queued']}, пропущено {ri['skipped']}, ошибок чтения {ri['errors']}\n"
+        f"AI-разбор: запросов {ai['requests']}, из кэша {ai['cache_hits']}, ошибок {ai['errors']}"
+        f"{', предохранитель сработал' if ai['breaker_open'] else ''}\n"
+        f"Рассылки: FloodWait {sp['flood_waits']}, slow mode {sp['slowmode_waits']}, "
+        f"аккаунтов на паузе {sp['cooling_accounts']}, с пониженным темпом {sp['slowed_accounts']}, "
+        f"умная проверка из кэша {ca['hits']} / по истории {ca['misses']}"
+    )
+
+
+@router.message(Command("rate_sources"))
+async def cmd_rate_sources(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    from bot.database.database import get_rate_ingest_stats
+    rows = await get_rate_ingest_stats(20)
+    if not rows:
+        await message.answer("Курсы из чатов ещё не собирались.")
+        return
+
+    lines = ["📈 Источники уличных курсов (всего):\n"]
+    for row in rows:
+        share = int(row["rated_messages"] * 100 / row["messages"]) if row["messages"] else 0
+        lines.append(
+            f"• {row['chat_title'] or row['chat_id']}: курсов {row['rates']}, "
+            f"сообщений {row['messages']} ({share}% с курсом), пропущено {row['skipped']}"
+        )
+    await message.answer("\n".join(lines))
 
 
 @router.message(Command("export_db"))
@@ -60,6 +111,8 @@ async def cmd_export_db(message: types.Message):
     if message.from_user.id not in ADMIN_IDS:
         return
 
+    # В режиме WAL свежие страницы лежат в bot.db-wal — сначала переносим их в файл
+    await checkpoint_db()
     file = types.FSInputFile(DB_NAME)
     await message.answer_document(file, caption="📦 Backup базы данных")
 
@@ -70,7 +123,7 @@ async def cmd_clear_all(message: types.Message):
     if message.from_user.id not in ADMIN_IDS:
         return
 
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         # Delete all market posts
         await db.execute("DELETE FROM market_posts")
         # Delete all web accounts
@@ -114,17 +167,29 @@ async def process_broadcast(message: types.Message, state: FSMContext, bot):
         await message.answer("Нужно отправить текст.")
         return
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT telegram_id FROM users") as cursor:
-            users = await cursor.fetchall()
+    # Рассылка идёт в фоне и переживает перезапуск; прогресс обновляется отдельным сообщением
+    await state.clear()
+    job_id = await start_broadcast(bot, message.from_user.id, text)
+    await message.answer(f"Рассылка #{job_id} запущена. Остановить: /broadcast_stop {job_id}")
 
-    count = 0
-    for user in users:
-        try:
-            await bot.send_message(user[0], text)
-            count += 1
-        except Exception:
-            pass
 
-    await message.answer(f"Готово. Рассылка отправлена {count} пользователям.")
-    await state.clear()
+@router.message(Command("broadcast_stop"))
+async def cmd_broadcast_stop(message: types.Message, bot):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    parts = (message.text or "").split()
+    running = running_broadcasts()
+    if len(parts) > 1 and parts[1].isdigit():
+        job_ids = [int(parts[1])]
+    else:
+        job_ids = running
+    if not job_ids:
+        await message.answer("Нет активных рассылок.")
+        return
+
+    stopped = [job_id for job_id in job_ids if await cancel_broadcast(bot, job_id)]
+    if stopped:
+        await message.answer("Остановлены рассылки: " + ", ".join(f"#{job_id}" for job_id in stopped))
+    else:
+        await message.answer("Рассылка не найдена или уже завершена.")
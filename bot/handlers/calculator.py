@@ -2,10 +2,11 @@ from aiogram import Router, F, types
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from config import RATES_MATRIX_CURRENCIES
 
 router = Router()
 
-DEFAULT_CURRENCIES = ["USD", "EGP", "EUR", "RUB", "UZS", "KGS", "KZT"]
+DEFAULT_CURRENCIES = RATES_MATRIX_CURRENCIES
 
 
 class CalculatorState(StatesGroup):
@@ -85,41 +86,32 @@ async def process_amount_numpad(callback: types.CallbackQuery, state: FSMContext
             return
 
         source_curr = data.get("source_currency", "USD")
-        from bot.services.rates_api import get_official_rates
+        from bot.services.rate_matrix import rate_matrix
 
-        rates = await get_official_rates()
-        if not rates:
+        # кросс-курсы посчитаны заранее при обновлении курсов — здесь только поиск
+        await rate_matrix.ensure()
+        row = rate_matrix.row(source_curr)
+        if not row:
             await callback.message.edit_text(
-                "Нет данных от FastForex (проверьте FAST_FOREX_API_KEY).",
+                "Нет данных о курсах (проверьте FAST_FOREX_API_KEY).",
                 reply_markup=get_calculator_keyboard(DEFAULT_CURRENCIES),
             )
             await state.clear()
             return
 
         result_text = f"💱 {amount:,.2f} {source_curr} =\n\n"
-        targets = [c for c in DEFAULT_CURRENCIES if c != source_curr]
-
-        for target in targets:
-            if source_curr == "USD":
-                rate_to_usd = 1.0
-            else:
-                usd_to_source = rates.get(source_curr)
-                if not usd_to_source:
-                    continue
-                rate_to_usd = 1 / usd_to_source
-
-            if target == "USD":
-                usd_to_target = 1.0
-            else:
-                usd_to_target = rates.get(target)
-                if not usd_to_target:
-                    continue
-
-            final_rate = rate_to_usd * usd_to_target
-            converted_amount = amount * final_rate
-            result_text += f"• {target}: {converted_amount:,.2f}\n"
-
-        result_text += "\nПо данным FastForex"
+        sources = set()
+        has_stale = False
+        for target, cell in row.items():
+            mark = " ⚠️" if cell.stale else ""
+            result_text += f"• {target}: {amount * cell.rate:,.2f}{mark}\n"
+            sources.update(cell.source.split("+"))
+            has_stale = has_stale or cell.stale
+
+        titles = {"street": "уличный курс", "p2p": "Binance P2P", "official": "FastForex"}
+        result_text += "\nИсточники: " + ", ".join(titles.get(s, s) for s in sorted(sources))
+        if has_stale:
+            result_text += "\n⚠️ — данные устарели"
 
         await callback.message.edit_text(result_text, reply_markup=get_calculator_keyboard(DEFAULT_CURRENCIES), parse_mode="Markdown")
         await state.clear()
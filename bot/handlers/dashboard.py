@@ -1,9 +1,10 @@
+import asyncio
 import datetime
 from aiogram import Router, F, types
 from aiogram.types import InlineKeyboardButton
 from bot.database.database import get_user
 from bot.keyboards.main_menu import get_main_menu_keyboard
-from bot.services.rates_api import get_official_rates, get_binance_p2p_rates
+from bot.services.rates_cache import rates_cache
 
 router = Router()
 
@@ -14,8 +15,10 @@ async def show_dashboard(callback: types.CallbackQuery):
 
 
 async def update_dashboard_message(message: types.Message):
-    official_rates = await get_official_rates()
-    binance_rates = await get_binance_p2p_rates()
+    # Из памяти; внешние API опрашивает фоновое обновление rates_cache
+    official_rates, binance_rates = await asyncio.gather(
+        rates_cache.get("official"), rates_cache.get("p2p")
+    )
 
     text = "💱 **Курсы валют**\n\n"
 
@@ -33,10 +36,15 @@ async def update_dashboard_message(message: types.Message):
     if not binance_rates:
         text += "_Нет данных._\n"
     else:
-        for pair, rate in binance_rates.items():
-            text += f"• {pair}: {rate:.2f}\n"
-
-    text += f"\n⏱ Обновлено: {datetime.datetime.now().strftime('%H:%M:%S')}"
+        text += "_покупка / продажа, средневзвешенно по объявлениям_\n"
+        for pair, sides in binance_rates.items():
+            buy = f"{sides['buy']:.2f}" if 'buy' in sides else "—"
+            sell = f"{sides['sell']:.2f}" if 'sell' in sides else "—"
+            text += f"• {pair}: {buy} / {sell}\n"
+
+    fetched = [rates_cache.fetched_at(name) for name in ("official", "p2p") if rates_cache.fetched_at(name)]
+    updated = datetime.datetime.fromtimestamp(min(fetched)) if fetched else datetime.datetime.now()
+    text += f"\n⏱ Обновлено: {updated.strftime('%H:%M:%S')}"
 
     user = await get_user(message.chat.id)
     lang = user[2] if user else "ru"
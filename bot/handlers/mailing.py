@@ -21,6 +21,7 @@ from bot.database.database import (
 )
 from bot.services.client_manager import get_user_dialogs, get_forum_topics
 from bot.services.scheduler import schedule_mailing_task
+from bot.services.template_cache import invalidate_template
 
 router = Router()
 
@@ -170,6 +171,7 @@ async def save_template_name(message: types.Message, state: FSMContext):
     entities_json = data.get("temp_entities")
 
     template_id = await add_template(message.from_user.id, content, media_type, caption, entities_json, name)
+    invalidate_template(template_id)
     await state.clear()
     await message.answer(
         f"Шаблон '{name}' сохранён (ID: {template_id}). Теперь выберите «Запустить рассылку».",
@@ -203,6 +205,7 @@ async def start_mailing(callback: types.CallbackQuery, state: FSMContext):
 async def delete_template_cb(callback: types.CallbackQuery, state: FSMContext):
     template_id = int(callback.data.split("_")[-1])
     await delete_template(callback.from_user.id, template_id)
+    invalidate_template(template_id)
     templates = await get_user_templates(callback.from_user.id)
     with suppress(TelegramBadRequest):
         if not templates:
@@ -9,6 +9,7 @@ from bot.database.database import (
     update_bid_message_id, get_rejected_bids_with_messages, get_order_client_id
 )
 from config import WEBAPP_URL
+from bot.services.notifier import notifier
 import logging
 
 router = Router()
@@ -318,15 +319,7 @@ async def notify_exchangers_new_order(bot: Bot, order_id: int, order_data: dict,
             f"Предложите свой курс!"
         )
         
-        try:
-            await bot.send_message(
-                chat_id=exchanger['telegram_id'],
-                text=text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            logging.error(f"Failed to notify exchanger {exchanger['telegram_id']}: {e}")
+        notifier.send_message(bot, exchanger['telegram_id'], text, reply_markup=keyboard, parse_mode="HTML")
 
 
 # ==================== EXCHANGER BIDS ====================
@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+
+import aiohttp
+
+
+def normalize(text: str) -> str:
+    """Одинаковые объявления с разными пробелами/регистром дают один ключ кэша."""
+    return " ".join(text.lower().split())
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(normalize(text).encode("utf-8")).hexdigest()
+
+
+class AIRateParser:
+    """
+    Разбор курсов через Mistral для сообщений, которые не понял регулярный разбор.
+
+    - кэш по хэшу нормализованного текста (LRU + TTL), включая пустые ответы —
+      повторно вставленное объявление не стоит второго запроса;
+    - одинаковые тексты, пришедшие одновременно, ждут один и тот же ответ;
+    - сообщения, пришедшие в пределах batch_wait, уходят одним промптом (до batch_size);
+    - не больше concurrency запросов одновременно, у каждого timeout;
+    - после breaker_failures ошибок подряд запросы не отправляются breaker_cooldown секунд.
+    url можно направить на локальную заглушку с тем же форматом ответа (chat/completions).
+    """
+
+    def __init__(self, api_key: str | None, allowed_pairs, url: str, model: str,
+                 cache_size: int = 5000, cache_ttl: float = 86400.0,
+                 batch_size: int = 10, batch_wait: float = 0.2, concurrency: int = 2,
+                 timeout: float = 15.0, breaker_failures: int = 5, breaker_cooldown: float = 300.0):
+        self.api_key = api_key
+        self.allowed_pairs = sorted(allowed_pairs)
+        self.url = url
+        self.model = model
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.breaker_failures = max(1, breaker_failures)
+        self.breaker_cooldown = breaker_cooldown
+
+        self._cache: OrderedDict[str, tuple[float, list]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._pending: list[tuple[str, str]] = []  # (key, text), ждут отправки пачкой
+        self._flusher: asyncio.TimerHandle | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self._failures = 0
+        self._open_until = 0.0
+
+        self.requests = 0
+        self.cache_hits = 0
+        self.shared = 0
+        self.errors = 0
+        self.short_circuited = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.api_key)
+
+    def is_open(self) -> bool:
+        return time.monotonic() < self._open_until
+
+    async def parse(self, text: str) -> list[tuple[str, float]]:
+        """[(pair, rate)] для одного сообщения; [] — курсов нет или AI недоступен."""
+        if not self.enabled or not text.strip():
+            return []
+        key = text_key(text)
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            if cached[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return cached[1]
+            del self._cache[key]
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future)
+
+        if self.is_open():
+            self.short_circuited += 1
+            return []
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self._pending.append((key, text))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._flusher is None:
+            self._flusher = asyncio.get_running_loop().call_later(self.batch_wait, self._flush)
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self._cache),
+            "requests": self.requests,
+            "cache_hits": self.cache_hits,
+            "shared": self.shared,
+            "errors": self.errors,
+            "short_circuited": self.short_circuited,
+            "breaker_open": self.is_open(),
+        }
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for key, _ in self._pending:
+            self._resolve(key, [], cache=False)
+        self._pending = []
+
+    # ---------- внутреннее ----------
+
+    def _flush(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+            task = asyncio.create_task(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _resolve(self, key: str, rates: list, cache: bool = True):
+        if cache:
+            self._cache[key] = (time.monotonic() + self.cache_ttl, rates)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(rates)
+
+    async def _run_batch(self, batch: list[tuple[str, str]]):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        results = None
+        try:
+            async with self._semaphore:
+                # пока ждали слот, предохранитель мог сработать
+                if not self.is_open():
+                    results = await self._request([text for _, text in batch])
+                else:
+                    self.short_circuited += len(batch)
+        except asyncio.CancelledError:
+            for key, _ in batch:
+                self._resolve(key, [], cache=False)
+            raise
+        except Exception as e:
+            self.errors += 1
+            self._failures += 1
+            if self._failures >= self.breaker_failures:
+                self._open_until = time.monotonic() + self.breaker_cooldown
+                logging.warning(f"Mistral parser: {self._failures} failures in a row, pausing for {self.breaker_cooldown}s")
+            logging.error(f"Mistral parser request failed: {e!r}")
+
+        if results is None:
+            # ошибку не кэшируем: следующее такое же сообщение попробует снова
+            for key, _ in batch:
+                self._resolve(key, [], cache=False)
+            return
+        self._failures = 0
+        for i, (key, _) in enumerate(batch):
+            self._resolve(key, results.get(i, []))
+
+    def _prompt(self, texts: list[str]) -> str:
+        messages = "\n".join(f"{i}: {json.dumps(text, ensure_ascii=False)}" for i, text in enumerate(texts))
+        return f"""
+    You are a currency exchange parser. Extract realistic rates only for these pairs: {", ".join(self.allowed_pairs)}.
+    Ignore any other pairs or words (like 'bor', 'olaman', random names).
+    If rate is unrealistic, drop it.
+
+    Messages (index: text):
+    {messages}
+
+    Return ONLY a JSON list. No markdown, no explanation.
+    Format: [{{"i": 0, "pair": "USD/UZS", "rate": 12500.0}}, {{"i": 1, "pair": "RUB/UZS", "rate": 135.0}}]
+    "i" is the index of the message the rate came from. If uncertain or no rates, return [].
+    """
+
+    async def _request(self, texts: list[str]) -> dict[int, list]:
+        """Один запрос на пачку; {index: [(pair, rate)]}. Любая ошибка — исключение (для предохранителя)."""
+        from bot.services.rates_api import get_session
+
+        self.requests += 1
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": self._prompt(texts)}],
+            "temperature": 0.1,
+        }
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        session = get_session()
+        async with session.post(self.url, headers=headers, json=payload,
+                                timeout=aiohttp.ClientTimeout(total=self.timeout)) as resp:
+            if resp.status != 200:
+                raise RuntimeError(f"HTTP {resp.status}: {(await resp.text())[:200]}")
+            result = await resp.json(content_type=None)
+
+        content = result["choices"][0]["message"]["content"]
+        content = re.sub(r"```json\s*|\s*```", "", content)
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError:
+            # модель ответила не JSON — запрос прошёл, просто курсов нет
+            logging.error(f"Mistral JSON error: {content[:200]}")
+            return {}
+
+        rates: dict[int, list] = {}
+        for item in data if isinstance(data, list) else []:
+            try:
+                index = int(item.get("i", 0)) if len(texts) > 1 else 0
+                rates.setdefault(index, []).append((item["pair"], float(item["rate"])))
+            except (AttributeError, KeyError, TypeError, ValueError):
+                continue
+        return rates
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
+
+from config import BROADCAST_CONCURRENCY, BROADCAST_BATCH_SIZE, BROADCAST_PROGRESS_INTERVAL
+from bot.database.database import (
+    create_broadcast_job, get_broadcast_job, get_running_broadcast_jobs,
+    set_broadcast_progress_message, get_broadcast_batch, save_broadcast_results,
+    finish_broadcast_job, get_broadcast_breakdown,
+)
+from bot.services.notifier import notifier, TRANSIENT_ERRORS
+
+# job_id -> задача, которая сейчас ведёт рассылку
+_running: dict[int, asyncio.Task] = {}
+
+REASONS = {
+    "blocked": "заблокировали бота",
+    "chat_not_found": "чат не найден",
+    "bad_request": "ошибка запроса",
+    "flood": "флуд-лимит",
+    "network": "сеть",
+    "other": "прочее",
+}
+
+
+async def start_broadcast(bot, admin_id: int, text: str) -> int:
+    """Сохранить рассылку в БД и запустить её в фоне. Возвращает id задания."""
+    job_id = await create_broadcast_job(admin_id, text)
+    job = await get_broadcast_job(job_id)
+    try:
+        msg = await bot.send_message(admin_id, _progress_text(job))
+        await set_broadcast_progress_message(job_id, msg.message_id)
+    except Exception as e:
+        logging.warning(f"Broadcast #{job_id}: cannot send progress message: {e}")
+    _spawn(bot, job_id)
+    return job_id
+
+
+async def resume_broadcasts(bot) -> int:
+    """Продолжить рассылки, прерванные перезапуском (status = 'running')."""
+    jobs = await get_running_broadcast_jobs()
+    for job in jobs:
+        if job["id"] not in _running:
+            logging.info(f"Resuming broadcast #{job['id']} from position {job['cursor']}/{job['total']}")
+            _spawn(bot, job["id"])
+    return len(jobs)
+
+
+async def cancel_broadcast(bot, job_id: int) -> bool:
+    task = _running.get(job_id)
+    job = await get_broadcast_job(job_id)
+    if not job or job["status"] != "running":
+        return False
+    await finish_broadcast_job(job_id, "cancelled")
+    if task is not None:
+        task.cancel()
+    await _report(bot, job_id, final=True)
+    return True
+
+
+def running_broadcasts() -> list[int]:
+    return sorted(_running)
+
+
+async def stop_broadcasts():
+    """Остановить фоновые задачи при выключении; статус 'running' остаётся, чтобы продолжить после рестарта."""
+    tasks = list(_running.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _spawn(bot, job_id: int):
+    task = asyncio.create_task(_run(bot, job_id))
+    _running[job_id] = task
+    task.add_done_callback(lambda _: _running.pop(job_id, None))
+
+
+async def _run(bot, job_id: int):
+    job = await get_broadcast_job(job_id)
+    if not job:
+        return
+    cursor = job["cursor"]
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    last_report = time.monotonic()
+
+    results = []
+    try:
+        while True:
+            batch = await get_broadcast_batch(job_id, cursor, BROADCAST_BATCH_SIZE)
+            if not batch:
+                break
+            results = []
+            await asyncio.gather(*(
+                _send_one(bot, semaphore, job["text"], position, telegram_id, results)
+                for position, telegram_id in batch
+            ))
+            cursor = batch[-1][0]
+            # до сохранения пачки её получатели остаются 'pending': после падения
+            # процесса максимум одна пачка уйдёт повторно
+            done, results = results, []
+            await save_broadcast_results(job_id, done, cursor)
+
+            if time.monotonic() - last_report >= BROADCAST_PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                await _report(bot, job_id)
+
+        await finish_broadcast_job(job_id, "done")
+        await _report(bot, job_id, final=True)
+    except asyncio.CancelledError:
+        # при штатной остановке сохраняем уже отправленное, чтобы не слать повторно
+        if results:
+            try:
+                await save_broadcast_results(job_id, results, cursor)
+            except Exception as e:
+                logging.warning(f"Broadcast #{job_id}: cannot save partial batch: {e}")
+        raise
+    except Exception:
+        # иначе задание висело бы в 'running' без задачи до следующего перезапуска
+        logging.exception(f"Broadcast #{job_id} failed at position {cursor}")
+        try:
+            if results:
+                await save_broadcast_results(job_id, results, cursor)
+            await finish_broadcast_job(job_id, "failed")
+            await _report(bot, job_id, final=True)
+        except Exception as e:
+            logging.error(f"Broadcast #{job_id}: cannot mark as failed: {e}")
+
+
+async def _send_one(bot, semaphore: asyncio.Semaphore, text: str, position: int, telegram_id: int, results: list):
+    async with semaphore:
+        results.append(await _deliver(bot, text, position, telegram_id))
+
+
+async def _deliver(bot, text: str, position: int, telegram_id: int):
+    try:
+        # общая очередь уведомлений: те же лимиты Telegram, что и у остальных сообщений бота
+        await notifier.call(bot, "send_message", telegram_id, text=text)
+        return position, telegram_id, "sent", None
+    except TelegramForbiddenError:
+        return position, telegram_id, "blocked", "blocked"
+    except TelegramBadRequest as e:
+        reason = "chat_not_found" if "chat not found" in str(e).lower() else "bad_request"
+        return position, telegram_id, "failed", reason
+    except TelegramRetryAfter:
+        return position, telegram_id, "failed", "flood"
+    except TRANSIENT_ERRORS:
+        return position, telegram_id, "failed", "network"
+    except Exception as e:
+        logging.warning(f"Broadcast to {telegram_id} failed: {e}")
+        return position, telegram_id, "failed", "other"
+
+
+def _progress_text(job: dict, breakdown: dict | None = None) -> str:
+    done = job["sent"] + job["failed"] + job["blocked"]
+    percent = int(done * 100 / job["total"]) if job["total"] else 100
+    titles = {"running": "идёт", "done": "завершена", "cancelled": "остановлена", "failed": "прервана из-за ошибки"}
+    text = (
+        f"📣 Рассылка #{job['id']} — {titles.get(job['status'], job['status'])}\n"
+        f"Обработано: {done}/{job['total']} ({percent}%)\n"
+        f"✅ Доставлено: {job['sent']}\n"
+        f"🚫 Заблокировали бота: {job['blocked']}\n"
+        f"❌ Ошибки: {job['failed']}"
+    )
+    if breakdown:
+        lines = [f"• {REASONS.get(reason, reason)}: {count}" for reason, count in sorted(breakdown.items())]
+        text += "\n\nПричины:\n" + "\n".join(lines)
+    return text
+
+
+async def _report(bot, job_id: int, final: bool = False):
+    job = await get_broadcast_job(job_id)
+    if not job or not job["progress_message_id"]:
+        return
+    breakdown = await get_broadcast_breakdown(job_id) if final else None
+    try:
+        await bot.edit_message_text(
+            _progress_text(job, breakdown),
+            chat_id=job["admin_id"],
+            message_id=job["progress_message_id"],
+        )
+    except TelegramBadRequest:
+        pass  # "message is not modified" — прогресс не изменился
+    except Exception as e:
+        logging.warning(f"Broadcast #{job_id}: cannot update progress: {e}")
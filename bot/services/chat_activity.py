@@ -0,0 +1,59 @@
+import time
+from collections import OrderedDict
+
+from config import MAILING_ACTIVITY_TTL, MAILING_ACTIVITY_SIZE
+
+
+class _Activity:
+    __slots__ = ("message_id", "sender_id", "expires_at")
+
+    def __init__(self, message_id: int, sender_id: int | None, expires_at: float):
+        self.message_id = message_id
+        self.sender_id = sender_id
+        self.expires_at = expires_at
+
+
+class ChatActivityCache:
+    """
+    Последнее сообщение в чате (теме) глазами аккаунта — для умной проверки рассылки.
+
+    Заполняется собственными отправками (своё сообщение заведомо последнее) и
+    результатами get_chat_history; пока запись моложе ttl, история не запрашивается.
+    Чужие сообщения после нашего станут видны не позже чем через ttl.
+    """
+
+    def __init__(self, ttl: float = 600.0, max_size: int = 20000):
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self._entries: OrderedDict[tuple, _Activity] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, account_id: int, chat_id: int, topic_id: int | None) -> _Activity | None:
+        key = (account_id, chat_id, topic_id)
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def remember(self, account_id: int, chat_id: int, topic_id: int | None, message_id: int, sender_id: int | None):
+        key = (account_id, chat_id, topic_id)
+        self._entries[key] = _Activity(message_id, sender_id, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def remember_sent(self, account_id: int, chat_id: int, topic_id: int | None, message_id: int, sender_id: int):
+        """Наше сообщение — последнее и в теме, и в чате целиком."""
+        self.remember(account_id, chat_id, topic_id, message_id, sender_id)
+        if topic_id:
+            self.remember(account_id, chat_id, None, message_id, sender_id)
+
+    def stats(self) -> dict:
+        return {"cached": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+chat_activity = ChatActivityCache(ttl=MAILING_ACTIVITY_TTL, max_size=MAILING_ACTIVITY_SIZE)
@@ -0,0 +1,97 @@
+import gzip
+import logging
+import os
+
+from config import HTTP_COMPRESS_MIN_BYTES, HTTP_GZIP_LEVEL, HTTP_BROTLI_QUALITY
+
+try:
+    import brotli
+except ImportError:  # brotli не обязателен: без него только gzip
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+    "text/html",
+    "text/css",
+    "text/plain",
+    "image/svg+xml",
+}
+STATIC_EXTENSIONS = {".js", ".mjs", ".css", ".html", ".svg", ".json", ".txt", ".map"}
+
+
+def available_encodings() -> list[str]:
+    """Поддерживаемые кодировки в порядке предпочтения."""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    """Accept-Encoding -> 'br' / 'gzip' / None (учитывает q=0)."""
+    accepted = set()
+    for item in (accept_encoding or "").lower().split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip()
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding)
+    for coding in available_encodings():
+        if coding in accepted or "*" in accepted:
+            return coding
+    return None
+
+
+def is_compressible(content_type: str, size: int) -> bool:
+    return size >= HTTP_COMPRESS_MIN_BYTES and content_type in COMPRESSIBLE_TYPES
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=HTTP_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=HTTP_GZIP_LEVEL, mtime=0)
+
+
+def precompress_static(directory: str) -> int:
+    """
+    Положить рядом с ассетами .gz (и .br, если есть brotli).
+    aiohttp FileResponse сам отдаёт такие файлы клиентам с нужным Accept-Encoding.
+    Пересжимает только устаревшие файлы; возвращает число записанных.
+    """
+    written = 0
+    suffixes = {"gzip": ".gz", "br": ".br"}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if os.path.splitext(name)[1] not in STATIC_EXTENSIONS:
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+                if stat.st_size < HTTP_COMPRESS_MIN_BYTES:
+                    continue
+                data = None
+                for encoding in available_encodings():
+                    target = path + suffixes[encoding]
+                    if os.path.exists(target) and os.stat(target).st_mtime >= stat.st_mtime:
+                        continue
+                    if data is None:
+                        with open(path, "rb") as f:
+                            data = f.read()
+                    packed = compress(data, encoding)
+                    if len(packed) >= len(data):
+                        if os.path.exists(target):
+                            os.remove(target)  # устаревшая копия бесполезна
+                        continue
+                    tmp = f"{target}.tmp{os.getpid()}"
+                    with open(tmp, "wb") as f:
+                        f.write(packed)
+                    os.replace(tmp, target)
+                    written += 1
+            except OSError as e:
+                logging.warning(f"Precompression failed for {path}: {e}")
+    return written
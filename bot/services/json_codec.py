@@ -0,0 +1,64 @@
+import datetime
+import decimal
+import json
+import logging
+import sqlite3
+
+from aiohttp import web
+
+from config import JSON_BACKEND
+
+try:
+    import orjson
+except ImportError:  # orjson не обязателен: без него работает stdlib json
+    orjson = None
+
+
+def _default(obj):
+    """Типы, которые json не умеет сам: даты, строки sqlite, Decimal, множества."""
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, sqlite3.Row):
+        return dict(zip(obj.keys(), obj))
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _stdlib_dumps(obj) -> bytes:
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _orjson_dumps(obj) -> bytes:
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _select_backend(name: str):
+    name = (name or "auto").lower()
+    if name == "stdlib":
+        return "stdlib", _stdlib_dumps, json.loads
+    if orjson is not None:
+        return "orjson", _orjson_dumps, orjson.loads
+    if name == "orjson":
+        logging.warning("JSON_BACKEND=orjson, but orjson is not installed; falling back to stdlib json")
+    return "stdlib", _stdlib_dumps, json.loads
+
+
+BACKEND, dumps_bytes, loads = _select_backend(JSON_BACKEND)
+
+
+def dumps(obj) -> str:
+    return dumps_bytes(obj).decode()
+
+
+def json_response(data=None, *, status: int = 200, headers=None) -> web.Response:
+    """Замена web.json_response: тело кодируется один раз сразу в байты."""
+    return web.Response(
+        body=dumps_bytes(data),
+        status=status,
+        headers=headers,
+        content_type="application/json",
+        charset="utf-8",
+    )
@@ -0,0 +1,157 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import re
+
+from config import MEDIA_DIR, MEDIA_MAX_BYTES, MEDIA_MAX_URL_LENGTH, MEDIA_THUMB_SIZE
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow не обязателен: без него превью = оригинал
+    Image = None
+
+# mime -> расширение файла
+ALLOWED_TYPES = {
+    "image/jpeg": "jpg",
+    "image/jpg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+    "image/gif": "gif",
+}
+CONTENT_TYPES = {
+    "jpg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+    "gif": "image/gif",
+}
+
+KEY_RE = re.compile(r"^[0-9a-f]{64}\.(jpg|png|webp|gif)$")
+DATA_URL_RE = re.compile(r"^data:(?P<mime>[\w/+.-]+);base64,(?P<data>.+)$", re.S | re.I)
+EXTERNAL_URL_RE = re.compile(r"^https?://[^\s/?#]+[^\s]*$", re.I)
+MEDIA_URL_PREFIX = "/media/"
+THUMB_URL_PREFIX = "/media/thumb/"
+
+
+class MediaError(ValueError):
+    """Картинка не прошла проверку (формат, размер, битый base64)."""
+
+
+def is_valid_key(key: str) -> bool:
+    return bool(key and KEY_RE.match(key))
+
+
+def media_path(key: str) -> str:
+    return os.path.join(MEDIA_DIR, key[:2], key)
+
+
+def thumb_path(key: str) -> str:
+    return os.path.join(MEDIA_DIR, "thumb", key[:2], key)
+
+
+def media_url(key: str | None) -> str | None:
+    return f"{MEDIA_URL_PREFIX}{key}" if key else None
+
+
+def thumb_url(key: str | None) -> str | None:
+    if not key:
+        return None
+    if Image is None and not os.path.exists(thumb_path(key)):
+        return media_url(key)
+    return f"{THUMB_URL_PREFIX}{key}"
+
+
+def key_from_url(value: str | None) -> str | None:
+    """'/media/<key>' или '/media/thumb/<key>' -> key (клиент присылает URL обратно при редактировании)."""
+    if not value:
+        return None
+    for prefix in (THUMB_URL_PREFIX, MEDIA_URL_PREFIX):
+        if value.startswith(prefix):
+            key = value[len(prefix):]
+            return key if is_valid_key(key) else None
+    return None
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _make_thumb(src: str, dst: str):
+    if Image is None:
+        return
+    try:
+        with Image.open(src) as img:
+            fmt = img.format
+            img.thumbnail((MEDIA_THUMB_SIZE, MEDIA_THUMB_SIZE))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            tmp = f"{dst}.tmp{os.getpid()}"
+            img.save(tmp, format=fmt)
+            os.replace(tmp, dst)
+    except Exception as e:
+        logging.warning(f"Thumbnail generation failed for {src}: {e}")
+
+
+def save_data_url(data_url: str) -> str:
+    """
+    Сохранить картинку из data:URL в хранилище. Возвращает ключ '<sha256>.<ext>'.
+    Одинаковые картинки попадают в один файл.
+    """
+    match = DATA_URL_RE.match(data_url.strip())
+    if not match:
+        raise MediaError("not_a_data_url")
+
+    ext = ALLOWED_TYPES.get(match.group("mime").lower())
+    if not ext:
+        raise MediaError("unsupported_image_type")
+
+    # грубая проверка до декодирования, чтобы не тратить память на огромные строки
+    if len(match.group("data")) * 3 // 4 > MEDIA_MAX_BYTES + 3:
+        raise MediaError("image_too_large")
+    try:
+        raw = base64.b64decode(match.group("data"), validate=False)
+    except (binascii.Error, ValueError):
+        raise MediaError("bad_base64") from None
+    if len(raw) > MEDIA_MAX_BYTES:
+        raise MediaError("image_too_large")
+
+    key = f"{hashlib.sha256(raw).hexdigest()}.{ext}"
+    path = media_path(key)
+    if not os.path.exists(path):
+        _write_atomic(path, raw)
+    if not os.path.exists(thumb_path(key)):
+        _make_thumb(path, thumb_path(key))
+    return key
+
+
+def image_urls(ref: str | None) -> tuple[str | None, str | None]:
+    """Сохранённая ссылка на картинку -> (url, url превью): ключ хранилища или внешний URL как есть."""
+    if is_valid_key(ref):
+        return media_url(ref), thumb_url(ref)
+    return ref, ref
+
+
+async def store_image(value: str | None) -> str | None:
+    """
+    Принять image_data из API: data:URL сохраняется в хранилище (-> ключ),
+    уже существующий /media/ URL возвращается как ключ, пусто -> None.
+    Внешняя http(s) ссылка (не длиннее MEDIA_MAX_URL_LENGTH) возвращается без изменений;
+    всё остальное — MediaError.
+    """
+    if not value:
+        return None
+    key = key_from_url(value)
+    if key:
+        return key
+    if value.lstrip()[:5].lower() == "data:":
+        return await asyncio.to_thread(save_data_url, value)
+    if EXTERNAL_URL_RE.match(value):
+        if len(value) > MEDIA_MAX_URL_LENGTH:
+            raise MediaError("image_url_too_long")
+        return value
+    raise MediaError("unsupported_image_ref")
@@ -0,0 +1,277 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram.exceptions import (
+    TelegramRetryAfter,
+    TelegramNetworkError,
+    TelegramServerError,
+)
+
+from config import (
+    NOTIFY_WORKERS,
+    NOTIFY_GLOBAL_RATE,
+    NOTIFY_CHAT_INTERVAL,
+    NOTIFY_MAX_RETRIES,
+    NOTIFY_MAX_PENDING,
+)
+
+# Ошибки, после которых есть смысл повторить отправку
+TRANSIENT_ERRORS = (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError, ConnectionError)
+
+
+class _Job:
+    __slots__ = ("bot", "method", "chat_id", "kwargs", "attempt", "future")
+
+    def __init__(self, bot, method: str, chat_id: int, kwargs: dict, future: asyncio.Future | None = None):
+        self.bot = bot
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.attempt = 0
+        self.future = future
+
+    def finish(self, result=None, error: Exception | None = None):
+        if self.future is None or self.future.done():
+            return
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
+
+
+class NotificationDispatcher:
+    """
+    Фоновая отправка уведомлений в Telegram.
+
+    Обработчик ставит сообщение в очередь и сразу возвращается; несколько
+    воркеров отправляют его, соблюдая общий лимит бота (сообщений в секунду)
+    и минимальный интервал между сообщениями в один чат. TelegramRetryAfter
+    ставит на паузу всю отправку, сетевые ошибки и 5xx повторяются с
+    экспоненциальной задержкой, остальные ошибки (бот заблокирован и т.п.) — нет.
+    """
+
+    def __init__(self, workers: int = 8, global_rate: float = 25.0, chat_interval: float = 1.0,
+                 max_retries: int = 3, max_pending: int = 10000):
+        self.workers = max(1, workers)
+        self.global_rate = max(0.1, global_rate)
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+
+        self._queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._delayed = 0  # задания, ждущие повтора / освобождения чата
+        self._timers: set[asyncio.TimerHandle] = set()
+
+        # token bucket для общего лимита
+        self._tokens = self.global_rate
+        self._refilled = time.monotonic()
+        self._bucket_lock: asyncio.Lock | None = None
+        self._paused_until = 0.0
+        self._chat_next: dict[int, float] = {}
+
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self.rejected = 0
+        self._sent_times = deque()
+
+    # ---------- публичный API ----------
+
+    def send_message(self, bot, chat_id: int, text: str, **kwargs) -> bool:
+        return self.submit(bot, "send_message", chat_id, text=text, **kwargs)
+
+    def delete_message(self, bot, chat_id: int, message_id: int) -> bool:
+        return self.submit(bot, "delete_message", chat_id, message_id=message_id)
+
+    def submit(self, bot, method: str, chat_id: int, **kwargs) -> bool:
+        """Поставить вызов bot.<method>(chat_id=..., **kwargs) в очередь. False — очередь переполнена."""
+        if bot is None or not chat_id:
+            return False
+        return self._put(_Job(bot, method, chat_id, kwargs))
+
+    async def call(self, bot, method: str, chat_id: int, **kwargs):
+        """
+        То же через общую очередь и лимиты, но с ожиданием итога:
+        возвращает результат bot.<method> или бросает последнюю ошибку (после повторов).
+        """
+        future = asyncio.get_running_loop().create_future()
+        if not self._put(_Job(bot, method, chat_id, kwargs, future)):
+            raise RuntimeError("notification queue is full")
+        return await future
+
+    def _put(self, job: _Job) -> bool:
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logging.warning(f"Notification queue is full ({self.max_pending}), dropping {job.method} to {job.chat_id}")
+            return False
+        self.enqueued += 1
+        return True
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        while self._sent_times and now - self._sent_times[0] > 60:
+            self._sent_times.popleft()
+        return {
+            "backlog": (self._queue.qsize() if self._queue else 0) + self._delayed,
+            "delayed": self._delayed,
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "sent_last_minute": len(self._sent_times),
+            "failed": self.failed,
+            "retried": self.retried,
+            "rate_limited": self.rate_limited,
+            "rejected": self.rejected,
+        }
+
+    async def close(self, timeout: float = 10.0):
+        """Дождаться отправки очереди (не дольше timeout) и остановить воркеры."""
+        if self._queue is not None and self._tasks:
+            try:
+                await asyncio.wait_for(self._drain(), timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"Notification dispatcher closed with {self.stats()['backlog']} messages unsent")
+        for timer in self._timers:
+            timer.cancel()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._timers = set()
+        self._queue = None
+        self._bucket_lock = None
+        self._delayed = 0
+
+    # ---------- внутреннее ----------
+
+    async def _drain(self):
+        # отложенные задания не сидят в очереди, поэтому одного join() мало
+        while True:
+            await self._queue.join()
+            if not self._delayed:
+                return
+            await asyncio.sleep(0.05)
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._bucket_lock = asyncio.Lock()
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    def _requeue_later(self, job: _Job, delay: float):
+        queue = self._queue
+        self._delayed += 1
+
+        def release():
+            self._timers.discard(timer)
+            self._delayed -= 1
+            try:
+                queue.put_nowait(job)
+            except asyncio.QueueFull:
+                self.rejected += 1
+                job.finish(error=RuntimeError("notification queue is full"))
+
+        timer = asyncio.get_running_loop().call_later(delay, release)
+        self._timers.add(timer)
+
+    async def _acquire_token(self):
+        async with self._bucket_lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.global_rate, self._tokens + (now - self._refilled) * self.global_rate)
+                self._refilled = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.global_rate)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"Notification {job.method} to {job.chat_id} crashed: {e}")
+                job.finish(error=e)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job: _Job):
+        if job.future is not None and job.future.cancelled():
+            return  # тот, кто ждал результат, уже отменён (например, остановка рассылки)
+        # чат ещё «остывает» после предыдущего сообщения — вернуть задание позже, не занимая воркер
+        now = time.monotonic()
+        wait = self._chat_next.get(job.chat_id, 0) - now
+        if wait > 0:
+            self._requeue_later(job, wait)
+            return
+        # слот чата занимаем до ожидания общего лимита, иначе соседний воркер проскочит
+        self._chat_next[job.chat_id] = now + self.chat_interval
+
+        await self._acquire_token()
+        self._chat_next[job.chat_id] = time.monotonic() + self.chat_interval
+        job.attempt += 1
+        try:
+            result = await getattr(job.bot, job.method)(chat_id=job.chat_id, **job.kwargs)
+        except TelegramRetryAfter as e:
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            logging.warning(f"Telegram flood limit: pausing notifications for {e.retry_after}s")
+            if job.attempt <= self.max_retries:
+                self._requeue_later(job, e.retry_after)
+            else:
+                self.failed += 1
+                job.finish(error=e)
+            return
+        except TRANSIENT_ERRORS as e:
+            if job.attempt <= self.max_retries:
+                self.retried += 1
+                self._requeue_later(job, min(2 ** job.attempt, 30))
+            else:
+                self.failed += 1
+                logging.error(f"Notification {job.method} to {job.chat_id} failed after {job.attempt} attempts: {e}")
+                job.finish(error=e)
+            return
+        except Exception as e:
+            self.failed += 1
+            # у call() ошибку разбирает вызывающий, в лог пишем только fire-and-forget
+            if job.future is None:
+                logging.warning(f"Notification {job.method} to {job.chat_id} failed: {e}")
+            job.finish(error=e)
+            return
+
+        job.finish(result)
+        self.sent += 1
+        self._sent_times.append(time.monotonic())
+        if len(self._sent_times) > 10000:
+            self._sent_times.popleft()
+        self._prune_chats()
+
+    def _prune_chats(self):
+        if len(self._chat_next) > 10000:
+            now = time.monotonic()
+            self._chat_next = {chat: t for chat, t in self._chat_next.items() if t > now}
+
+
+notifier = NotificationDispatcher(
+    workers=NOTIFY_WORKERS,
+    global_rate=NOTIFY_GLOBAL_RATE,
+    chat_interval=NOTIFY_CHAT_INTERVAL,
+    max_retries=NOTIFY_MAX_RETRIES,
+    max_pending=NOTIFY_MAX_PENDING,
+)
@@ -1,8 +1,11 @@
 import re
 import logging
-import aiohttp
-import json
-from config import MISTRAL_API_KEY
+from config import (
+    MISTRAL_API_KEY, MISTRAL_API_URL, MISTRAL_MODEL,
+    AI_PARSE_CACHE_SIZE, AI_PARSE_CACHE_TTL, AI_PARSE_BATCH_SIZE, AI_PARSE_BATCH_WAIT,
+    AI_PARSE_CONCURRENCY, AI_PARSE_TIMEOUT, AI_PARSE_BREAKER_FAILURES, AI_PARSE_BREAKER_COOLDOWN,
+)
+from bot.services.ai_parser import AIRateParser
 
 CURRENCIES = {
     "USD": ["usd", "доллар", "dollar", "$"],
@@ -28,56 +31,172 @@ ALLOWED_RANGES = {
 
 ALLOWED_PAIRS = set(ALLOWED_RANGES.keys())
 
+# Порядок пар, если по контексту сообщения валюту не понять (как было раньше: сначала сум, потом фунт, рубль)
+DEFAULT_PAIR_ORDER = ["USD/UZS", "USD/EGP", "USD/RUB", "RUB/UZS"] + sorted(
+    ALLOWED_PAIRS - {"USD/UZS", "USD/EGP", "USD/RUB", "RUB/UZS"}
+)
+
+SIDES = {
+    "buy": ["olaman", "оламан", "куплю", "покупаю", "беру", "buy", "покупка"],
+    "sell": ["sotaman", "сотаман", "продам", "продаю", "sell", "продажа"],
+}
+
+_ALIASES = {alias: code for code, aliases in CURRENCIES.items() for alias in aliases}
+_SIDE_WORDS = {word: side for side, words in SIDES.items() for word in words}
+
+
+# Один проход по тексту: телефон (пропускаем), число, слово, "$", перевод строки или знак препинания
+# (он только разделяет: "12650, рубль 141" — рубль относится не к 12650).
+# Валюты и глаголы ищутся по словарю среди слов — это быстрее длинной альтернативы в регулярке
+# и сразу даёт совпадение только целых слов ("sum", но не "summa").
+_TOKEN_RE = re.compile(
+    r"(?P<skip>\+\d[\d ()-]{6,}\d|\d{2,3}[ -]\d{3}[ -]\d{2}[ -]\d{2}(?!\d))"
+    r"|(?P<num>\d{1,3}(?:[ .,]\d{3})+(?:[.,]\d+)?(?!\d)|\d+(?:[.,]\d+)?)"
+    r"|(?P<word>[^\W\d_][\w']*)"
+    r"|(?P<dollar>\$)"
+    r"|(?P<nl>\n)"
+    r"|(?P<sep>[.,;!?()—–])"
+)
+_HAS_DIGIT = re.compile(r"\d").search
+
+ai_parser = AIRateParser(
+    MISTRAL_API_KEY,
+    ALLOWED_PAIRS,
+    url=MISTRAL_API_URL,
+    model=MISTRAL_MODEL,
+    cache_size=AI_PARSE_CACHE_SIZE,
+    cache_ttl=AI_PARSE_CACHE_TTL,
+    batch_size=AI_PARSE_BATCH_SIZE,
+    batch_wait=AI_PARSE_BATCH_WAIT,
+    concurrency=AI_PARSE_CONCURRENCY,
+    timeout=AI_PARSE_TIMEOUT,
+    breaker_failures=AI_PARSE_BREAKER_FAILURES,
+    breaker_cooldown=AI_PARSE_BREAKER_COOLDOWN,
+)
+
+# USD/EUR (0.5–1.5) разбор по словам не выбирает: евро в словаре нет, а такое число в
+# объявлении — почти всегда количество ("1$ = 12650", "1 dona"). Эту пару даёт только AI.
+_TEXT_PAIRS = [pair for pair in DEFAULT_PAIR_ORDER if pair != "USD/EUR"]
+
+# (pair, low, high, base, quote) в порядке DEFAULT_PAIR_ORDER
+_PAIR_RANGES = [(pair, *ALLOWED_RANGES[pair], *pair.split("/")) for pair in _TEXT_PAIRS]
+
+
+def _number_candidates(raw: str) -> list[float]:
+    """
+    '12 650' -> [12650]; '12.650' / '12,650' -> [12.65, 12650] (разделитель тысяч или дробная часть —
+    решает диапазон пары); '0,925' -> [0.925, 925].
+    """
+    compact = raw.replace(" ", "")
+    values = []
+    if "." in compact or "," in compact:
+        # последний разделитель — дробная часть, остальные — тысячи
+        head, _, tail = compact.replace(",", ".").rpartition(".")
+        try:
+            values.append(float(head.replace(".", "") + "." + tail))
+        except ValueError:
+            pass
+        if len(tail) == 3:
+            values.append(float(head.replace(".", "") + tail))
+    else:
+        values.append(float(compact))
+    return values
+
+
+def _classify(rate: float, context: list[str], label: str | None = None, unit: str | None = None) -> str | None:
+    """
+    Пара для числа. context — валюты строки от ближайшей к числу к дальней;
+    label — ближайшая валюта перед числом ("RUB 138" — курс рубля, она и есть base);
+    unit — валюта сразу после числа ("12650 sum" — курс в сумах, это quote).
+
+    Число с unit, которая не может быть quote ни одной подходящей пары ("100$", "1 usd"), —
+    количество, а не курс. Из остальных пар выигрывает та, чья base совпадает с label,
+    затем та, чьи валюты ближе к числу (отсутствующая — хуже любой упомянутой),
+    и только при полном равенстве — DEFAULT_PAIR_ORDER.
+    """
+    best, best_score = None, None
+    missing = len(context)
+    for pair, low, high, base, quote in _PAIR_RANGES:
+        if not low <= rate <= high or (unit is not None and quote != unit):
+            continue
+        if not context:
+            return pair
+        score = (
+            base != label,
+            (context.index(base) if base in context else missing) + (context.index(quote) if quote in context else missing),
+        )
+        if best_score is None or score < best_score:
+            best, best_score = pair, score
+    return best
+
+
+def extract_rates(text: str) -> list[tuple[str, str | None, float]]:
+    """
+    Курсы из текста за один проход регулярки: [(pair, side, rate)], side — 'buy' / 'sell' / None.
+    Каждому числу достаётся ближайшая (по словам) валюта и ближайший глагол из той же строки
+    (глагол — из всего сообщения, если в строке его нет).
+    """
+    if not _HAS_DIGIT(text):
+        return []
+
+    lines = []  # [(числа, валюты, глаголы)], элементы — (номер токена, значение)
+    nums, curs, sides = [], [], []
+    message_side = None
+    for i, (skip, num, word, dollar, nl, _) in enumerate(_TOKEN_RE.findall(text.lower())):
+        if num:
+            nums.append((i, num))
+        elif word:
+            code = _ALIASES.get(word)
+            if code is not None:
+                curs.append((i, code))
+            else:
+                side = _SIDE_WORDS.get(word)
+                if side is not None:
+                    sides.append((i, side))
+                    message_side = message_side or side
+        elif dollar:
+            curs.append((i, "USD"))
+        elif nl:
+            if nums:
+                lines.append((nums, curs, sides))
+            nums, curs, sides = [], [], []
+    if nums:
+        lines.append((nums, curs, sides))
+
+    rates = []
+    for nums, curs, sides in lines:
+        for pos, raw in nums:
+            context = []
+            label = unit = None
+            for at, code in sorted(curs, key=lambda c: abs(c[0] - pos)):
+                if code not in context:
+                    context.append(code)
+                if at == pos + 1:
+                    unit = code
+                elif at < pos and label is None:
+                    label = code
+            side = min(sides, key=lambda s: abs(s[0] - pos))[1] if sides else message_side
+            for rate in _number_candidates(raw):
+                pair = _classify(rate, context, label, unit)
+                if pair is not None:
+                    rates.append((pair, side, rate))
+                    break
+    return rates
+
 
 async def parse_market_message(text: str):
     """
     Попытаться извлечь курсы из текстового сообщения.
-    Возвращает список кортежей (pair, rate).
+    Возвращает список кортежей (pair, side, rate); side — 'buy' / 'sell' / None.
     """
-    rates = []
-    text_lower = text.lower()
-
-    patterns = [
-        # USD
-        r"(?:usd|dollar|доллар|\$)\s*[:=-]?\s*(\d+[.,]?\d*)",
-        r"(\d+[.,]?\d*)\s*(?:usd|dollar|доллар|\$)",
-        # UZS/SUM
-        r"(\d+[.,]?\d*)\s*(?:sum|so'm|сум|сўм)",
-        # Buy/sell verbs + number
-        r"(?:olaman|sotaman|куплю|продам|беру|продаю)\s*[:=-]?\s*(\d+[.,]?\d*)",
-        r"(\d+[.,]?\d*)\s*(?:ga|dan)?\s*(?:olaman|sotaman|куплю|продам|беру|продаю)",
-    ]
-
-    for pattern in patterns:
-        matches = re.findall(pattern, text_lower)
-        for match in matches:
-            try:
-                clean_rate = match.replace(",", ".")
-                if clean_rate.count(".") > 1:
-                    clean_rate = clean_rate.replace(".", "", clean_rate.count(".") - 1)
-
-                rate = float(clean_rate)
-                pair = "USD/UZS"
-
-                if 30 < rate < 100:
-                    pair = "USD/EGP"
-                elif 8000 < rate < 20000:
-                    pair = "USD/UZS"
-                elif 40 < rate < 150:
-                    pair = "USD/RUB"
-
-                rates.append((pair, rate))
-            except ValueError:
-                pass
-
-    filtered = _filter_and_average(rates)
+    filtered = _filter_and_average(extract_rates(text))
     if filtered:
         return filtered
 
-    if MISTRAL_API_KEY:
+    if ai_parser.enabled:
         try:
             ai_rates = await parse_with_ai(text)
-            filtered_ai = _filter_and_average(ai_rates)
+            filtered_ai = _filter_and_average([(pair, None, rate) for pair, rate in ai_rates])
             if filtered_ai:
                 return filtered_ai
         except Exception as e:
@@ -87,71 +206,22 @@ async def parse_market_message(text: str):
 
 
 async def parse_with_ai(text: str):
-    if not MISTRAL_API_KEY:
-        return []
-
-    url = "https://api.mistral.ai/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {MISTRAL_API_KEY}",
-        "Content-Type": "application/json",
-    }
-
-    allowed_pairs = ", ".join(sorted(ALLOWED_PAIRS))
-    prompt = f"""
-    You are a currency exchange parser. Extract realistic rates only for these pairs: {allowed_pairs}.
-    Ignore any other pairs or words (like 'bor', 'olaman', random names).
-    If rate is unrealistic, drop it.
-
-    Text: "{text}"
-
-    Return ONLY a JSON list. No markdown, no explanation.
-    Format: [{{"pair": "USD/UZS", "rate": 12500.0}}, {{"pair": "RUB/UZS", "rate": 135.0}}]
-    If uncertain or no rates, return [].
-    """
-
-    payload = {
-        "model": "mistral-tiny",
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.1,
-    }
-
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(url, headers=headers, json=payload) as resp:
-                if resp.status == 200:
-                    result = await resp.json()
-                    content = result["choices"][0]["message"]["content"]
-                    content = re.sub(r"```json\s*|\s*```", "", content)
-
-                    try:
-                        data = json.loads(content)
-                        rates = []
-                        for item in data:
-                            if "pair" in item and "rate" in item:
-                                rates.append((item["pair"], float(item["rate"])))
-                        return rates
-                    except json.JSONDecodeError:
-                        logging.error(f"Mistral JSON error: {content}")
-                else:
-                    logging.warning(f"Mistral AI error {resp.status}: {await resp.text()}")
-        except Exception as e:
-            logging.error(f"Mistral connection error: {e}")
-
-    return []
+    """[(pair, rate)] от Mistral: с кэшем, пачками и предохранителем (см. AIRateParser)."""
+    return await ai_parser.parse(text)
 
 
 def _filter_and_average(rates):
-    """Оставляем только допустимые пары и диапазоны, дубли усредняем."""
+    """Оставляем только допустимые пары и диапазоны, дубли (пара + сторона) усредняем."""
     filtered = {}
-    for pair, rate in rates or []:
+    for pair, side, rate in rates or []:
         if pair not in ALLOWED_PAIRS:
             continue
         low, high = ALLOWED_RANGES[pair]
         if not (low <= rate <= high):
             continue
-        filtered.setdefault(pair, []).append(rate)
+        filtered.setdefault((pair, side), []).append(rate)
 
     averaged = []
-    for pair, vals in filtered.items():
-        averaged.append((pair, sum(vals) / len(vals)))
+    for (pair, side), vals in filtered.items():
+        averaged.append((pair, side, sum(vals) / len(vals)))
     return averaged
@@ -0,0 +1,97 @@
+"""
+Замер скорости разбора курсов: старый разбор (пять re.findall по тексту) против extract_rates.
+
+    python -m bot.services.parser_bench [corpus.txt] [rounds]
+
+corpus.txt — сообщения из чатов, разделённые пустой строкой; без файла используется SAMPLE_CORPUS.
+"""
+import re
+import sys
+import time
+
+from bot.services.parser import extract_rates, _filter_and_average
+
+# Типичные сообщения из обменных чатов (Ташкент)
+SAMPLE_CORPUS = [
+    "USD 12650 sotaman",
+    "$ 12 600 olaman, Chilonzor",
+    "Dollar olaman 12.650 tezkor",
+    "Куплю доллар 12640, центр, срочно",
+    "Продам USDT 12700\nКуплю $ 12620",
+    "Доллар 12,650 сўм, рубль 140",
+    "Assalomu alaykum! Kim dollar sotadi? 12 630 dan olaman, Yunusobod",
+    "RUB 138 беру, от 100 000 рублей",
+    "usd/uzs 12 650 / 12 700",
+    "Всем привет, кто сегодня работает?",
+    "salom 2024 yil 5 ta joy bor",
+    "Tenge: USDT 505 KZT, сом 89",
+    "Долларни 12660 га оламан",
+    "Евро 0.92, доллар 12650, рубль 141 — обмен в офисе, звоните +998 90 123 45 67",
+    "Продаю $ 12 710, Сергели, доставка",
+    "1$ = 12650 sum",
+    "1 usd = 12700",
+    "sotaman 1 dona 12800",
+    "100$ bor 12650 dan",
+    "RUB 138 беру",
+]
+
+
+def legacy_extract(text: str):
+    """Старый разбор parse_market_message (до однопроходного токенизатора) — только для сравнения."""
+    rates = []
+    text_lower = text.lower()
+    patterns = [
+        r"(?:usd|dollar|доллар|\$)\s*[:=-]?\s*(\d+[.,]?\d*)",
+        r"(\d+[.,]?\d*)\s*(?:usd|dollar|доллар|\$)",
+        r"(\d+[.,]?\d*)\s*(?:sum|so'm|сум|сўм)",
+        r"(?:olaman|sotaman|куплю|продам|беру|продаю)\s*[:=-]?\s*(\d+[.,]?\d*)",
+        r"(\d+[.,]?\d*)\s*(?:ga|dan)?\s*(?:olaman|sotaman|куплю|продам|беру|продаю)",
+    ]
+    for pattern in patterns:
+        for match in re.findall(pattern, text_lower):
+            try:
+                clean_rate = match.replace(",", ".")
+                if clean_rate.count(".") > 1:
+                    clean_rate = clean_rate.replace(".", "", clean_rate.count(".") - 1)
+                rate = float(clean_rate)
+                pair = "USD/UZS"
+                if 30 < rate < 100:
+                    pair = "USD/EGP"
+                elif 8000 < rate < 20000:
+                    pair = "USD/UZS"
+                elif 40 < rate < 150:
+                    pair = "USD/RUB"
+                rates.append((pair, None, rate))
+            except ValueError:
+                pass
+    return rates
+
+
+def _measure(extract, corpus: list[str], rounds: int) -> tuple[float, int]:
+    found = 0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for text in corpus:
+            found += len(_filter_and_average(extract(text)))
+    elapsed = time.perf_counter() - started
+    return len(corpus) * rounds / elapsed, found // rounds
+
+
+def benchmark(corpus: list[str] | None = None, rounds: int = 2000) -> dict:
+    """{'legacy': {...}, 'compiled': {...}} — сообщений в секунду и курсов на прогон корпуса."""
+    corpus = corpus or SAMPLE_CORPUS
+    result = {}
+    for name, extract in (("legacy", legacy_extract), ("compiled", extract_rates)):
+        per_second, found = _measure(extract, corpus, rounds)
+        result[name] = {"messages_per_sec": round(per_second), "rates_found": found}
+    return result
+
+
+if __name__ == "__main__":
+    corpus = None
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding="utf-8") as f:
+            corpus = [m.strip() for m in f.read().split("\n\n") if m.strip()]
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    for name, row in benchmark(corpus, rounds).items():
+        print(f"{name:>8}: {row['messages_per_sec']:>9} msg/s, rates per corpus pass: {row['rates_found']}")
@@ -1,20 +1,75 @@
 import asyncio
-import random
 import logging
+import time
 import traceback
-from pyrogram import enums
-from bot.database.database import get_user, get_template, deactivate_task
+from pyrogram.errors import (
+    FloodWait,
+    SlowmodeWait,
+    FileIdInvalid,
+    FileReferenceEmpty,
+    FileReferenceExpired,
+    FileReferenceInvalid,
+    MediaEmpty,
+    MediaInvalid,
+)
+from bot.database.database import (
+    get_user, deactivate_task,
+    get_uploaded_media, save_uploaded_media, touch_uploaded_media, invalidate_uploaded_media,
+)
+from bot.services.chat_activity import chat_activity
 from bot.services.client_manager import get_client
+from bot.services.send_pacer import send_pacer, wait_until
+from bot.services.template_cache import get_template_payload
 from aiogram import Bot
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN,
+    MAILING_TYPING_LEAD,
+    MAILING_PREPARE_CONCURRENCY,
+    MAILING_FLOOD_MAX_WAIT,
+    MAILING_FLOOD_RETRIES,
+)
 import os
 import tempfile
 
+# Telegram не принял сохранённый file_id — нужно загрузить файл заново
+STALE_MEDIA_ERRORS = (
+    FileIdInvalid, FileReferenceEmpty, FileReferenceExpired, FileReferenceInvalid, MediaEmpty, MediaInvalid, ValueError,
+)
 
-async def run_mailing_task(user_id: int, template_id: int, target_groups: list, task_id: int | None = None) -> bool:
+# итог отправки в один чат
+SENT, FAILED, SKIPPED, DEFERRED = "sent", "failed", "skipped", "deferred"
+
+
+class MailingResult:
+    """
+    Итог запуска рассылки. bool(result) — было ли хотя бы одно успешное отправление.
+    deferred — чаты (как в target_groups), которые упёрлись в FloodWait / slow mode
+    дольше MAILING_FLOOD_MAX_WAIT; их можно повторить через retry_in секунд.
+    """
+
+    __slots__ = ("sent", "failed", "skipped", "deferred", "retry_in")
+
+    def __init__(self, sent: int = 0, failed: int = 0, skipped: int = 0,
+                 deferred: list | None = None, retry_in: float = 0.0):
+        self.sent = sent
+        self.failed = failed
+        self.skipped = skipped
+        self.deferred = deferred or []
+        self.retry_in = retry_in
+
+    def __bool__(self) -> bool:
+        return self.sent > 0
+
+    @property
+    def should_deactivate(self) -> bool:
+        # временные лимиты и пропуски умной проверки задачу не выключают
+        return self.sent == 0 and self.failed > 0 and not self.deferred
+
+
+async def run_mailing_task(user_id: int, template_id: int, target_groups: list, task_id: int | None = None) -> MailingResult:
     """
     Выполняет рассылку сообщения по группам.
-    Возвращает True, если было хотя бы одно успешное отправление.
+    Возвращает MailingResult (истинен, если было хотя бы одно успешное отправление).
     """
     logging.info(f"Starting mailing task for user {user_id}, template {template_id}, groups {len(target_groups)}")
 
@@ -23,77 +78,34 @@ async def run_mailing_task(user_id: int, template_id: int, target_groups: list,
         logging.error(f"User {user_id} not found or no session")
         if task_id is not None:
             await deactivate_task(task_id)
-        return False
+        return MailingResult(failed=len(target_groups))
 
     session_string = user[3]
-    template = await get_template(template_id)
+    # разобранный один раз шаблон (entities, метод отправки) из памяти
+    payload = await get_template_payload(template_id)
 
-    if not template:
+    if not payload:
         logging.error(f"Template {template_id} not found")
         if task_id is not None:
             await deactivate_task(task_id)
-        return False
+        return MailingResult(failed=len(target_groups))
 
-    content = template[2]
-    media_type = template[3]
-    caption = template[4] if len(template) > 4 else None
-    entities_json = template[5] if len(template) > 5 else None
-    
-    entities = []
-    if entities_json:
-        try:
-            import json
-            from pyrogram.types import MessageEntity
-            from pyrogram.enums import MessageEntityType
-            
-            raw_entities = json.loads(entities_json)
-            for e in raw_entities:
-                # Map Aiogram type to Pyrogram Enum
-                etype = e["type"]
-                pyro_type = None
-                
-                # Mapping
-                if etype == "bold": pyro_type = MessageEntityType.BOLD
-                elif etype == "italic": pyro_type = MessageEntityType.ITALIC
-                elif etype == "underline": pyro_type = MessageEntityType.UNDERLINE
-                elif etype == "strikethrough": pyro_type = MessageEntityType.STRIKETHROUGH
-                elif etype == "spoiler": pyro_type = MessageEntityType.SPOILER
-                elif etype == "code": pyro_type = MessageEntityType.CODE
-                elif etype == "pre": pyro_type = MessageEntityType.PRE
-                elif etype == "text_link": pyro_type = MessageEntityType.TEXT_LINK
-                elif etype == "text_mention": pyro_type = MessageEntityType.TEXT_MENTION
-                elif etype == "custom_emoji": pyro_type = MessageEntityType.CUSTOM_EMOJI
-                elif etype == "blockquote": pyro_type = MessageEntityType.BLOCKQUOTE
-                # ... add others if needed
-                
-                if pyro_type:
-                    entity = MessageEntity(
-                        type=pyro_type,
-                        offset=e["offset"],
-                        length=e["length"],
-                        url=e.get("url"),
-                        user=None, # User object needed for text_mention, complicated.
-                        language=e.get("language"),
-                        custom_emoji_id=e.get("custom_emoji_id")
-                    )
-                    # For text_mention, we need a User object. 
-                    # If we saved user_id, we might try to fetch or construct, but it's hard without resolving.
-                    # For now, skip text_mention user resolution or just pass user_id if supported?
-                    # Pyrogram MessageEntity expects User object.
-                    # If we have user_id, we can try to pass it? No, it needs User.
-                    # We will skip text_mention user for now or just not support it fully.
-                    
-                    entities.append(entity)
-        except Exception as e:
-            logging.error(f"Failed to parse entities: {e}")
+    # аккаунт ещё на паузе после FloodWait — даже не подключаемся
+    wait = send_pacer.ready_at(user_id) - time.monotonic()
+    if wait > MAILING_FLOOD_MAX_WAIT:
+        logging.info(f"Account {user_id} is cooling down after FloodWait for {wait:.0f}s more, deferring mailing")
+        return MailingResult(deferred=list(target_groups), retry_in=wait)
 
     try:
         client = await get_client(user_id, session_string)
+    except FloodWait as e:
+        send_pacer.on_flood_wait(user_id, e.value)
+        return MailingResult(deferred=list(target_groups), retry_in=e.value)
     except Exception as e:
         logging.error(f"Failed to start client for user {user_id}: {e}")
         if task_id is not None:
             await deactivate_task(task_id)
-        return False
+        return MailingResult(failed=len(target_groups))
 
     valid_groups = []
     for item in target_groups:
@@ -106,217 +118,336 @@ async def run_mailing_task(user_id: int, template_id: int, target_groups: list,
                 topic_id = int(parts[1])
             else:
                 chat_id = int(item)
-
-            # Try to resolve peer to ensure we can send to it
-            # This might fail if the user hasn't encountered the peer yet
-            try:
-                await client.resolve_peer(chat_id)
-            except Exception:
-                # If resolve fails, we might still be able to send if it's in dialogs, 
-                # but usually resolve_peer is a good check.
-                # Let's try to fetch it via get_chat to be sure? 
-                # Or just proceed and let send_message fail if it must.
-                pass
-            valid_groups.append({"chat_id": chat_id, "topic_id": topic_id})
+            # resolve_peer — уже в параллельной подготовке чата (_MailingRun.send_to)
+            valid_groups.append({"chat_id": chat_id, "topic_id": topic_id, "item": item})
         except Exception as e:
-            logging.error(f"Skip chat {item}: cannot resolve peer: {e}")
+            logging.error(f"Skip chat {item}: invalid chat id: {e}")
 
     if not valid_groups:
         logging.warning("No valid groups to send; deactivating task")
         if task_id is not None:
             await deactivate_task(task_id)
-        return False
-
-    # Prepare content for Pyrogram
-    # If it's media, we need to download it from Telegram Bot API and upload via Pyrogram
-    temp_file_path = None
-    bot = None
-    
-    if media_type != "text" and content and isinstance(content, str) and not os.path.exists(content):
-        # Assume content is a file_id from Bot API
-        try:
-            bot = Bot(token=BOT_TOKEN)
-            file_info = await bot.get_file(content)
-            
-            # Get extension
-            ext = os.path.splitext(file_info.file_path)[1]
-            if not ext:
-                # Fallback based on media_type if possible, or just .jpg for photo
-                if media_type == "photo": ext = ".jpg"
-                elif media_type == "video": ext = ".mp4"
-                elif media_type == "audio": ext = ".mp3"
-                elif media_type == "voice": ext = ".ogg"
-                elif media_type == "animation": ext = ".mp4"
-            
-            # Create temp file with extension
-            fd, temp_file_path = tempfile.mkstemp(suffix=ext)
-            os.close(fd)
-            
-            await bot.download_file(file_info.file_path, temp_file_path)
-            logging.info(f"Downloaded media to {temp_file_path}")
-            
-            # Use this path for sending
-            content = temp_file_path
-            
-        except Exception as e:
-            logging.error(f"Failed to download media: {e}")
-            if bot:
-                await bot.session.close()
-            if task_id is not None:
-                await deactivate_task(task_id)
-            return False
+        return MailingResult(failed=len(target_groups))
 
-    success_count = 0
-    fail_count = 0
+    run = _MailingRun(user_id, template_id, client, payload)
 
-    # We will try to capture the uploaded file_id from the first successful send
-    # to avoid re-uploading for every chat.
-    uploaded_file_id = None
+    # Prepare content for Pyrogram
+    # Медиа шаблона (file_id Bot API) загружается аккаунтом один раз: file_id Pyrogram
+    # хранится в media_uploads по (аккаунт, шаблон, хэш медиа) и переживает перезапуски.
+    if payload.bot_file_id:
+        run.cached_file_id = run.uploaded_file_id = await get_uploaded_media(user_id, template_id, payload.file_key)
+        if run.cached_file_id:
+            logging.info(f"Using cached upload for template {template_id}")
+        else:
+            run.temp_file_path = await _download_media(payload.bot_file_id, payload.media_type)
+            if not run.temp_file_path:
+                if task_id is not None:
+                    await deactivate_task(task_id)
+                return MailingResult(failed=len(target_groups))
+            run.content = run.temp_file_path
 
     # Get our own user ID for smart check
     try:
-        me = await client.get_me()
+        run.me = await client.get_me()
+    except FloodWait as e:
+        send_pacer.on_flood_wait(user_id, e.value)
     except Exception as e:
         logging.error(f"Failed to get me: {e}")
-        me = None
 
-    for group in valid_groups:
+    # Чаты обрабатываются одновременно: подготовка (resolve_peer, проверка истории)
+    # идёт параллельно, а сами отправки аккаунта расставляет send_pacer.
+    results = await asyncio.gather(*(run.send_to(group) for group in valid_groups))
+    result = MailingResult(
+        sent=results.count(SENT),
+        failed=results.count(FAILED) + len(target_groups) - len(valid_groups),
+        skipped=results.count(SKIPPED),
+        deferred=run.deferred,
+        retry_in=max(0.0, run.retry_at - time.monotonic()) if run.deferred else 0.0,
+    )
+
+    # Cleanup
+    if run.cached_uses:
+        try:
+            await touch_uploaded_media(user_id, template_id, payload.file_key, run.cached_uses)
+        except Exception as e:
+            logging.warning(f"Failed to update upload stats for template {template_id}: {e}")
+    if run.temp_file_path and os.path.exists(run.temp_file_path):
+        try:
+            os.remove(run.temp_file_path)
+        except:
+            pass
+
+    logging.info(
+        f"Mailing finished. Success: {result.sent}, Fail: {result.failed}, "
+        f"Skipped: {result.skipped}, Deferred: {len(result.deferred)}"
+    )
+    if result.should_deactivate and task_id is not None:
+        # Every attempted chat failed for good (not flood limits / smart skips):
+        # deactivate to avoid spamming logs if it's broken.
+        await deactivate_task(task_id)
+    return result
+
+
+class _MailingRun:
+    """Один запуск рассылки аккаунтом по нескольким чатам; загрузка медиа общая для всех чатов."""
+
+    __slots__ = ("user_id", "template_id", "client", "payload", "me", "content",
+                 "uploaded_file_id", "cached_file_id", "rejected_file_id", "temp_file_path",
+                 "cached_uses", "deferred", "retry_at", "_prepare", "_upload_lock")
+
+    def __init__(self, user_id: int, template_id: int, client, payload):
+        self.user_id = user_id
+        self.template_id = template_id
+        self.client = client
+        self.payload = payload
+        self.me = None
+        self.content = payload.content
+        self.uploaded_file_id = None
+        self.cached_file_id = None
+        self.rejected_file_id = None
+        self.temp_file_path = None
+        self.cached_uses = 0
+        self.deferred = []
+        self.retry_at = 0.0
+        self._prepare = asyncio.Semaphore(max(1, MAILING_PREPARE_CONCURRENCY))
+        self._upload_lock = asyncio.Lock()
+
+    async def send_to(self, group: dict) -> str:
+        """SENT, FAILED, SKIPPED (умная проверка) или DEFERRED (FloodWait / slow mode)."""
         chat_id_int = group["chat_id"]
         topic_id = group["topic_id"]
-        
-        # Smart Check: Skip if last message is ours
-        if me:
+        if self._defer_if_blocked(group):
+            return DEFERRED
+
+        async with self._prepare:
+            # умная проверка первой: пропущенному чату resolve_peer не нужен
+            if self.me and await self._last_is_ours(chat_id_int, topic_id):
+                return SKIPPED
+            # Try to resolve peer to ensure we can send to it
+            # This might fail if the user hasn't encountered the peer yet;
+            # then just proceed and let send fail if it must.
             try:
-                should_skip = False
-                # Fetch more history to find relevant message and skip service messages
-                limit = 20 if topic_id else 10
-                last_msg = None
-                
-                async for msg in client.get_chat_history(chat_id_int, limit=limit):
-                    # Skip service messages (pinned, joined, etc.)
-                    if msg.service:
-                        continue
-                        
-                    if topic_id:
-                        # Check if message belongs to this topic
-                        if getattr(msg, "reply_to_message_id", None) == topic_id or \
-                           getattr(msg, "message_thread_id", None) == topic_id or \
-                           msg.id == topic_id:
-                            last_msg = msg
-                            break
-                    else:
-                        last_msg = msg
-                        break
-                
-                if last_msg:
-                    is_mine = False
-                    sender_id = "Unknown"
-                    
-                    if last_msg.from_user:
-                        sender_id = last_msg.from_user.id
-                        if last_msg.from_user.id == me.id:
-                            is_mine = True
-                    elif last_msg.sender_chat:
-                        sender_id = f"Chat {last_msg.sender_chat.id}"
-                        # If we sent as a channel? Unlikely for userbot, but possible.
-                    
-                    if is_mine:
-                        logging.info(f"Smart Mode: Skipping {chat_id_int} (topic {topic_id}) - last message is ours.")
-                        continue
-                    else:
-                        logging.info(f"Smart Mode: Sending to {chat_id_int} (topic {topic_id}). Last msg from: {sender_id}")
-                else:
-                    logging.info(f"Smart Mode: No previous messages found in {chat_id_int} (topic {topic_id}). Sending...")
+                await self.client.resolve_peer(chat_id_int)
+            except FloodWait as e:
+                send_pacer.on_flood_wait(self.user_id, e.value)
+            except Exception:
+                pass
+
+        # FloodWait / SlowmodeWait: записываем паузу и пробуем снова ровно после неё
+        for _ in range(MAILING_FLOOD_RETRIES + 1):
+            try:
+                if not await self._deliver(group):
+                    return DEFERRED
+                send_pacer.on_success(self.user_id)
+                return SENT
+            except FloodWait as e:
+                send_pacer.on_flood_wait(self.user_id, e.value)
+            except SlowmodeWait as e:
+                logging.warning(f"Slow mode in {chat_id_int}: next message allowed in {e.value}s")
+                send_pacer.on_slowmode_wait(chat_id_int, e.value)
             except Exception as e:
-                logging.warning(f"Smart check failed for {chat_id_int}: {e}")
+                logging.error(f"Failed to send to {chat_id_int}: {e!r}")
+                traceback.print_exc()
+                return FAILED
+        self._defer(group, send_pacer.ready_at(self.user_id, chat_id_int))
+        return DEFERRED
 
-        try:
-            # Send chat action (typing)
+    def _defer(self, group: dict, ready_at: float):
+        self.deferred.append(group["item"])
+        self.retry_at = min(self.retry_at, ready_at) if self.retry_at else ready_at
+
+    def _defer_if_blocked(self, group: dict) -> bool:
+        """Пауза аккаунта / чата длиннее MAILING_FLOOD_MAX_WAIT — чат уходит в отложенный повтор."""
+        ready_at = send_pacer.ready_at(self.user_id, group["chat_id"])
+        if ready_at - time.monotonic() <= MAILING_FLOOD_MAX_WAIT:
+            return False
+        self._defer(group, ready_at)
+        return True
+
+    async def _deliver(self, group: dict) -> bool:
+        if not self.uploaded_file_id and self.payload.media_type != "text":
+            # файл ещё не загружен: грузит один чат, остальные ждут его file_id
+            # и только потом занимают слот — иначе все они уйдут разом после загрузки
+            async with self._upload_lock:
+                if not self.uploaded_file_id:
+                    return await self._paced_send(group, uploading=True)
+        return await self._paced_send(group)
+
+    async def _paced_send(self, group: dict, uploading: bool = False) -> bool:
+        """False — слот сдвинулся дальше MAILING_FLOOD_MAX_WAIT, чат отложен."""
+        chat_id_int = group["chat_id"]
+        while True:
+            if self._defer_if_blocked(group):
+                return False
+            at = send_pacer.reserve(self.user_id, send_pacer.ready_at(self.user_id, chat_id_int))
+            # "печатает" показываем незадолго до своего слота, а не отдельной паузой
+            await wait_until(at - MAILING_TYPING_LEAD)
+            if send_pacer.ready_at(self.user_id, chat_id_int) > at:
+                continue  # пока ждали, пришёл FloodWait — слот больше не годится
             try:
-                action = enums.ChatAction.TYPING if media_type == "text" else enums.ChatAction.UPLOAD_PHOTO
-                if media_type == "video": action = enums.ChatAction.UPLOAD_VIDEO
-                elif media_type == "audio": action = enums.ChatAction.UPLOAD_AUDIO
-                elif media_type == "document": action = enums.ChatAction.UPLOAD_DOCUMENT
-                
-                # await client.send_chat_action(chat_id_int, action=action, message_thread_id=topic_id)
                 # message_thread_id not supported in this version
-                await client.send_chat_action(chat_id_int, action=action)
-                await asyncio.sleep(random.uniform(1, 3))
+                await self.client.send_chat_action(chat_id_int, action=self.payload.action)
+            except FloodWait as e:
+                send_pacer.on_flood_wait(self.user_id, e.value)
+                continue
             except Exception as e:
                 logging.warning(f"Failed to send chat action to {chat_id_int}: {e}")
+            await wait_until(at)
+            if send_pacer.ready_at(self.user_id, chat_id_int) <= at:
+                break
 
-            # Prepare kwargs
-            kwargs = {}
-            if topic_id:
-                # Use reply_to_message_id for topics (older Pyrogram / standard API behavior)
-                # If message_thread_id is not supported, this is the way.
-                kwargs["reply_to_message_id"] = topic_id
-            
-            if entities:
-                if media_type == "text":
-                    kwargs["entities"] = entities
+        sent_msg = await self._send(chat_id_int, self.payload.send_kwargs(group["topic_id"]), uploading)
+        logging.info(f"Sent to {chat_id_int}")
+        if self.me and getattr(sent_msg, "id", None):
+            # следующий запуск узнает, что последнее сообщение наше, без get_chat_history
+            chat_activity.remember_sent(self.user_id, chat_id_int, group["topic_id"], sent_msg.id, self.me.id)
+        return True
+
+    async def _last_is_ours(self, chat_id_int: int, topic_id: int | None) -> bool:
+        # Smart Check: Skip if last message is ours
+        cached = chat_activity.get(self.user_id, chat_id_int, topic_id)
+        if cached is not None:
+            if cached.sender_id == self.me.id:
+                logging.info(f"Smart Mode: Skipping {chat_id_int} (topic {topic_id}) - last message is ours (cached).")
+                return True
+            return False
+
+        try:
+            # Fetch more history to find relevant message and skip service messages
+            limit = 20 if topic_id else 10
+            last_msg = None
+
+            async for msg in self.client.get_chat_history(chat_id_int, limit=limit):
+                # Skip service messages (pinned, joined, etc.)
+                if msg.service:
+                    continue
+
+                if topic_id:
+                    # Check if message belongs to this topic
+                    if getattr(msg, "reply_to_message_id", None) == topic_id or \
+                       getattr(msg, "message_thread_id", None) == topic_id or \
+                       msg.id == topic_id:
+                        last_msg = msg
+                        break
                 else:
-                    kwargs["caption_entities"] = entities
-
-            # Use uploaded_file_id if available
-            current_content = uploaded_file_id if uploaded_file_id else content
-
-            sent_msg = None
-            if media_type == "text":
-                sent_msg = await client.send_message(chat_id_int, current_content, **kwargs)
-            elif media_type == "photo":
-                sent_msg = await client.send_photo(chat_id_int, current_content, caption=caption, **kwargs)
-            elif media_type == "video":
-                sent_msg = await client.send_video(chat_id_int, current_content, caption=caption, **kwargs)
-            elif media_type == "animation":
-                sent_msg = await client.send_animation(chat_id_int, current_content, caption=caption, **kwargs)
-            elif media_type == "audio":
-                sent_msg = await client.send_audio(chat_id_int, current_content, caption=caption, **kwargs)
-            elif media_type == "voice":
-                sent_msg = await client.send_voice(chat_id_int, current_content, caption=caption, **kwargs)
-            elif media_type == "document":
-                sent_msg = await client.send_document(chat_id_int, current_content, caption=caption, **kwargs)
-            elif media_type == "video_note":
-                sent_msg = await client.send_video_note(chat_id_int, current_content, **kwargs)
-            else:
-                # Fallback
-                sent_msg = await client.send_message(chat_id_int, f"Unsupported media type: {media_type}", **kwargs)
-
-            # Capture file_id for next sends
-            if not uploaded_file_id and sent_msg:
-                if sent_msg.photo: uploaded_file_id = sent_msg.photo.file_id
-                elif sent_msg.video: uploaded_file_id = sent_msg.video.file_id
-                elif sent_msg.animation: uploaded_file_id = sent_msg.animation.file_id
-                elif sent_msg.audio: uploaded_file_id = sent_msg.audio.file_id
-                elif sent_msg.voice: uploaded_file_id = sent_msg.voice.file_id
-                elif sent_msg.document: uploaded_file_id = sent_msg.document.file_id
-                elif sent_msg.video_note: uploaded_file_id = sent_msg.video_note.file_id
-
-            logging.info(f"Sent to {chat_id_int}")
-            success_count += 1
-
-            sleep_time = random.uniform(5, 15)
-            logging.info(f"Sleeping {sleep_time:.2f}s")
-            await asyncio.sleep(sleep_time)
+                    last_msg = msg
+                    break
+
+            if last_msg:
+                chat_activity.remember(
+                    self.user_id, chat_id_int, topic_id, last_msg.id,
+                    last_msg.from_user.id if last_msg.from_user else None,
+                )
+                is_mine = False
+                sender_id = "Unknown"
 
+                if last_msg.from_user:
+                    sender_id = last_msg.from_user.id
+                    if last_msg.from_user.id == self.me.id:
+                        is_mine = True
+                elif last_msg.sender_chat:
+                    sender_id = f"Chat {last_msg.sender_chat.id}"
+                    # If we sent as a channel? Unlikely for userbot, but possible.
+
+                if is_mine:
+                    logging.info(f"Smart Mode: Skipping {chat_id_int} (topic {topic_id}) - last message is ours.")
+                    return True
+                logging.info(f"Smart Mode: Sending to {chat_id_int} (topic {topic_id}). Last msg from: {sender_id}")
+            else:
+                chat_activity.remember(self.user_id, chat_id_int, topic_id, 0, None)
+                logging.info(f"Smart Mode: No previous messages found in {chat_id_int} (topic {topic_id}). Sending...")
+        except FloodWait as e:
+            send_pacer.on_flood_wait(self.user_id, e.value)
         except Exception as e:
-            logging.error(f"Failed to send to {chat_id_int}: {e!r}")
-            traceback.print_exc()
-            fail_count += 1
-    
-    # Cleanup
-    if bot:
-        await bot.session.close()
-    if temp_file_path and os.path.exists(temp_file_path):
+            logging.warning(f"Smart check failed for {chat_id_int}: {e}")
+        return False
+
+    async def _send(self, chat_id: int, kwargs: dict, uploading: bool = False):
+        if uploading:
+            return await self._upload(chat_id, kwargs)
+        if not self.uploaded_file_id and self.payload.media_type != "text":
+            # загрузку сбросили (file_id устарел) — её заново делает один чат
+            async with self._upload_lock:
+                if not self.uploaded_file_id:
+                    return await self._upload(chat_id, kwargs)
+
+        current_content = self.uploaded_file_id or self.content
         try:
+            sent_msg = await self.payload.send(self.client, chat_id, current_content, kwargs)
+        except STALE_MEDIA_ERRORS as e:
+            if current_content not in (self.cached_file_id, self.rejected_file_id):
+                raise
+            async with self._upload_lock:
+                if current_content == self.cached_file_id:
+                    # сохранённая загрузка больше не действует: забываем её и грузим файл заново
+                    logging.warning(f"Cached upload for template {self.template_id} rejected ({e!r}), re-uploading")
+                    await invalidate_uploaded_media(self.user_id, self.template_id)
+                    self.rejected_file_id = current_content
+                    self.cached_file_id = self.uploaded_file_id = None
+                    if not self.temp_file_path:
+                        self.temp_file_path = await _download_media(self.payload.bot_file_id, self.payload.media_type)
+                        if not self.temp_file_path:
+                            raise
+                    self.content = self.temp_file_path
+                if not self.uploaded_file_id:
+                    return await self._upload(chat_id, kwargs)
+            return await self.payload.send(self.client, chat_id, self.uploaded_file_id, kwargs)
+
+        if self.cached_file_id and current_content == self.cached_file_id:
+            self.cached_uses += 1
+        return sent_msg
+
+    async def _upload(self, chat_id: int, kwargs: dict):
+        sent_msg = await self.payload.send(self.client, chat_id, self.content, kwargs)
+        # Capture file_id for next sends (and next runs)
+        file_id = _uploaded_file_id(sent_msg) if sent_msg else None
+        if file_id:
+            self.uploaded_file_id = file_id
+            if self.payload.file_key:
+                try:
+                    await save_uploaded_media(self.user_id, self.template_id, self.payload.file_key,
+                                              self.payload.media_type, file_id)
+                except Exception as e:
+                    logging.warning(f"Failed to cache upload for template {self.template_id}: {e}")
+        return sent_msg
+
+
+async def _download_media(file_id: str, media_type: str) -> str | None:
+    """Скачать медиа шаблона через Bot API во временный файл; None — не удалось."""
+    bot = Bot(token=BOT_TOKEN)
+    temp_file_path = None
+    try:
+        file_info = await bot.get_file(file_id)
+
+        # Get extension
+        ext = os.path.splitext(file_info.file_path)[1]
+        if not ext:
+            # Fallback based on media_type if possible, or just .jpg for photo
+            if media_type == "photo": ext = ".jpg"
+            elif media_type == "video": ext = ".mp4"
+            elif media_type == "audio": ext = ".mp3"
+            elif media_type == "voice": ext = ".ogg"
+            elif media_type == "animation": ext = ".mp4"
+
+        # Create temp file with extension
+        fd, temp_file_path = tempfile.mkstemp(suffix=ext)
+        os.close(fd)
+
+        await bot.download_file(file_info.file_path, temp_file_path)
+        logging.info(f"Downloaded media to {temp_file_path}")
+        return temp_file_path
+    except Exception as e:
+        logging.error(f"Failed to download media: {e}")
+        if temp_file_path and os.path.exists(temp_file_path):
             os.remove(temp_file_path)
-        except:
-            pass
+        return None
+    finally:
+        await bot.session.close()
 
-    logging.info(f"Mailing finished. Success: {success_count}, Fail: {fail_count}")
-    if success_count == 0 and task_id is not None:
-        # If we failed to send to ALL groups, maybe we should deactivate?
-        # Or maybe just leave it active for next retry?
-        # User complained "all failed", so let's deactivate to avoid spamming logs if it's broken.
-        await deactivate_task(task_id)
-    return success_count > 0
+
+def _uploaded_file_id(sent_msg) -> str | None:
+    for attr in ("photo", "video", "animation", "audio", "voice", "document", "video_note"):
+        media = getattr(sent_msg, attr, None)
+        if media:
+            return media.file_id
+    return None
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import time
+
+from config import (
+    RATES_RETENTION_RAW_DAYS,
+    RATES_RETENTION_1M_DAYS,
+    RATES_RETENTION_1H_DAYS,
+    RATES_RETENTION_1D_DAYS,
+    RATES_PRUNE_INTERVAL,
+)
+from bot.database.database import add_rate_points, prune_rate_history
+from bot.services.rates_cache import rates_cache
+
+DAY = 86400
+
+# Сколько секунд хранить каждое разрешение (0 — всегда)
+RETENTION = {
+    "raw": int(RATES_RETENTION_RAW_DAYS * DAY),
+    "1m": int(RATES_RETENTION_1M_DAYS * DAY),
+    "1h": int(RATES_RETENTION_1H_DAYS * DAY),
+    "1d": int(RATES_RETENTION_1D_DAYS * DAY),
+}
+
+_pruner: asyncio.Task | None = None
+
+
+def to_points(name: str, value: dict, ts: int) -> list:
+    """
+    Значение источника из rates_cache -> [(source, pair, ts, value)].
+    official: {"EUR": 0.92} -> ("fastforex", "USD/EUR")
+    p2p: {"USDT/UZS": {"buy": x, "sell": y}} -> ("binance_p2p_buy" / "binance_p2p_sell", "USDT/UZS")
+    """
+    points = []
+    if name == "official":
+        for code, rate in value.items():
+            if rate:
+                points.append(("fastforex", f"USD/{code}", ts, float(rate)))
+    elif name == "p2p":
+        for pair, sides in value.items():
+            for side in ("buy", "sell"):
+                if sides.get(side):
+                    points.append((f"binance_p2p_{side}", pair, ts, float(sides[side])))
+    return points
+
+
+async def _on_refresh(name: str, value: dict):
+    await add_rate_points(to_points(name, value, int(time.time())))
+
+
+async def _prune_loop():
+    while True:
+        try:
+            deleted = await prune_rate_history(RETENTION)
+            if deleted:
+                logging.info(f"Rate history: pruned {deleted} rows")
+        except Exception as e:
+            logging.error(f"Rate history prune failed: {e}")
+        await asyncio.sleep(RATES_PRUNE_INTERVAL)
+
+
+def start():
+    """Писать каждое обновление кэша курсов в историю и периодически чистить старое."""
+    global _pruner
+    rates_cache.add_listener(_on_refresh)
+    if _pruner is None or _pruner.done():
+        _pruner = asyncio.create_task(_prune_loop())
+
+
+async def close():
+    global _pruner
+    if _pruner is not None:
+        _pruner.cancel()
+        await asyncio.gather(_pruner, return_exceptions=True)
+        _pruner = None
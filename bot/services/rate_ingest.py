@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import time
+
+from config import (
+    RATES_INGEST_POLL_INTERVAL,
+    RATES_INGEST_FETCH_LIMIT,
+    RATES_INGEST_QUEUE_SIZE,
+    RATES_INGEST_BATCH_SIZE,
+    RATES_INGEST_PARSE_CONCURRENCY,
+)
+from bot.database.database import get_rate_ingest_chats, add_market_rates, save_rate_ingest_progress
+from bot.services.client_manager import get_client
+from bot.services.parser import parse_market_message
+
+
+class _ChatStats:
+    __slots__ = ("title", "messages", "rated", "rates", "skipped", "errors", "last_rate_at")
+
+    def __init__(self, title: str | None):
+        self.title = title
+        self.messages = 0
+        self.rated = 0
+        self.rates = 0
+        self.skipped = 0
+        self.errors = 0
+        self.last_rate_at = None
+
+
+class RateIngestor:
+    """
+    Уличные курсы из отслеживаемых чатов.
+
+    Опросчик читает новые сообщения каждого чата userbot-клиентом его владельца
+    (клиенты запущены с no_updates, поэтому история, а не апдейты) и кладёт их в
+    ограниченную очередь; дубли отсекаются по последнему прочитанному id сообщения
+    в чате. Разборщик забирает сообщения пачками, разбирает параллельно и пишет
+    все найденные курсы одной транзакцией. Если разбор не успевает, опросчик ждёт
+    места в очереди — память не растёт, а лишнее из слишком активного чата
+    считается как skipped.
+    """
+
+    def __init__(self, poll_interval: float = 60.0, fetch_limit: int = 100, queue_size: int = 1000,
+                 batch_size: int = 50, parse_concurrency: int = 8):
+        self.poll_interval = poll_interval
+        self.fetch_limit = max(1, fetch_limit)
+        self.queue_size = max(1, queue_size)
+        self.batch_size = max(1, batch_size)
+        self.parse_concurrency = max(1, parse_concurrency)
+
+        self._queue: asyncio.Queue | None = None
+        self._poller: asyncio.Task | None = None
+        self._consumer: asyncio.Task | None = None
+        self._last_seen: dict[int, int] = {}  # chat_id -> id последнего поставленного в очередь сообщения
+        self._retry_at: dict[int, float] = {}  # чаты, которые не удалось прочитать, — пауза
+        self._pending_skipped: dict[int, int] = {}
+        self.chats: dict[int, _ChatStats] = {}
+
+    # ---------- жизненный цикл ----------
+
+    def start(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll_loop())
+        if self._consumer is None or self._consumer.done():
+            self._consumer = asyncio.create_task(self._consume_loop())
+
+    async def close(self, timeout: float = 5.0):
+        """Остановить опрос, дать разобрать уже прочитанное (не дольше timeout)."""
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+        if self._queue is not None and self._consumer is not None and not self._consumer.done():
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"Rate ingestion closed with {self._queue.qsize()} messages unparsed")
+        if self._consumer is not None:
+            self._consumer.cancel()
+            await asyncio.gather(self._consumer, return_exceptions=True)
+        self._poller = self._consumer = None
+        self._queue = None
+
+    def stats(self) -> dict:
+        chats = self.chats.values()
+        return {
+            "chats": len(self.chats),
+            "queued": self._queue.qsize() if self._queue else 0,
+            "messages": sum(c.messages for c in chats),
+            "rated_messages": sum(c.rated for c in chats),
+            "rates": sum(c.rates for c in chats),
+            "skipped": sum(c.skipped for c in chats),
+            "errors": sum(c.errors for c in chats),
+        }
+
+    # ---------- опрос чатов ----------
+
+    async def _poll_loop(self):
+        while True:
+            try:
+                for chat in await get_rate_ingest_chats():
+                    await self._poll_chat(chat)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Rate ingestion poll failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _poll_chat(self, chat: dict):
+        chat_id = chat["chat_id"]
+        stats = self.chats.get(chat_id)
+        if stats is None:
+            stats = self.chats[chat_id] = _ChatStats(chat["chat_title"])
+        if self._retry_at.get(chat_id, 0) > time.monotonic():
+            return
+
+        last = max(self._last_seen.get(chat_id, 0), chat["last_message_id"] or 0)
+        new = []
+        try:
+            client = await get_client(chat["user_id"], chat["session_string"])
+            # история идёт от новых к старым: читаем до уже обработанного;
+            # в первый раз — только самое новое сообщение, чтобы запомнить, откуда читать
+            async for msg in client.get_chat_history(chat_id, limit=self.fetch_limit if last else 1):
+                if msg.id <= last:
+                    break
+                new.append(msg)
+        except Exception as e:
+            stats.errors += 1
+            self._retry_at[chat_id] = time.monotonic() + self.poll_interval * 10
+            logging.warning(f"Rate ingestion: cannot read chat {chat_id}: {e}")
+            return
+        self._retry_at.pop(chat_id, None)
+        if not new:
+            return
+        if not last:
+            # старая история чата — не текущие курсы: разбираем только то, что придёт дальше
+            self._last_seen[chat_id] = new[0].id
+            await save_rate_ingest_progress([(chat_id, chat["chat_title"], new[0].id, 0, 0, 0, 0, None)])
+            return
+
+        self._last_seen[chat_id] = new[0].id
+        if last and len(new) == self.fetch_limit and new[-1].id - last > 1:
+            # чат написал больше, чем читаем за опрос; id в чате идут подряд, так что это оценка
+            skipped = new[-1].id - last - 1
+            stats.skipped += skipped
+            self._pending_skipped[chat_id] = self._pending_skipped.get(chat_id, 0) + skipped
+
+        for msg in reversed(new):
+            text = msg.text or msg.caption
+            if not text:
+                continue
+            ts = int(msg.date.timestamp()) if msg.date else int(time.time())
+            # put() ждёт, пока разборщик освободит место: это и есть backpressure
+            await self._queue.put((chat_id, chat["chat_title"], msg.id, str(text), ts))
+
+    # ---------- разбор ----------
+
+    async def _consume_loop(self):
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                await self._process(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Rate ingestion batch of {len(batch)} failed: {e}")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _process(self, batch: list):
+        semaphore = asyncio.Semaphore(self.parse_concurrency)
+
+        async def parse(text: str):
+            async with semaphore:
+                try:
+                    return await parse_market_message(text)
+                except Exception as e:
+                    logging.warning(f"Rate ingestion: parse failed: {e}")
+                    return []
+
+        parsed = await asyncio.gather(*(parse(item[3]) for item in batch))
+
+        rows = []
+        progress = {}
+        for (chat_id, title, message_id, _, ts), rates in zip(batch, parsed):
+            entry = progress.setdefault(chat_id, [chat_id, title, 0, 0, 0, 0, self._pending_skipped.get(chat_id, 0), None])
+            entry[2] = max(entry[2], message_id)
+            entry[3] += 1
+            if rates:
+                entry[4] += 1
+                entry[5] += len(rates)
+                entry[7] = max(entry[7] or 0, ts)
+                rows.extend((pair, side, rate, str(chat_id), ts) for pair, side, rate in rates)
+
+        await add_market_rates(rows)
+        await save_rate_ingest_progress([tuple(entry) for entry in progress.values()])
+
+        # пропуски списываем только после записи; за время await могли накопиться новые
+        for chat_id, *_, skipped, _ in progress.values():
+            left = self._pending_skipped.get(chat_id, 0) - skipped
+            if left > 0:
+                self._pending_skipped[chat_id] = left
+            else:
+                self._pending_skipped.pop(chat_id, None)
+
+        for chat_id, _, _, messages, rated, found, _, last_rate_at in progress.values():
+            stats = self.chats.get(chat_id)
+            if stats is not None:
+                stats.messages += messages
+                stats.rated += rated
+                stats.rates += found
+                if last_rate_at:
+                    stats.last_rate_at = last_rate_at
+
+        if rows:
+            from bot.services.rate_matrix import rate_matrix
+            await rate_matrix.rebuild()
+
+
+rate_ingestor = RateIngestor(
+    poll_interval=RATES_INGEST_POLL_INTERVAL,
+    fetch_limit=RATES_INGEST_FETCH_LIMIT,
+    queue_size=RATES_INGEST_QUEUE_SIZE,
+    batch_size=RATES_INGEST_BATCH_SIZE,
+    parse_concurrency=RATES_INGEST_PARSE_CONCURRENCY,
+)
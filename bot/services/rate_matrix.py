@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+
+from config import RATES_MATRIX_CURRENCIES, RATES_MATRIX_PRECEDENCE, RATES_STREET_STALE_AFTER
+from bot.database.database import get_average_rates
+from bot.services.rates_cache import rates_cache
+
+PIVOT = "USD"
+# USDT на P2P и в уличных объявлениях считаем равным USD (стейблкоин), если прямого USD-курса нет
+ALIASES = {"USDT": "USD"}
+
+
+class _Cell:
+    __slots__ = ("rate", "source", "stale", "via", "as_of")
+
+    def __init__(self, rate: float, source: str, stale: bool, via: str | None, as_of: float):
+        self.rate = rate
+        self.source = source
+        self.stale = stale
+        self.via = via
+        self.as_of = as_of
+
+    def to_dict(self) -> dict:
+        return {
+            "rate": self.rate,
+            "source": self.source,
+            "stale": self.stale,
+            "via": self.via,
+            "as_of": int(self.as_of),
+        }
+
+
+class RateMatrix:
+    """
+    Готовая таблица кросс-курсов N×N: конвертация — один поиск в словаре.
+
+    Перестраивается после каждого обновления rates_cache. Для каждой пары берётся
+    прямой курс или курс через USD из самого приоритетного источника; свежие данные
+    важнее приоритета, устаревшие помечаются stale. rate — сколько quote за 1 base.
+    """
+
+    def __init__(self, currencies: list[str], precedence: list[str]):
+        self.currencies = currencies
+        self.precedence = {name: i for i, name in enumerate(precedence)}
+        self.cells: dict[tuple[str, str], _Cell] = {}
+        self.built_at = 0.0
+        self._lock: asyncio.Lock | None = None
+
+    def lookup(self, base: str, quote: str) -> _Cell | None:
+        return self.cells.get((base, quote))
+
+    def row(self, base: str) -> dict[str, _Cell]:
+        """Все известные курсы из base: {quote: cell}."""
+        return {quote: self.cells[(base, quote)] for quote in self.currencies if (base, quote) in self.cells}
+
+    def to_dict(self) -> dict:
+        return {
+            "currencies": self.currencies,
+            "built_at": int(self.built_at),
+            "rates": {
+                base: {quote: cell.to_dict() for quote, cell in self.row(base).items()}
+                for base in self.currencies
+            },
+        }
+
+    async def ensure(self):
+        """Построить таблицу, если её ещё нет (первый запрос до фонового обновления)."""
+        if not self.cells:
+            await asyncio.gather(rates_cache.get("official"), rates_cache.get("p2p"))
+            await self.rebuild()
+
+    async def rebuild(self, *_):
+        # подходит и как слушатель rates_cache: callback(name, value)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            try:
+                street = await get_average_rates()
+            except Exception as e:
+                logging.error(f"Rate matrix: cannot load street rates: {e}")
+                street = []
+            self.cells = self._build(self._collect(street))
+            self.built_at = time.time()
+
+    # ---------- построение ----------
+
+    def _collect(self, street) -> list:
+        """Все известные прямые курсы: [(base, quote, rate, source, stale, as_of)]."""
+        now = time.time()
+        quotes = []
+
+        official = rates_cache.peek("official")
+        if official:
+            stale = not rates_cache.is_fresh("official")
+            as_of = rates_cache.fetched_at("official")
+            for code, rate in official.items():
+                quotes.append((PIVOT, code, rate, "official", stale, as_of))
+
+        p2p = rates_cache.peek("p2p")
+        if p2p:
+            stale = not rates_cache.is_fresh("p2p")
+            as_of = rates_cache.fetched_at("p2p")
+            for pair, sides in p2p.items():
+                # середина между покупкой и продажей
+                prices = [sides[side] for side in ("buy", "sell") if sides.get(side)]
+                if prices and "/" in pair:
+                    base, quote = pair.split("/", 1)
+                    quotes.append((base, quote, sum(prices) / len(prices), "p2p", stale, as_of))
+
+        for pair, rate, last_ts in street:
+            if rate and "/" in pair:
+                base, quote = pair.split("/", 1)
+                stale = now - (last_ts or 0) > RATES_STREET_STALE_AFTER
+                quotes.append((base, quote, rate, "street", stale, last_ts or 0))
+        return quotes
+
+    def _rank(self, source: str, stale: bool) -> tuple:
+        return stale, self.precedence.get(source, len(self.precedence))
+
+    def _build(self, quotes: list) -> dict:
+        # лучший прямой курс по каждому направлению
+        edges: dict[tuple[str, str], tuple] = {}
+
+        def offer(base, quote, rate, source, stale, as_of, aliased):
+            if base == quote:
+                return
+            # (stale, приоритет, курс через псевдоним хуже настоящего)
+            rank = self._rank(source, stale) + (aliased,)
+            current = edges.get((base, quote))
+            if current is None or rank < current[0]:
+                edges[(base, quote)] = (rank, rate, source, stale, as_of)
+
+        for base, quote, rate, source, stale, as_of in quotes:
+            # пустой, нулевой или отрицательный курс — мусор источника; обратный из него не считаем
+            if rate is None or not rate > 0:
+                continue
+            real_base, real_quote = ALIASES.get(base, base), ALIASES.get(quote, quote)
+            aliased = (real_base, real_quote) != (base, quote)
+            offer(real_base, real_quote, rate, source, stale, as_of, aliased)
+            offer(real_quote, real_base, 1 / rate, source, stale, as_of, aliased)
+
+        cells = {}
+        for base in self.currencies:
+            for quote in self.currencies:
+                if base == quote:
+                    continue
+                best = None
+                direct = edges.get((base, quote))
+                if direct is not None:
+                    rank, rate, source, stale, as_of = direct
+                    best = (rank[:2], _Cell(rate, source, stale, None, as_of))
+                first, second = edges.get((base, PIVOT)), edges.get((PIVOT, quote))
+                if PIVOT not in (base, quote) and first is not None and second is not None:
+                    # кросс через USD хуже худшей из двух ног
+                    rank = max(first[0][:2], second[0][:2])
+                    if best is None or rank < best[0]:
+                        sources = first[2] if first[2] == second[2] else f"{first[2]}+{second[2]}"
+                        cell = _Cell(
+                            first[1] * second[1], sources, first[3] or second[3], PIVOT,
+                            min(first[4], second[4]),
+                        )
+                        best = (rank, cell)
+                if best is not None:
+                    cells[(base, quote)] = best[1]
+        return cells
+
+    def start(self):
+        rates_cache.add_listener(self.rebuild)
+
+
+rate_matrix = RateMatrix(RATES_MATRIX_CURRENCIES, RATES_MATRIX_PRECEDENCE)
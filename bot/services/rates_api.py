@@ -1,9 +1,38 @@
+import asyncio
 import aiohttp
 import logging
-from config import FAST_FOREX_API_KEY
+from config import (
+    FAST_FOREX_API_KEY,
+    RATES_HTTP_POOL_SIZE,
+    RATES_HTTP_TIMEOUT,
+    BINANCE_P2P_FIATS,
+    BINANCE_P2P_DEPTH,
+)
 
 BASE_CURRENCY = "USD"
 TARGET_CURRENCIES = ["EGP", "EUR", "RUB", "UZS", "KGS", "KZT"]
+BINANCE_P2P_URL = "https://p2p.binance.com/bapi/c2c/v2/friendly/c2c/adv/search"
+P2P_SIDES = ("BUY", "SELL")
+
+# Одна долгоживущая сессия с пулом соединений на все запросы курсов
+_session: aiohttp.ClientSession | None = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=RATES_HTTP_POOL_SIZE, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=RATES_HTTP_TIMEOUT),
+        )
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
 
 
 async def get_official_rates():
@@ -14,49 +43,81 @@ async def get_official_rates():
 
     url = f"https://api.fastforex.io/fetch-multi?from={BASE_CURRENCY}&to={','.join(TARGET_CURRENCIES)}&api_key={FAST_FOREX_API_KEY}"
 
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    return data.get("results", {})
-                logging.error(f"FastForex error: {resp.status} {await resp.text()}")
-        except Exception as e:
-            logging.error(f"FastForex connection error: {e}")
+    try:
+        async with get_session().get(url) as resp:
+            if resp.status == 200:
+                data = await resp.json()
+                return data.get("results", {})
+            logging.error(f"FastForex error: {resp.status} {await resp.text()}")
+    except Exception as e:
+        logging.error(f"FastForex connection error: {e}")
     return {}
 
 
-async def get_binance_p2p_rates():
-    """Получить ориентировочные курсы USDT на Binance P2P (покупка USDT)."""
-    url = "https://p2p.binance.com/bapi/c2c/v2/friendly/c2c/adv/search"
-    rates = {}
+def volume_weighted_price(advs: list, depth: int) -> float | None:
+    """Средняя цена по первым depth объявлениям, взвешенная доступным объёмом."""
+    total = weighted = 0.0
+    prices = []
+    for item in advs[:depth]:
+        adv = item.get("adv") or {}
+        try:
+            price = float(adv["price"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        try:
+            volume = float(adv.get("tradableQuantity") or adv.get("surplusAmount") or 0)
+        except (TypeError, ValueError):
+            volume = 0.0
+        prices.append(price)
+        if volume > 0:
+            weighted += price * volume
+            total += volume
+    if total > 0:
+        return weighted / total
+    # объёмы не пришли — простое среднее
+    return sum(prices) / len(prices) if prices else None
+
+
+async def _fetch_p2p_side(session: aiohttp.ClientSession, fiat: str, side: str, depth: int) -> float | None:
+    payload = {
+        "fiat": fiat,
+        "page": 1,
+        "rows": depth,
+        "tradeType": side,
+        "asset": "USDT",
+        "countries": [],
+        "proMerchantAds": False,
+        "shieldMerchantAds": False,
+        "publisherType": None,
+        "payTypes": [],
+    }
+    try:
+        async with session.post(BINANCE_P2P_URL, json=payload) as resp:
+            if resp.status != 200:
+                logging.warning(f"Binance P2P error {resp.status} for {fiat} {side}")
+                return None
+            data = await resp.json()
+    except Exception as e:
+        logging.error(f"Binance P2P error for {fiat} {side}: {e!r}")
+        return None
+    return volume_weighted_price(data.get("data") or [], depth)
 
-    async with aiohttp.ClientSession() as session:
-        for fiat in ["UZS", "RUB", "KZT", "KGS"]:
-            payload = {
-                "fiat": fiat,
-                "page": 1,
-                "rows": 5,
-                "tradeType": "BUY",
-                "asset": "USDT",
-                "countries": [],
-                "proMerchantAds": False,
-                "shieldMerchantAds": False,
-                "publisherType": None,
-                "payTypes": [],
-            }
-
-            try:
-                async with session.post(url, json=payload) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        advs = data.get("data", [])
-                        if advs:
-                            price = float(advs[0]["adv"]["price"])
-                            rates[f"USDT/{fiat}"] = price
-                    else:
-                        logging.warning(f"Binance P2P error {resp.status} for {fiat}")
-            except Exception as e:
-                logging.error(f"Binance P2P error for {fiat}: {e}")
 
+async def get_binance_p2p_rates(fiats: list = None, depth: int = None):
+    """
+    Курсы USDT на Binance P2P: {"USDT/UZS": {"buy": ..., "sell": ...}}.
+    buy — цена покупки USDT, sell — продажи; обе взвешены по объёму первых depth объявлений.
+    Все запросы (валюты × стороны) идут параллельно по общей сессии.
+    """
+    fiats = fiats or BINANCE_P2P_FIATS
+    depth = max(1, min(depth or BINANCE_P2P_DEPTH, 20))  # Binance отдаёт не больше 20 строк
+    session = get_session()
+
+    jobs = [(fiat, side) for fiat in fiats for side in P2P_SIDES]
+    prices = await asyncio.gather(*(_fetch_p2p_side(session, fiat, side, depth) for fiat, side in jobs))
+
+    rates = {}
+    for (fiat, side), price in zip(jobs, prices):
+        if price is not None:
+            rates.setdefault(f"USDT/{fiat}", {})[side.lower()] = price
     return rates
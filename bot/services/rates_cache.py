@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import time
+
+from config import RATES_OFFICIAL_TTL, RATES_P2P_TTL, RATES_RETRY_AFTER
+from bot.services.rates_api import get_official_rates, get_binance_p2p_rates
+
+
+class _Source:
+    __slots__ = ("name", "fetch", "ttl", "value", "fetched_at", "failed_at", "inflight")
+
+    def __init__(self, name: str, fetch, ttl: float):
+        self.name = name
+        self.fetch = fetch
+        self.ttl = ttl
+        self.value = {}
+        self.fetched_at = 0.0  # time.time() последнего удачного обновления, 0 — ещё не было
+        self.failed_at = 0.0
+        self.inflight: asyncio.Task | None = None
+
+
+class RatesCache:
+    """
+    Курсы в памяти вместо запроса к внешнему API на каждое нажатие.
+
+    get(): свежее значение отдаётся сразу; устаревшее тоже отдаётся сразу,
+    а в фоне запускается обновление (stale-while-revalidate); ждать приходится
+    только если данных ещё нет совсем. Одновременные вызовы делят один запрос.
+    Фоновая задача обновляет источники по их TTL, поэтому в обычной работе
+    обработчики читают только память.
+    """
+
+    def __init__(self, retry_after: float = 60.0):
+        self.retry_after = retry_after
+        self.sources: dict[str, _Source] = {}
+        self._refresher: asyncio.Task | None = None
+        self._listeners = []
+
+    def register(self, name: str, fetch, ttl: float):
+        """fetch — корутина без аргументов, возвращающая dict (пустой dict = неудача)."""
+        self.sources[name] = _Source(name, fetch, ttl)
+
+    def add_listener(self, callback):
+        """callback(name, value) — корутина, вызывается после каждого удачного обновления."""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def peek(self, name: str) -> dict:
+        """Последнее известное значение без ожидания (может быть пустым или устаревшим)."""
+        return self.sources[name].value
+
+    def fetched_at(self, name: str) -> float:
+        return self.sources[name].fetched_at
+
+    def is_fresh(self, name: str) -> bool:
+        source = self.sources[name]
+        return bool(source.fetched_at) and time.time() - source.fetched_at < source.ttl
+
+    async def get(self, name: str) -> dict:
+        source = self.sources[name]
+        if self.is_fresh(name):
+            return source.value
+        if source.fetched_at:
+            self._refresh_in_background(source)
+            return source.value
+        if source.failed_at and time.time() - source.failed_at < self.retry_after:
+            return source.value  # данных нет и источник только что не ответил — не ждём снова
+        # данных ещё нет — ждём (общий для всех вызывающих) запрос
+        return await self._refresh(source)
+
+    async def refresh(self, name: str) -> dict:
+        """Принудительно обновить источник (с объединением параллельных вызовов)."""
+        return await self._refresh(self.sources[name])
+
+    def _refresh(self, source: _Source) -> asyncio.Future:
+        if source.inflight is None or source.inflight.done():
+            source.inflight = asyncio.create_task(self._fetch(source))
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return asyncio.shield(source.inflight)
+
+    def _refresh_in_background(self, source: _Source):
+        if source.failed_at and time.time() - source.failed_at < self.retry_after:
+            return  # источник недавно не ответил — не долбим его на каждое нажатие
+        if source.inflight is None or source.inflight.done():
+            source.inflight = asyncio.create_task(self._fetch(source))
+
+    async def _fetch(self, source: _Source) -> dict:
+        started = time.perf_counter()
+        try:
+            value = await source.fetch()
+        except Exception as e:
+            logging.error(f"Rates source {source.name} failed: {e}")
+            value = None
+        if value:
+            source.value = value
+            source.fetched_at = time.time()
+            source.failed_at = 0.0
+            logging.info(f"Rates source {source.name} refreshed in {time.perf_counter() - started:.2f}s")
+            for callback in self._listeners:
+                try:
+                    await callback(source.name, value)
+                except Exception as e:
+                    logging.error(f"Rates listener for {source.name} failed: {e}")
+        else:
+            source.failed_at = time.time()
+        return source.value
+
+    # ---------- фоновое обновление ----------
+
+    def start(self):
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            for source in self.sources.values():
+                if source.inflight is not None and not source.inflight.done():
+                    continue
+                # чуть раньше TTL, чтобы читатели не застали устаревшие данные
+                due = source.fetched_at + source.ttl * 0.9 if source.fetched_at else 0
+                if source.failed_at:
+                    due = max(due, source.failed_at + self.retry_after)
+                if now >= due:
+                    source.inflight = asyncio.create_task(self._fetch(source))
+            await asyncio.sleep(1)
+
+    async def close(self):
+        tasks = [self._refresher] if self._refresher else []
+        tasks += [s.inflight for s in self.sources.values() if s.inflight and not s.inflight.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._refresher = None
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            name: {
+                "age": round(now - s.fetched_at, 1) if s.fetched_at else None,
+                "fresh": self.is_fresh(name),
+                "failing": bool(s.failed_at),
+            }
+            for name, s in self.sources.items()
+        }
+
+
+rates_cache = RatesCache(retry_after=RATES_RETRY_AFTER)
+rates_cache.register("official", get_official_rates, RATES_OFFICIAL_TTL)
+rates_cache.register("p2p", get_binance_p2p_rates, RATES_P2P_TTL)
@@ -29,15 +29,34 @@ def _within_window(start_time: str, end_time: str) -> bool:
     return now >= start or now <= end
 
 
-async def _mailing_job(task_id: int, user_id: int, template_id: int, target_groups: list, start_time: str, end_time: str):
+def _seconds_until(start_time: str) -> float:
+    """Seconds until the next occurrence of start_time (HH:MM)."""
+    now = datetime.datetime.now()
+    start = datetime.datetime.combine(now.date(), datetime.time.fromisoformat(start_time))
+    if start <= now:
+        start += datetime.timedelta(days=1)
+    return (start - now).total_seconds()
+
+
+async def _mailing_job(task_id: int, user_id: int, template_id: int, target_groups: list, start_time: str, end_time: str,
+                       retry: bool = False):
     if not _within_window(start_time, end_time):
-        logging.debug(f"Task {task_id} skipped (outside window {start_time}-{end_time})")
+        if retry:
+            # отложенные чаты не теряем: повтор переносится на начало следующего окна
+            logging.info(f"Task {task_id} retry outside window {start_time}-{end_time}, moved to {start_time}")
+            _schedule_retry(task_id, user_id, template_id, target_groups, start_time, end_time,
+                            _seconds_until(start_time))
+        else:
+            logging.debug(f"Task {task_id} skipped (outside window {start_time}-{end_time})")
         return
 
-    sent = await run_mailing_task(user_id, template_id, target_groups, task_id=task_id)
-    if sent:
+    # повтор отложенных чатов задачу не выключает, даже если не удался
+    result = await run_mailing_task(user_id, template_id, target_groups, task_id=None if retry else task_id)
+    if result:
         await update_last_run(task_id)
-    else:
+    if result.deferred:
+        _schedule_retry(task_id, user_id, template_id, result.deferred, start_time, end_time, result.retry_in)
+    elif result.should_deactivate and not retry:
         await deactivate_task(task_id)
         try:
             scheduler.remove_job(f"mailing_{task_id}")
@@ -46,6 +65,32 @@ async def _mailing_job(task_id: int, user_id: int, template_id: int, target_grou
             pass
 
 
+def _schedule_retry(task_id: int, user_id: int, template_id: int, target_groups: list, start_time: str, end_time: str,
+                    delay: float):
+    """
+    Отложенные FloodWait / slow mode чаты — отдельным разовым запуском, как только Telegram разрешит.
+    Если повтор задачи уже ждёт, чаты добавляются к нему, а запуск переносится на более ранний срок
+    (чаты, которым ещё рано, повтор снова отложит).
+    """
+    job_id = f"mailing_{task_id}_retry"
+    run_date = (datetime.datetime.now() + datetime.timedelta(seconds=max(1.0, delay))).astimezone()
+    pending = scheduler.get_job(job_id)
+    if pending is not None:
+        target_groups = list(dict.fromkeys([*pending.args[3], *target_groups]))
+        pending_at = getattr(pending, "next_run_time", None)
+        if pending_at is not None:
+            run_date = min(run_date, pending_at)
+    scheduler.add_job(
+        _mailing_job,
+        trigger="date",
+        run_date=run_date,
+        args=(task_id, user_id, template_id, target_groups, start_time, end_time, True),
+        id=job_id,
+        replace_existing=True,
+    )
+    logging.info(f"Task {task_id}: {len(target_groups)} chats deferred by flood limits, retry at {run_date:%H:%M:%S}")
+
+
 def schedule_mailing_task(task_id: int, user_id: int, template_id: int, target_groups: list, start_time: str, end_time: str, interval_minutes: int, run_immediately: bool = False):
     job_id = f"mailing_{task_id}"
     kwargs = {"next_run_time": datetime.datetime.now()} if run_immediately else {}
@@ -69,6 +114,10 @@ def stop_mailing_job(task_id: int):
         logging.info(f"Stopped mailing job {job_id}")
     except Exception:
         pass
+    try:
+        scheduler.remove_job(f"{job_id}_retry")
+    except Exception:
+        pass
 
 
 async def load_scheduled_mailings():
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import random
+import time
+
+from config import (
+    MAILING_SEND_RATE,
+    MAILING_SEND_BURST,
+    MAILING_JITTER_MIN,
+    MAILING_JITTER_MAX,
+    MAILING_JITTER_DIST,
+    MAILING_FLOOD_BACKOFF,
+    MAILING_FLOOD_MIN_FACTOR,
+    MAILING_FLOOD_RECOVERY,
+)
+
+JITTER_DISTRIBUTIONS = ("uniform", "triangular", "exponential")
+
+
+class _Bucket:
+    __slots__ = ("tokens", "refilled", "next_at", "factor", "cooldown_until", "flood_waits")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.refilled = now
+        self.next_at = now
+        self.factor = 1.0  # доля от базового темпа; падает после FloodWait
+        self.cooldown_until = 0.0
+        self.flood_waits = 0
+
+
+class SendPacer:
+    """
+    Темп отправки рассылок для каждого userbot-аккаунта.
+
+    Token bucket ограничивает средний темп (rate сообщений в минуту, до burst подряд),
+    а случайная пауза (jitter) разводит соседние отправки аккаунта — как живой человек.
+    Слот отправки резервируется сразу и без блокировок: чаты одной рассылки (и разных
+    рассылок одного аккаунта) получают разные моменты времени и ждут каждый свой,
+    так что подготовка следующих чатов идёт, пока предыдущие ждут очереди.
+
+    FloodWait ставит аккаунт на паузу ровно на указанное время и снижает его темп
+    (в backoff раз, не ниже min_factor); каждая удачная отправка возвращает по recovery.
+    SlowmodeWait касается одного чата — в него нельзя писать до конца паузы.
+    """
+
+    def __init__(self, rate_per_minute: float = 12.0, burst: int = 3,
+                 jitter_min: float = 2.0, jitter_max: float = 6.0, jitter_dist: str = "uniform",
+                 backoff: float = 0.5, min_factor: float = 0.1, recovery: float = 0.05):
+        self.rate = max(0.1, rate_per_minute) / 60.0
+        self.burst = max(1, burst)
+        self.jitter_min = max(0.0, jitter_min)
+        self.jitter_max = max(self.jitter_min, jitter_max)
+        self.jitter_dist = jitter_dist if jitter_dist in JITTER_DISTRIBUTIONS else "uniform"
+        self.backoff = min(1.0, max(0.01, backoff))
+        self.min_factor = min(1.0, max(0.01, min_factor))
+        self.recovery = max(0.0, recovery)
+        self._buckets: dict[int, _Bucket] = {}
+        self._chat_until: dict[int, float] = {}  # chat_id -> конец slow mode (time.monotonic)
+
+        self.flood_waits = 0
+        self.slowmode_waits = 0
+
+    def jitter(self) -> float:
+        low, high = self.jitter_min, self.jitter_max
+        if high <= low:
+            return low
+        if self.jitter_dist == "triangular":
+            # чаще короткие паузы, изредка длинные
+            return random.triangular(low, high, low)
+        if self.jitter_dist == "exponential":
+            return min(high, low + random.expovariate(2.0 / (high - low)))
+        return random.uniform(low, high)
+
+    def _bucket(self, account_id: int) -> _Bucket:
+        bucket = self._buckets.get(account_id)
+        if bucket is None:
+            bucket = self._buckets[account_id] = _Bucket(self.burst, time.monotonic())
+        return bucket
+
+    def reserve(self, account_id: int, not_before: float = 0.0) -> float:
+        """Занять следующий слот аккаунта (не раньше not_before); возвращает момент отправки (time.monotonic)."""
+        now = time.monotonic()
+        bucket = self._bucket(account_id)
+        rate = self.rate * bucket.factor
+
+        at = max(now, bucket.next_at, bucket.cooldown_until, not_before)
+        bucket.tokens = min(self.burst, bucket.tokens + (at - bucket.refilled) * rate)
+        bucket.refilled = at
+        if bucket.tokens < 1:
+            # ждём, пока накопится целый токен
+            at += (1 - bucket.tokens) / rate
+            bucket.tokens = 1
+            bucket.refilled = at
+        bucket.tokens -= 1
+        bucket.next_at = at + self.jitter()
+        return at
+
+    async def acquire(self, account_id: int):
+        await wait_until(self.reserve(account_id))
+
+    def ready_at(self, account_id: int, chat_id: int | None = None) -> float:
+        """Раньше этого момента (time.monotonic) аккаунту / в чат писать нельзя."""
+        bucket = self._buckets.get(account_id)
+        at = bucket.cooldown_until if bucket else 0.0
+        if chat_id is not None:
+            at = max(at, self._chat_until.get(chat_id, 0.0))
+        return at
+
+    def on_success(self, account_id: int):
+        bucket = self._buckets.get(account_id)
+        if bucket is not None and bucket.factor < 1.0:
+            bucket.factor = min(1.0, bucket.factor + self.recovery)
+
+    def on_flood_wait(self, account_id: int, seconds: float) -> float:
+        """FloodWait аккаунта: пауза на seconds и сниженный темп. Возвращает конец паузы."""
+        bucket = self._bucket(account_id)
+        until = time.monotonic() + seconds
+        bucket.cooldown_until = max(bucket.cooldown_until, until)
+        bucket.tokens = 0.0
+        bucket.refilled = bucket.cooldown_until
+        bucket.factor = max(self.min_factor, bucket.factor * self.backoff)
+        bucket.flood_waits += 1
+        self.flood_waits += 1
+        logging.warning(
+            f"FloodWait {seconds}s for account {account_id}: paused, send rate now "
+            f"{self.rate * bucket.factor * 60:.1f}/min"
+        )
+        return bucket.cooldown_until
+
+    def on_slowmode_wait(self, chat_id: int, seconds: float) -> float:
+        until = max(self._chat_until.get(chat_id, 0.0), time.monotonic() + seconds)
+        self._chat_until[chat_id] = until
+        self.slowmode_waits += 1
+        self._prune_chats()
+        return until
+
+    def backlog(self, account_id: int) -> float:
+        """Сколько секунд расписано у аккаунта вперёд."""
+        bucket = self._buckets.get(account_id)
+        return max(0.0, bucket.next_at - time.monotonic()) if bucket else 0.0
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "accounts": len(self._buckets),
+            "cooling_accounts": sum(1 for b in self._buckets.values() if b.cooldown_until > now),
+            "slowed_accounts": sum(1 for b in self._buckets.values() if b.factor < 1.0),
+            "slowmode_chats": sum(1 for until in self._chat_until.values() if until > now),
+            "flood_waits": self.flood_waits,
+            "slowmode_waits": self.slowmode_waits,
+        }
+
+    def _prune_chats(self):
+        if len(self._chat_until) > 10000:
+            now = time.monotonic()
+            self._chat_until = {chat: t for chat, t in self._chat_until.items() if t > now}
+
+
+async def wait_until(at: float):
+    delay = at - time.monotonic()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+send_pacer = SendPacer(
+    rate_per_minute=MAILING_SEND_RATE,
+    burst=MAILING_SEND_BURST,
+    jitter_min=MAILING_JITTER_MIN,
+    jitter_max=MAILING_JITTER_MAX,
+    jitter_dist=MAILING_JITTER_DIST,
+    backoff=MAILING_FLOOD_BACKOFF,
+    min_factor=MAILING_FLOOD_MIN_FACTOR,
+    recovery=MAILING_FLOOD_RECOVERY,
+)
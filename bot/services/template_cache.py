@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+
+from pyrogram import enums
+from pyrogram.enums import MessageEntityType
+from pyrogram.types import MessageEntity
+
+from bot.database.database import get_template
+
+# aiogram entity type -> Pyrogram (у text_mention нет объекта User — отправляется как есть)
+ENTITY_TYPES = {
+    "bold": MessageEntityType.BOLD,
+    "italic": MessageEntityType.ITALIC,
+    "underline": MessageEntityType.UNDERLINE,
+    "strikethrough": MessageEntityType.STRIKETHROUGH,
+    "spoiler": MessageEntityType.SPOILER,
+    "code": MessageEntityType.CODE,
+    "pre": MessageEntityType.PRE,
+    "text_link": MessageEntityType.TEXT_LINK,
+    "text_mention": MessageEntityType.TEXT_MENTION,
+    "custom_emoji": MessageEntityType.CUSTOM_EMOJI,
+    "blockquote": MessageEntityType.BLOCKQUOTE,
+}
+
+# media_type -> (метод клиента, есть ли подпись, действие "печатает/загружает")
+SEND_METHODS = {
+    "text": ("send_message", False, enums.ChatAction.TYPING),
+    "photo": ("send_photo", True, enums.ChatAction.UPLOAD_PHOTO),
+    "video": ("send_video", True, enums.ChatAction.UPLOAD_VIDEO),
+    "animation": ("send_animation", True, enums.ChatAction.UPLOAD_PHOTO),
+    "audio": ("send_audio", True, enums.ChatAction.UPLOAD_AUDIO),
+    "voice": ("send_voice", True, enums.ChatAction.UPLOAD_PHOTO),
+    "document": ("send_document", True, enums.ChatAction.UPLOAD_DOCUMENT),
+    "video_note": ("send_video_note", False, enums.ChatAction.UPLOAD_PHOTO),
+}
+
+MAX_CACHED_TEMPLATES = 1000
+
+
+class TemplatePayload:
+    """Шаблон, готовый к отправке: разобранные entities, метод клиента, действие чата."""
+
+    __slots__ = ("template_id", "media_type", "content", "caption", "entities",
+                 "method", "with_caption", "action", "entities_key", "bot_file_id", "file_key")
+
+    def __init__(self, template_id: int, media_type: str, content, caption, entities: list):
+        self.template_id = template_id
+        self.media_type = media_type
+        self.content = content
+        self.caption = caption
+        self.entities = entities
+        self.method, self.with_caption, self.action = SEND_METHODS.get(
+            media_type, ("send_message", False, enums.ChatAction.TYPING)
+        )
+        self.entities_key = "entities" if media_type == "text" else "caption_entities"
+
+        # медиа из Bot API (file_id): его userbot загружает сам, см. media_uploads.
+        # file_key — ключ по file_id, а не по байтам: тот же файл, присланный боту заново,
+        # получит другой file_id и будет загружен ещё раз
+        self.bot_file_id = None
+        self.file_key = None
+        if media_type != "text" and content and isinstance(content, str) and not os.path.exists(content):
+            self.bot_file_id = content
+            self.file_key = hashlib.sha1(f"{media_type}:{content}".encode()).hexdigest()
+
+    def send_kwargs(self, topic_id: int | None = None) -> dict:
+        kwargs = {}
+        if topic_id:
+            # Use reply_to_message_id for topics (older Pyrogram / standard API behavior)
+            kwargs["reply_to_message_id"] = topic_id
+        if self.entities:
+            kwargs[self.entities_key] = self.entities
+        return kwargs
+
+    async def send(self, client, chat_id: int, content, kwargs: dict):
+        if self.media_type not in SEND_METHODS:
+            return await client.send_message(chat_id, f"Unsupported media type: {self.media_type}", **kwargs)
+        method = getattr(client, self.method)
+        if self.with_caption:
+            return await method(chat_id, content, caption=self.caption, **kwargs)
+        return await method(chat_id, content, **kwargs)
+
+
+def compile_entities(entities_json: str | None) -> list:
+    if not entities_json:
+        return []
+    entities = []
+    try:
+        for e in json.loads(entities_json):
+            pyro_type = ENTITY_TYPES.get(e["type"])
+            if pyro_type is None:
+                continue
+            entities.append(MessageEntity(
+                type=pyro_type,
+                offset=e["offset"],
+                length=e["length"],
+                url=e.get("url"),
+                user=None,
+                language=e.get("language"),
+                custom_emoji_id=e.get("custom_emoji_id"),
+            ))
+    except Exception as e:
+        logging.error(f"Failed to parse entities: {e}")
+    return entities
+
+
+def compile_template(template) -> TemplatePayload:
+    """Строка templates -> TemplatePayload."""
+    caption = template["caption"] if "caption" in template.keys() else None
+    entities_json = template["entities"] if "entities" in template.keys() else None
+    return TemplatePayload(
+        template["id"], template["media_type"], template["content"], caption, compile_entities(entities_json)
+    )
+
+
+_cache: OrderedDict[int, TemplatePayload] = OrderedDict()
+
+
+async def get_template_payload(template_id: int) -> TemplatePayload | None:
+    """Скомпилированный шаблон из памяти; из БД — только при первом обращении."""
+    payload = _cache.get(template_id)
+    if payload is not None:
+        _cache.move_to_end(template_id)
+        return payload
+    template = await get_template(template_id)
+    if not template:
+        return None
+    payload = compile_template(template)
+    _cache[template_id] = payload
+    while len(_cache) > MAX_CACHED_TEMPLATES:
+        _cache.popitem(last=False)
+    return payload
+
+
+def invalidate_template(template_id: int | None = None):
+    """Сбросить шаблон (или весь кэш) — после add_template / delete_template."""
+    if template_id is None:
+        _cache.clear()
+    else:
+        _cache.pop(template_id, None)
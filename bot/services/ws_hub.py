@@ -0,0 +1,248 @@
+import asyncio
+import logging
+from collections import deque
+
+from aiohttp import WSCloseCode
+
+from config import WS_QUEUE_SIZE, WS_SEND_TIMEOUT, WS_MAX_LAG_DROPS, WS_MAX_TOPICS
+from bot.services.json_codec import dumps
+
+# Темы подписки: "location:<район>", "currency:<код>", "order:<id>", "user:<id>"
+TOPIC_KINDS = {"location", "currency", "order", "user"}
+MAX_TOPIC_VALUE = 64
+
+
+def topic(kind: str, value) -> str | None:
+    """Нормализованное имя темы или None, если значение не годится."""
+    value = str(value if value is not None else "").strip().lower()
+    if kind not in TOPIC_KINDS or not value or len(value) > MAX_TOPIC_VALUE:
+        return None
+    return f"{kind}:{value}"
+
+
+def parse_topic(raw) -> str | None:
+    """'Location:Chilonzor ' -> 'location:chilonzor'."""
+    if not isinstance(raw, str) or ":" not in raw:
+        return None
+    kind, value = raw.split(":", 1)
+    return topic(kind.strip().lower(), value)
+
+
+class WSClient:
+    """Одно WebSocket-соединение со своей ограниченной очередью исходящих."""
+
+    def __init__(self, ws, max_queue: int):
+        self.ws = ws
+        self.max_queue = max(1, max_queue)
+        self.queue = deque()  # [key, message]
+        self.ready = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.sent = 0
+        self.dropped = 0
+        self.lag_drops = 0  # потери с момента последней успешной отправки
+        self.last_progress = asyncio.get_running_loop().time()
+        self.slow = False
+        self.closing = False
+        self.topics: set[str] = set()
+
+    def offer(self, message: str, key: str | None = None) -> str:
+        """
+        Положить сообщение в очередь, не блокируясь.
+        Возвращает 'queued' / 'coalesced' / 'dropped'.
+        """
+        if key is not None:
+            # более свежее событие о том же объекте заменяет ещё не отправленное
+            for item in self.queue:
+                if item[0] == key:
+                    item[1] = message
+                    return "coalesced"
+
+        result = "queued"
+        if not self.queue:
+            self.last_progress = asyncio.get_running_loop().time()
+        if len(self.queue) >= self.max_queue:
+            self.queue.popleft()
+            self.dropped += 1
+            self.lag_drops += 1
+            result = "dropped"
+        self.queue.append([key, message])
+        self.ready.set()
+        return result
+
+
+class WSHub:
+    """
+    Рассылка событий по WebSocket без ожидания клиентов.
+
+    publish() кодирует событие один раз и раскладывает по очередям клиентов;
+    каждую очередь разгребает своя задача. Медленный клиент теряет старые
+    сообщения, а если отстал на WS_MAX_LAG_DROPS и дольше WS_SEND_TIMEOUT
+    ничего не принял — отключается (клиент переподключится и перечитает ленту).
+    Короткий всплеск событий здорового клиента не отключает.
+    """
+
+    def __init__(self, max_queue: int = 64, send_timeout: float = 10.0, max_lag_drops: int = 64, max_topics: int = 50):
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.max_lag_drops = max(1, max_lag_drops)
+        self.max_topics = max_topics
+        self.clients: set[WSClient] = set()
+        self.routes: dict[str, set[WSClient]] = {}  # тема -> подписанные сокеты
+
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.slow_disconnects = 0
+
+    def register(self, ws) -> WSClient:
+        client = WSClient(ws, self.max_queue)
+        client.task = asyncio.create_task(self._drain(client))
+        self.clients.add(client)
+        return client
+
+    async def unregister(self, client: WSClient):
+        self.clients.discard(client)
+        self.unsubscribe(client, list(client.topics))
+        # wait_for (3.11) теряет cancel(), если send_str завершился в тот же момент, —
+        # поэтому drain ещё и будим с флагом, иначе он навсегда заснёт в ready.wait()
+        client.closing = True
+        client.ready.set()
+        if client.task is not None and client.task is not asyncio.current_task():
+            client.task.cancel()
+            try:
+                await client.task
+            except asyncio.CancelledError:
+                pass
+
+    def subscribe(self, client: WSClient, topics) -> list[str]:
+        """Подписать сокет на темы; возвращает принятые (нормализованные) темы."""
+        accepted = []
+        for raw in topics:
+            name = parse_topic(raw)
+            if name is None:
+                continue
+            if name not in client.topics:
+                if len(client.topics) >= self.max_topics:
+                    break
+                client.topics.add(name)
+                self.routes.setdefault(name, set()).add(client)
+            accepted.append(name)
+        return accepted
+
+    def unsubscribe(self, client: WSClient, topics) -> list[str]:
+        removed = []
+        for raw in topics:
+            name = parse_topic(raw)
+            if name is None or name not in client.topics:
+                continue
+            client.topics.discard(name)
+            subscribers = self.routes.get(name)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self.routes[name]
+            removed.append(name)
+        return removed
+
+    def send(self, client: WSClient, event_type: str, data) -> str:
+        """Ответ одному сокету (подтверждение подписки, ошибка протокола)."""
+        return client.offer(dumps({"type": event_type, "data": data}))
+
+    def publish(self, event_type: str, data, key: str | None = None, topics=None) -> int:
+        """
+        Разослать событие; возвращает число клиентов, которым оно поставлено в очередь.
+        topics=None — всем сокетам, иначе только подписанным хотя бы на одну из тем
+        (каждый сокет получает событие один раз).
+        """
+        if topics is None:
+            targets = list(self.clients)
+        else:
+            targets = set()
+            for name in topics:
+                if name and name in self.routes:
+                    targets |= self.routes[name]
+        self.published += 1
+        if not targets:
+            return 0
+
+        message = dumps({"type": event_type, "data": data})
+        count = 0
+        for client in targets:
+            if client.slow:
+                continue
+            result = client.offer(message, key)
+            count += 1
+            if result == "coalesced":
+                self.coalesced += 1
+            elif result == "dropped":
+                self.dropped += 1
+                stalled = asyncio.get_running_loop().time() - client.last_progress
+                if client.lag_drops >= self.max_lag_drops and stalled >= self.send_timeout:
+                    client.slow = True
+                    client.ready.set()
+        return count
+
+    async def _drain(self, client: WSClient):
+        ws = client.ws
+        try:
+            while not ws.closed and not client.closing:
+                if client.slow:
+                    self.slow_disconnects += 1
+                    logging.warning(
+                        f"WebSocket client too slow ({client.dropped} dropped, "
+                        f"{len(client.queue)} queued), disconnecting"
+                    )
+                    await asyncio.wait_for(
+                        ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=b"slow consumer"),
+                        self.send_timeout
+                    )
+                    break
+                if not client.queue:
+                    client.ready.clear()
+                    await client.ready.wait()
+                    continue
+                _, message = client.queue.popleft()
+                await asyncio.wait_for(ws.send_str(message), self.send_timeout)
+                client.sent += 1
+                client.lag_drops = 0
+                client.last_progress = asyncio.get_running_loop().time()
+                self.delivered += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # таймаут или обрыв: соединение закрываем, websocket_handler его отпишет
+            if isinstance(e, asyncio.TimeoutError):
+                self.slow_disconnects += 1
+            logging.info(f"WebSocket send failed, closing: {e!r}")
+            if not ws.closed:
+                try:
+                    await asyncio.wait_for(ws.close(code=WSCloseCode.GOING_AWAY), 1)
+                except Exception:
+                    pass
+
+    def stats(self) -> dict:
+        depths = [len(client.queue) for client in self.clients]
+        return {
+            "clients": len(depths),
+            "topics": len(self.routes),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "slow_disconnects": self.slow_disconnects,
+        }
+
+    async def close(self):
+        for client in list(self.clients):
+            await self.unregister(client)
+
+
+hub = WSHub(
+    max_queue=WS_QUEUE_SIZE,
+    send_timeout=WS_SEND_TIMEOUT,
+    max_lag_drops=WS_MAX_LAG_DROPS,
+    max_topics=WS_MAX_TOPICS,
+)
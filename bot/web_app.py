@@ -1,5 +1,6 @@
 import os
-import json
+import base64
+import hashlib
 import logging
 import asyncio
 from aiohttp import web, WSMsgType
@@ -8,20 +9,22 @@ from bot.database.database import (
     get_user_orders, place_bid, get_order_bids, create_market_post, get_market_posts,
     verify_seller_code
 )
+from bot.services.json_codec import json_response, loads
+from bot.services.ws_hub import hub, topic
+from bot.services.notifier import notifier
+from bot.services.compression import choose_encoding, is_compressible, compress, precompress_static
+from bot.services.media_store import (
+    MediaError, store_image, is_valid_key, media_path, thumb_path, CONTENT_TYPES
+)
 
-# WebSocket clients for real-time updates
-ws_clients = set()
-
-async def broadcast_update(event_type: str, data: dict):
-    """Broadcast update to all connected WebSocket clients"""
-    message = json.dumps({"type": event_type, "data": data})
-    disconnected = set()
-    for ws in ws_clients:
-        try:
-            await ws.send_str(message)
-        except:
-            disconnected.add(ws)
-    ws_clients.difference_update(disconnected)
+async def broadcast_update(event_type: str, data: dict, key: str = None, topics: list = None):
+    """
+    Broadcast update to WebSocket clients subscribed to any of `topics`
+    (all clients if topics is None).
+    Only enqueues: delivery happens in per-client tasks of the hub.
+    Events with the same key replace each other while still queued.
+    """
+    hub.publish(event_type, data, key=key, topics=topics)
 
 # Middleware to log all requests
 @web.middleware
@@ -29,29 +32,179 @@ async def log_requests(request, handler):
     logging.info(f"Incoming request: {request.method} {request.path}")
     return await handler(request)
 
+# ============= COMPRESSION / ETAG =============
+
+# Списки, которые мини-апп постоянно перезапрашивает: неизменный ответ -> 304
+ETAG_PATHS = {'/api/market', '/api/categories', '/api/orders/active'}
+# Больше этого сжимаем в потоке, чтобы не держать event loop
+COMPRESS_IN_THREAD_BYTES = 64 * 1024
+
+def _etag_match(if_none_match: str, etag: str) -> str | None:
+    """
+    If-None-Match сравнивается слабо: W/ и суффикс кодировки (-gzip/-br) не важны.
+    Возвращает совпавший тег в том виде, в каком его прислал клиент.
+    """
+    tag = etag.strip('"')
+    for raw in if_none_match.split(','):
+        raw = raw.strip()
+        if raw == '*':
+            return etag
+        candidate = raw.removeprefix('W/').strip('"')
+        for suffix in ('-gzip', '-br'):
+            candidate = candidate.removesuffix(suffix)
+        if candidate == tag:
+            return raw
+    return None
+
+@web.middleware
+async def conditional_get(request, handler):
+    response = await handler(request)
+    if (request.method not in ('GET', 'HEAD') or request.path not in ETAG_PATHS
+            or response.status != 200 or not isinstance(response, web.Response)
+            or not isinstance(response.body, bytes)):
+        return response
+
+    # X-Next-Cursor входит в представление страницы, поэтому и в хэш
+    digest = hashlib.blake2b(response.body, digest_size=16)
+    digest.update(response.headers.get('X-Next-Cursor', '').encode())
+    etag = f'"{digest.hexdigest()}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+    matched = _etag_match(request.headers.get('If-None-Match', ''), etag)
+    if matched:
+        # 304 повторяет тег закэшированного клиентом представления (с суффиксом кодировки)
+        headers['ETag'] = matched
+        for name in ('X-Next-Cursor', 'Access-Control-Expose-Headers'):
+            if name in response.headers:
+                headers[name] = response.headers[name]
+        return web.Response(status=304, headers=headers)
+    response.headers.update(headers)
+    return response
+
+@web.middleware
+async def compress_responses(request, handler):
+    response = await handler(request)
+    # FileResponse (статика) сам отдаёт предсжатые .br/.gz, WebSocket и стримы не трогаем
+    if (not isinstance(response, web.Response) or not isinstance(response.body, bytes)
+            or 'Content-Encoding' in response.headers
+            or not is_compressible(response.content_type, len(response.body))):
+        return response
+
+    response.headers['Vary'] = 'Accept-Encoding'
+    encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+    if not encoding:
+        return response
+
+    body = response.body
+    if len(body) >= COMPRESS_IN_THREAD_BYTES:
+        packed = await asyncio.to_thread(compress, body, encoding)
+    else:
+        packed = compress(body, encoding)
+    response.body = packed
+    response.headers['Content-Encoding'] = encoding
+
+    # Сильный ETag обязан отличаться для разных кодировок
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        response.headers['ETag'] = f'{etag[:-1]}-{encoding}"'
+    return response
+
+async def _precompress_client(app):
+    written = await asyncio.to_thread(precompress_static, CLIENT_DIST_DIR)
+    if written:
+        logging.info(f"Precompressed {written} static files in {CLIENT_DIST_DIR}")
+
+async def _close_ws_hub(app):
+    await hub.close()
+
+# ============= PAGINATION =============
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+def _encode_cursor(item: dict) -> str:
+    raw = f"{item['created_at']}|{item['id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _decode_cursor(cursor: str) -> tuple:
+    padded = cursor + '=' * (-len(cursor) % 4)
+    created_at, item_id = base64.urlsafe_b64decode(padded).decode().rsplit('|', 1)
+    return created_at, int(item_id)
+
+def _page_params(request, default=DEFAULT_PAGE_SIZE):
+    """
+    ?limit=&cursor= -> (limit, before). ValueError при мусоре в параметрах.
+    default=None: без limit и cursor страница не ограничена (limit None).
+    """
+    if default is None and 'limit' not in request.query and 'cursor' not in request.query:
+        return None, None
+    limit = int(request.query.get('limit', DEFAULT_PAGE_SIZE))
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    cursor = request.query.get('cursor')
+    before = _decode_cursor(cursor) if cursor else None
+    return limit, before
+
+def _fetch_limit(limit):
+    """Сколько строк просить у БД: limit + 1 (признак следующей страницы) или -1 — все."""
+    return -1 if limit is None else limit + 1
+
+def _page_response(items: list, limit):
+    """items запрошены с _fetch_limit(limit): лишняя строка означает, что есть следующая страница."""
+    headers = {'Access-Control-Expose-Headers': 'X-Next-Cursor'}
+    if limit is not None and len(items) > limit:
+        items = items[:limit]
+        headers['X-Next-Cursor'] = _encode_cursor(items[-1])
+    return json_response(items, headers=headers)
+
+def _bad_page_params():
+    return json_response({'error': 'bad_cursor'}, status=400)
+
 routes = web.RouteTableDef()
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CLIENT_DIST_DIR = os.path.join(BASE_DIR, 'client', 'dist')
 
+def _handle_ws_message(client, raw: str):
+    """
+    {"type": "subscribe", "topics": ["location:Chilonzor", "currency:USD", "order:12", "user:42"]}
+    {"type": "unsubscribe", "topics": [...]}
+    """
+    try:
+        message = loads(raw)
+        action = message.get('type')
+        topics = message.get('topics') or []
+        if not isinstance(topics, list):
+            raise ValueError
+    except (ValueError, AttributeError):
+        hub.send(client, 'error', {'error': 'bad_message'})
+        return
+
+    if action == 'subscribe':
+        accepted = hub.subscribe(client, topics)
+        hub.send(client, 'subscribed', {'topics': accepted, 'active': sorted(client.topics)})
+    elif action == 'unsubscribe':
+        removed = hub.unsubscribe(client, topics)
+        hub.send(client, 'unsubscribed', {'topics': removed, 'active': sorted(client.topics)})
+    elif action != 'ping':
+        hub.send(client, 'error', {'error': 'unknown_type'})
+
 @routes.get('/ws')
 async def websocket_handler(request):
     """WebSocket endpoint for real-time updates"""
     ws = web.WebSocketResponse()
     await ws.prepare(request)
     
-    ws_clients.add(ws)
-    logging.info(f"WebSocket client connected. Total: {len(ws_clients)}")
+    client = hub.register(ws)
+    logging.info(f"WebSocket client connected. Total: {len(hub.clients)}")
     
     try:
         async for msg in ws:
             if msg.type == WSMsgType.TEXT:
-                # Handle incoming messages if needed
-                pass
+                _handle_ws_message(client, msg.data)
             elif msg.type == WSMsgType.ERROR:
                 logging.error(f'WebSocket error: {ws.exception()}')
     finally:
-        ws_clients.discard(ws)
-        logging.info(f"WebSocket client disconnected. Total: {len(ws_clients)}")
+        await hub.unregister(client)
+        logging.info(f"WebSocket client disconnected. Total: {len(hub.clients)}")
     
     return ws
 
@@ -67,11 +220,38 @@ async def handle_index(request):
 # Serve static assets
 routes.static('/assets', os.path.join(CLIENT_DIST_DIR, 'assets'))
 
+MEDIA_CACHE_HEADERS = {'Cache-Control': 'public, max-age=31536000, immutable'}
+
+async def _serve_media(key: str, path: str):
+    # Ключ = sha256 содержимого, поэтому файл по этому URL никогда не меняется
+    if not is_valid_key(key) or not os.path.exists(path):
+        return web.Response(status=404)
+    ext = key.rsplit('.', 1)[1]
+    headers = dict(MEDIA_CACHE_HEADERS, **{'Content-Type': CONTENT_TYPES[ext], 'ETag': f'"{key}"'})
+    return web.FileResponse(path, headers=headers)
+
+@routes.get('/media/thumb/{key}')
+async def handle_media_thumb(request):
+    key = request.match_info['key']
+    if not is_valid_key(key):
+        return web.Response(status=404)
+    path = thumb_path(key)
+    if not os.path.exists(path):
+        path = media_path(key)  # превью ещё не сделано — отдаём оригинал
+    return await _serve_media(key, path)
+
+@routes.get('/media/{key}')
+async def handle_media(request):
+    key = request.match_info['key']
+    if not is_valid_key(key):
+        return web.Response(status=404)
+    return await _serve_media(key, media_path(key))
+
 @routes.get('/api/init')
 async def handle_init(request):
     user_id = request.query.get('user_id')
     if not user_id:
-        return web.json_response({'error': 'Missing user_id'}, status=400)
+        return json_response({'error': 'Missing user_id'}, status=400)
     
     user = await get_user(int(user_id))
     if user:
@@ -79,8 +259,8 @@ async def handle_init(request):
             role = user[6]
         except IndexError:
             role = None
-        return web.json_response({'role': role})
-    return web.json_response({'role': None})
+        return json_response({'role': role})
+    return json_response({'role': None})
 
 @routes.post('/api/role')
 async def handle_set_role(request):
@@ -88,7 +268,7 @@ async def handle_set_role(request):
     user_id = data.get('user_id')
     role = data.get('role')
     await update_user_role(int(user_id), role)
-    return web.json_response({'status': 'ok'})
+    return json_response({'status': 'ok'})
 
 import time
 RATE_LIMITS = {}
@@ -102,11 +282,11 @@ async def handle_check_nickname(request):
     nickname = data.get('nickname', '')
     
     if not nickname or len(nickname) < 3:
-        return web.json_response({'available': False, 'error': 'too_short'})
+        return json_response({'available': False, 'error': 'too_short'})
     
     from bot.database.database import check_nickname_exists
     exists = await check_nickname_exists(nickname)
-    return web.json_response({'available': not exists})
+    return json_response({'available': not exists})
 
 @routes.post('/api/auth/register')
 async def handle_register(request):
@@ -118,15 +298,15 @@ async def handle_register(request):
     telegram_id = data.get('telegram_id')  # From Telegram WebApp initData
     
     if not nickname or len(nickname) < 3:
-        return web.json_response({'error': 'nickname_too_short'}, status=400)
+        return json_response({'error': 'nickname_too_short'}, status=400)
     if not password or len(password) < 4:
-        return web.json_response({'error': 'password_too_short'}, status=400)
+        return json_response({'error': 'password_too_short'}, status=400)
     
     from bot.database.database import register_web_account
     result = await register_web_account(nickname, name or nickname, password)
     
     if 'error' in result:
-        return web.json_response(result, status=400)
+        return json_response(result, status=400)
     
     logging.info(f"New account registered: {nickname}, code: {result['code']}")
     
@@ -146,7 +326,7 @@ async def handle_register(request):
             except Exception as e:
                 logging.error(f"Failed to send code to {telegram_id}: {e}")
     
-    return web.json_response(result)
+    return json_response(result)
 
 @routes.post('/api/auth/login')
 async def handle_login(request):
@@ -159,9 +339,9 @@ async def handle_login(request):
     result = await login_web_account(nickname, password)
     
     if 'error' in result:
-        return web.json_response(result, status=401)
+        return json_response(result, status=401)
     
-    return web.json_response(result)
+    return json_response(result)
 
 @routes.post('/api/auth/check-verified')
 async def handle_check_verified(request):
@@ -171,7 +351,7 @@ async def handle_check_verified(request):
     
     from bot.database.database import check_code_verified
     result = await check_code_verified(code)
-    return web.json_response(result)
+    return json_response(result)
 
 @routes.post('/api/auth/request-seller-code')
 async def handle_request_seller_code(request):
@@ -180,7 +360,7 @@ async def handle_request_seller_code(request):
     telegram_id = data.get('telegram_id')
     
     if not telegram_id:
-        return web.json_response({'error': 'missing_telegram_id'}, status=400)
+        return json_response({'error': 'missing_telegram_id'}, status=400)
     
     from bot.database.database import generate_seller_code
     code = await generate_seller_code(int(telegram_id))
@@ -197,16 +377,16 @@ async def handle_request_seller_code(request):
                 parse_mode="HTML"
             )
             logging.info(f"Seller code sent to {telegram_id}")
-            return web.json_response({'success': True, 'code_sent': True})
+            return json_response({'success': True, 'code_sent': True})
         except Exception as e:
             error_msg = str(e).lower()
             logging.error(f"Failed to send seller code to {telegram_id}: {e}")
             # Check if bot is blocked
             if 'blocked' in error_msg or 'forbidden' in error_msg or 'chat not found' in error_msg:
-                return web.json_response({'error': 'BOT_BLOCKED'}, status=400)
-            return web.json_response({'error': 'send_failed'}, status=500)
+                return json_response({'error': 'BOT_BLOCKED'}, status=400)
+            return json_response({'error': 'send_failed'}, status=500)
     
-    return web.json_response({'error': 'bot_not_available'}, status=500)
+    return json_response({'error': 'bot_not_available'}, status=500)
 
 
 @routes.post('/api/auth/verify-seller')
@@ -218,16 +398,16 @@ async def handle_verify_seller(request):
     telegram_id = data.get('telegram_id')
     
     if not code:
-        return web.json_response({'error': 'missing_code'}, status=400)
+        return json_response({'error': 'missing_code'}, status=400)
     
     if not account_id and not telegram_id:
-        return web.json_response({'error': 'missing_id'}, status=400)
+        return json_response({'error': 'missing_id'}, status=400)
     
     success = await verify_seller_code(code, account_id=account_id, telegram_id=telegram_id)
     
     if success:
-        return web.json_response({'success': True})
-    return web.json_response({'error': 'invalid_code'}, status=400)
+        return json_response({'success': True})
+    return json_response({'error': 'invalid_code'}, status=400)
 
 @routes.post('/api/auth/verify-code')
 async def handle_verify_code_from_site(request):
@@ -237,14 +417,14 @@ async def handle_verify_code_from_site(request):
     account_id = data.get('account_id')
     
     if not code:
-        return web.json_response({'error': 'missing_code'}, status=400)
+        return json_response({'error': 'missing_code'}, status=400)
     
     from bot.database.database import verify_bot_code
     result = await verify_bot_code(code, account_id)
     
     if result.get('success'):
-        return web.json_response({'success': True})
-    return web.json_response({'error': 'invalid_code'}, status=400)
+        return json_response({'success': True})
+    return json_response({'error': 'invalid_code'}, status=400)
 
 # ============= LEGACY ENDPOINTS (keep for compatibility) =============
 
@@ -256,7 +436,7 @@ async def handle_generate_code(request):
     name = data.get('name', '')
     
     if not user_id:
-        return web.json_response({'error': 'Missing user_id'}, status=400)
+        return json_response({'error': 'Missing user_id'}, status=400)
 
     import random
     code = f"{random.randint(100000, 999999)}"
@@ -266,7 +446,7 @@ async def handle_generate_code(request):
     await save_verification_code_by_user(int(user_id), code, f"pending_{user_id}")
     
     logging.info(f"Generated code {code} for user {user_id}")
-    return web.json_response({'status': 'ok', 'code': code})
+    return json_response({'status': 'ok', 'code': code})
 
 @routes.post('/api/user/update')
 async def handle_update_user(request):
@@ -277,12 +457,12 @@ async def handle_update_user(request):
     name = data.get('name')
 
     if not user_id:
-        return web.json_response({'error': 'Missing user_id'}, status=400)
+        return json_response({'error': 'Missing user_id'}, status=400)
 
     from bot.database.database import update_user_profile
     await update_user_profile(user_id, phone, username, name)
     await update_user_profile(user_id, phone, username, name)
-    return web.json_response({'status': 'ok'})
+    return json_response({'status': 'ok'})
 
 @routes.post('/api/user/avatar')
 async def handle_update_avatar(request):
@@ -292,21 +472,21 @@ async def handle_update_avatar(request):
     avatar_url = data.get('avatar_url')
     
     if not account_id:
-        return web.json_response({'error': 'Missing account_id'}, status=400)
+        return json_response({'error': 'Missing account_id'}, status=400)
     
     from bot.database.database import update_avatar
     await update_avatar(int(account_id), avatar_url)
-    return web.json_response({'status': 'ok'})
+    return json_response({'status': 'ok'})
 
 @routes.get('/api/user/stats')
 async def handle_get_stats(request):
     user_id = request.query.get('user_id')
     if not user_id:
-        return web.json_response({'error': 'Missing user_id'}, status=400)
+        return json_response({'error': 'Missing user_id'}, status=400)
         
     from bot.database.database import get_user_stats
     stats = await get_user_stats(int(user_id))
-    return web.json_response(stats)
+    return json_response(stats)
 
 @routes.post('/api/orders')
 async def handle_create_order(request):
@@ -343,10 +523,8 @@ async def handle_create_order(request):
                     [InlineKeyboardButton(text="💰 Предложить курс", callback_data=f"bid_order:{order_id}")],
                 ])
 
-                try:
-                    await bot.send_message(chat_id=exchanger_id, text=text, reply_markup=kb, parse_mode="HTML")
-                except Exception as e:
-                    logging.warning(f"Failed to notify exchanger {exchanger_id}: {e}")
+                # Отправка в фоне: ответ клиенту не ждёт рассылки обменникам
+                notifier.send_message(bot, exchanger_id, text, reply_markup=kb, parse_mode="HTML")
 
     except Exception as e:
         logging.error(f"Notification error: {e}")
@@ -358,20 +536,32 @@ async def handle_create_order(request):
         'currency': data['currency'],
         'location': data['location'],
         'user_id': int(data['user_id'])
-    })
+    }, topics=[
+        topic('location', data['location']),
+        topic('currency', data['currency']),
+        topic('user', data['user_id']),
+    ])
 
-    return web.json_response({'id': order_id, 'status': 'ok'})
+    return json_response({'id': order_id, 'status': 'ok'})
 
 @routes.get('/api/orders/active')
 async def handle_get_active_orders(request):
-    orders = await get_active_orders()
-    return web.json_response(orders)
+    try:
+        limit, before = _page_params(request)
+    except (ValueError, UnicodeDecodeError):
+        return _bad_page_params()
+    orders = await get_active_orders(limit + 1, before)
+    return _page_response(orders, limit)
 
 @routes.get('/api/orders/my')
 async def handle_get_my_orders(request):
     user_id = request.query.get('user_id')
-    orders = await get_user_orders(int(user_id))
-    return web.json_response(orders)
+    try:
+        limit, before = _page_params(request, default=None)
+    except (ValueError, UnicodeDecodeError):
+        return _bad_page_params()
+    orders = await get_user_orders(int(user_id), _fetch_limit(limit), before)
+    return _page_response(orders, limit)
 
 @routes.post('/api/orders/{id}/cancel')
 async def handle_cancel_order(request):
@@ -379,10 +569,10 @@ async def handle_cancel_order(request):
     try:
         from bot.database.database import cancel_order
         await cancel_order(order_id)
-        return web.json_response({'status': 'ok'})
+        return json_response({'status': 'ok'})
     except Exception as e:
         logging.error(f"Failed to cancel order: {e}")
-        return web.json_response({'error': str(e)}, status=500)
+        return json_response({'error': str(e)}, status=500)
 
 @routes.post('/api/bids')
 async def handle_place_bid(request):
@@ -396,6 +586,7 @@ async def handle_place_bid(request):
     )
     
     # Notify client with Uber-like notification
+    order = None
     try:
         from bot.database.database import get_order, get_user, update_bid_message_id
         from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
@@ -435,46 +626,55 @@ async def handle_place_bid(request):
     except Exception as e:
         logging.error(f"Failed to notify client about new bid: {e}")
     
-    # Broadcast new bid to WebSocket clients
+    # Broadcast new bid to WebSocket clients watching this order / its owner / the exchanger
     await broadcast_update('new_bid', {
         'bid_id': bid_id,
         'order_id': int(data['order_id']),
         'rate': data['rate'],
         'exchanger_id': int(data['exchanger_id'])
-    })
+    }, topics=[
+        topic('order', data['order_id']),
+        topic('user', data['exchanger_id']),
+        topic('user', order['user_id']) if order else None,
+    ])
     
-    return web.json_response({'status': 'ok', 'bid_id': bid_id})
+    return json_response({'status': 'ok', 'bid_id': bid_id})
 
 @routes.get('/api/bids/my')
 async def handle_get_my_bids(request):
     user_id = request.query.get('user_id')
     if not user_id:
-        return web.json_response({'error': 'Missing user_id'}, status=400)
+        return json_response({'error': 'Missing user_id'}, status=400)
     
+    try:
+        limit, before = _page_params(request, default=None)
+    except (ValueError, UnicodeDecodeError):
+        return _bad_page_params()
+
     from bot.database.database import get_user_bids
-    bids = await get_user_bids(int(user_id))
-    return web.json_response(bids)
+    bids = await get_user_bids(int(user_id), _fetch_limit(limit), before)
+    return _page_response(bids, limit)
 
 @routes.get('/api/bids')
 async def handle_get_order_bids(request):
     order_id = request.query.get('order_id')
     if not order_id:
-        return web.json_response({'error': 'Missing order_id'}, status=400)
+        return json_response({'error': 'Missing order_id'}, status=400)
     
     from bot.database.database import get_order_bids
     bids = await get_order_bids(int(order_id))
-    return web.json_response(bids)
+    return json_response(bids)
 
 @routes.delete('/api/bids/completed')
 async def handle_clear_completed_bids(request):
     """Clear completed/rejected bids for a user"""
     user_id = request.query.get('user_id')
     if not user_id:
-        return web.json_response({'error': 'Missing user_id'}, status=400)
+        return json_response({'error': 'Missing user_id'}, status=400)
     
     from bot.database.database import clear_completed_bids
     await clear_completed_bids(int(user_id))
-    return web.json_response({'status': 'ok'})
+    return json_response({'status': 'ok'})
 
 @routes.post('/api/bids/{id}/accept')
 async def handle_accept_bid(request):
@@ -487,7 +687,7 @@ async def handle_accept_bid(request):
     bid = await accept_bid(bid_id)
     
     if not bid:
-        return web.json_response({'error': 'Bid not found'}, status=404)
+        return json_response({'error': 'Bid not found'}, status=404)
         
     # Get order and user details
     order = await get_order(bid['order_id'])
@@ -526,7 +726,7 @@ async def handle_accept_bid(request):
             f"Свяжитесь с клиентом для завершения сделки!"
         )
         
-        await bot.send_message(chat_id=exchanger_id, text=text, reply_markup=kb, parse_mode="HTML")
+        notifier.send_message(bot, exchanger_id, text, reply_markup=kb, parse_mode="HTML")
         
     except Exception as e:
         logging.error(f"Failed to notify exchanger about accepted bid: {e}")
@@ -536,35 +736,35 @@ async def handle_accept_bid(request):
         rejected_bids = await get_rejected_bids_with_messages(bid['order_id'], bid_id)
         for rejected_bid in rejected_bids:
             if rejected_bid['message_id']:
-                try:
-                    await bot.delete_message(
-                        chat_id=order_client_id,
-                        message_id=rejected_bid['message_id']
-                    )
-                except Exception as e:
-                    logging.warning(f"Failed to delete rejected bid message: {e}")
+                notifier.delete_message(bot, order_client_id, rejected_bid['message_id'])
             
             # Notify rejected exchanger
-            try:
-                await bot.send_message(
-                    chat_id=rejected_bid['exchanger_id'],
-                    text=f"❌ К сожалению, заявка #{rejected_bid['order_id']} закрыта.\n"
-                         f"Клиент выбрал другого обменника.",
-                    parse_mode="HTML"
-                )
-            except Exception as e:
-                logging.warning(f"Failed to notify rejected exchanger: {e}")
+            notifier.send_message(
+                bot,
+                rejected_bid['exchanger_id'],
+                f"❌ К сожалению, заявка #{rejected_bid['order_id']} закрыта.\n"
+                f"Клиент выбрал другого обменника.",
+                parse_mode="HTML"
+            )
 
-    return web.json_response({'status': 'ok', 'order_id': bid['order_id']})
+    return json_response({'status': 'ok', 'order_id': bid['order_id']})
 
 @routes.get('/api/market')
 async def handle_get_market(request):
-    posts = await get_market_posts()
-    return web.json_response(posts)
+    try:
+        limit, before = _page_params(request)
+    except (ValueError, UnicodeDecodeError):
+        return _bad_page_params()
+    posts = await get_market_posts(limit + 1, before)
+    return _page_response(posts, limit)
 
 @routes.post('/api/market')
 async def handle_create_post(request):
     data = await request.json()
+    try:
+        image_key = await store_image(data.get('image_data'))
+    except MediaError as e:
+        return json_response({'error': str(e)}, status=400)
     await create_market_post(
         int(data['user_id']),
         data['type'],
@@ -574,19 +774,24 @@ async def handle_create_post(request):
         data['location'],
         data['description'],
         data.get('category'),
-        data.get('image_data')
+        image_key
     )
-    return web.json_response({'status': 'ok'})
+    return json_response({'status': 'ok'})
 
 @routes.get('/api/market/my')
 async def handle_get_my_posts(request):
     user_id = request.query.get('user_id')
     if not user_id:
-        return web.json_response({'error': 'Missing user_id'}, status=400)
+        return json_response({'error': 'Missing user_id'}, status=400)
     
+    try:
+        limit, before = _page_params(request, default=None)
+    except (ValueError, UnicodeDecodeError):
+        return _bad_page_params()
+
     from bot.database.database import get_user_market_posts
-    posts = await get_user_market_posts(int(user_id))
-    return web.json_response(posts)
+    posts = await get_user_market_posts(int(user_id), _fetch_limit(limit), before)
+    return _page_response(posts, limit)
 
 @routes.get('/api/users/{id}')
 async def handle_get_user_profile(request):
@@ -598,7 +803,7 @@ async def handle_get_user_profile(request):
     account = await get_web_account_by_telegram_id(user_id)
     
     if account:
-        return web.json_response({
+        return json_response({
             'id': user_id,
             'name': account.get('name') or account.get('nickname', 'User'),
             'avatar_url': account.get('avatar_url'),
@@ -610,7 +815,7 @@ async def handle_get_user_profile(request):
     # Fallback to users table
     user = await get_user(user_id)
     if user:
-        return web.json_response({
+        return json_response({
             'id': user_id,
             'name': user[2] or 'User',  # username
             'avatar_url': None,
@@ -620,7 +825,7 @@ async def handle_get_user_profile(request):
         })
     
     # Create basic user data if nothing found
-    return web.json_response({
+    return json_response({
         'id': user_id,
         'name': f'User {user_id}',
         'avatar_url': None,
@@ -635,7 +840,7 @@ async def handle_get_user_posts(request):
     user_id = int(request.match_info['id'])
     from bot.database.database import get_user_market_posts
     posts = await get_user_market_posts(user_id)
-    return web.json_response(posts)
+    return json_response(posts)
 
 @routes.get('/api/users/{id}/reviews')
 async def handle_get_user_reviews(request):
@@ -643,7 +848,7 @@ async def handle_get_user_reviews(request):
     user_id = int(request.match_info['id'])
     from bot.database.database import get_user_reviews
     reviews = await get_user_reviews(user_id)
-    return web.json_response(reviews)
+    return json_response(reviews)
 
 @routes.get('/api/posts/{id}')
 async def handle_get_post(request):
@@ -652,15 +857,20 @@ async def handle_get_post(request):
     from bot.database.database import get_market_post
     post = await get_market_post(post_id)
     if not post:
-        return web.json_response({'error': 'not_found'}, status=404)
-    return web.json_response(post)
+        return json_response({'error': 'not_found'}, status=404)
+    return json_response(post)
 
 @routes.put('/api/market/{id}')
 async def handle_update_post(request):
     post_id = int(request.match_info['id'])
     data = await request.json()
     user_id = data.get('user_id')
-    
+
+    try:
+        image_key = await store_image(data.get('image_data'))
+    except MediaError as e:
+        return json_response({'error': str(e)}, status=400)
+
     from bot.database.database import update_market_post
     await update_market_post(
         post_id, 
@@ -672,9 +882,9 @@ async def handle_update_post(request):
         currency=data.get('currency'),
         location=data.get('location'),
         category=data.get('category'),
-        image_data=data.get('image_data')
+        image_key=image_key
     )
-    return web.json_response({'status': 'ok'})
+    return json_response({'status': 'ok'})
 
 @routes.delete('/api/market/{id}')
 async def handle_delete_post(request):
@@ -682,11 +892,11 @@ async def handle_delete_post(request):
     user_id = request.query.get('user_id')
     
     if not user_id:
-        return web.json_response({'error': 'Missing user_id'}, status=400)
+        return json_response({'error': 'Missing user_id'}, status=400)
 
     from bot.database.database import delete_market_post
     await delete_market_post(post_id, int(user_id))
-    return web.json_response({'status': 'ok'})
+    return json_response({'status': 'ok'})
 
 @routes.get('/api/categories')
 async def handle_get_categories(request):
@@ -695,7 +905,7 @@ async def handle_get_categories(request):
     # Default categories + custom ones
     defaults = ['USD', 'BTC', 'UZS']
     all_cats = list(set(defaults + categories))
-    return web.json_response(all_cats)
+    return json_response(all_cats)
 
 @routes.post('/api/categories')
 async def handle_create_category(request):
@@ -704,20 +914,20 @@ async def handle_create_category(request):
     user_id = data.get('user_id')
     
     if not name or not user_id:
-        return web.json_response({'error': 'Missing data'}, status=400)
+        return json_response({'error': 'Missing data'}, status=400)
 
     from bot.database.database import create_category
     success = await create_category(name, int(user_id))
     if success:
-        return web.json_response({'status': 'ok'})
+        return json_response({'status': 'ok'})
     else:
-        return web.json_response({'error': 'Category already exists'}, status=400)
+        return json_response({'error': 'Category already exists'}, status=400)
 
 @routes.get('/api/config')
 async def handle_get_config(request):
     bot = request.app['bot']
     me = await bot.get_me()
-    return web.json_response({'bot_username': me.username})
+    return json_response({'bot_username': me.username})
 
 @routes.post('/api/chat/send')
 async def handle_send_chat(request):
@@ -730,7 +940,7 @@ async def handle_send_chat(request):
     payload = data.get('payload', {})
 
     if not target_user_id or not sender_id:
-        return web.json_response({'error': 'Missing target_user_id or sender_id'}, status=400)
+        return json_response({'error': 'Missing target_user_id or sender_id'}, status=400)
 
     bot = request.app['bot']
     # Build caption
@@ -758,10 +968,58 @@ async def handle_send_chat(request):
             photo="https://via.placeholder.com/600x320.png?text=Malxam+Order",
             caption=caption
         )
-        return web.json_response({'status': 'ok'})
+        return json_response({'status': 'ok'})
     except Exception as e:
         logging.error(f"Failed to send chat handoff: {e}")
-        return web.json_response({'error': 'Failed to send message'}, status=500)
+        return json_response({'error': 'Failed to send message'}, status=500)
+
+# ============= RATE HISTORY =============
+
+# Окно по умолчанию для каждого разрешения, если from не передан
+RATE_HISTORY_WINDOWS = {'raw': 3600, '1m': 6 * 3600, '1h': 7 * 86400, '1d': 365 * 86400}
+
+@routes.get('/api/rates/series')
+async def handle_rate_series(request):
+    from bot.database.database import get_rate_series
+    return json_response(await get_rate_series())
+
+@routes.get('/api/rates/history')
+async def handle_rate_history(request):
+    """
+    Ряд для графика: ?source=street&pair=USD/UZS&resolution=1h&from=<unix>&to=<unix>&limit=
+    resolution: raw | 1m | 1h | 1d. Точки агрегатов — {ts, open, high, low, close, avg, count}.
+    """
+    source = request.query.get('source')
+    pair = request.query.get('pair')
+    resolution = request.query.get('resolution', '1h')
+    if not source or not pair:
+        return json_response({'error': 'source and pair are required'}, status=400)
+    if resolution not in RATE_HISTORY_WINDOWS:
+        return json_response({'error': f'resolution must be one of {", ".join(RATE_HISTORY_WINDOWS)}'}, status=400)
+    try:
+        end = int(request.query.get('to', time.time()))
+        start = int(request.query.get('from', end - RATE_HISTORY_WINDOWS[resolution]))
+        limit = min(max(int(request.query.get('limit', 1000)), 1), 5000)
+    except ValueError:
+        return json_response({'error': 'from, to and limit must be integers'}, status=400)
+
+    from bot.database.database import get_rate_history
+    points = await get_rate_history(source, pair.upper(), resolution, start, end, limit)
+    return json_response({
+        'source': source,
+        'pair': pair.upper(),
+        'resolution': resolution,
+        'from': start,
+        'to': end,
+        'points': points,
+    })
+
+@routes.get('/api/rates/matrix')
+async def handle_rate_matrix(request):
+    """Кросс-курсы N×N: rates[base][quote] = {rate, source, stale, via, as_of}."""
+    from bot.services.rate_matrix import rate_matrix
+    await rate_matrix.ensure()
+    return json_response(rate_matrix.to_dict())
 
 # Catch-all for React Router (SPA)
 @routes.get('/{tail:.*}')
@@ -783,8 +1041,8 @@ async def get_user_profile(request):
     from bot.database.database import get_public_profile
     profile = await get_public_profile(user_id)
     if not profile:
-        return web.json_response({'error': 'not_found'}, status=404)
-    return web.json_response(profile)
+        return json_response({'error': 'not_found'}, status=404)
+    return json_response(profile)
 
 @routes.get('/api/users/{user_id}/posts')
 async def get_user_posts_endpoint(request):
@@ -792,7 +1050,7 @@ async def get_user_posts_endpoint(request):
     user_id = int(request.match_info['user_id'])
     from bot.database.database import get_user_posts
     posts = await get_user_posts(user_id)
-    return web.json_response(posts)
+    return json_response(posts)
 
 @routes.get('/api/users/{user_id}/reviews')
 async def get_user_reviews_endpoint(request):
@@ -800,7 +1058,7 @@ async def get_user_reviews_endpoint(request):
     user_id = int(request.match_info['user_id'])
     from bot.database.database import get_user_reviews
     reviews = await get_user_reviews(user_id)
-    return web.json_response(reviews)
+    return json_response(reviews)
 
 @routes.post('/api/reviews')
 async def add_review_endpoint(request):
@@ -813,11 +1071,11 @@ async def add_review_endpoint(request):
     post_id = data.get('post_id')
     
     if not all([from_user, to_user, rating]):
-        return web.json_response({'error': 'missing_data'}, status=400)
+        return json_response({'error': 'missing_data'}, status=400)
     
     from bot.database.database import add_review
     await add_review(from_user, to_user, rating, comment, post_id)
-    return web.json_response({'success': True})
+    return json_response({'success': True})
 
 # ============= DEAL ENDPOINTS =============
 
@@ -865,12 +1123,17 @@ async def accept_deal(request):
         except Exception as e:
             logging.error(f"Failed to send ticket: {e}")
     
-    return web.json_response({'success': True, 'deal_id': deal_id})
+    return json_response({'success': True, 'deal_id': deal_id})
 
 
 async def init_web_app(bot):
     # Increase max size to 10MB for image uploads
-    app = web.Application(middlewares=[log_requests], client_max_size=10*1024*1024)
+    app = web.Application(
+        middlewares=[log_requests, compress_responses, conditional_get],
+        client_max_size=10*1024*1024
+    )
     app['bot'] = bot
+    app.on_startup.append(_precompress_client)
+    app.on_cleanup.append(_close_ws_hub)
     app.add_routes(routes)
     return app
@@ -10,3 +10,122 @@ ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x]
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
 FAST_FOREX_API_KEY = os.getenv("FAST_FOREX_API_KEY")
 WEBAPP_URL = os.getenv("WEBAPP_URL", "https://localhost:8080")
+
+# SQLite connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "10"))
+DB_PRAGMAS = os.getenv("DB_PRAGMAS", "")  # "name=value,name=value", применяются к каждому соединению
+
+# SQLite storage mode
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+# Пакетная запись мелких обновлений
+DB_WRITE_FLUSH_MS = float(os.getenv("DB_WRITE_FLUSH_MS", "5"))
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "200"))
+
+# Хранилище картинок объявлений
+MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(5 * 1024 * 1024)))
+MEDIA_THUMB_SIZE = int(os.getenv("MEDIA_THUMB_SIZE", "480"))
+MEDIA_MAX_URL_LENGTH = int(os.getenv("MEDIA_MAX_URL_LENGTH", "2048"))
+
+# JSON для API и WebSocket: auto (orjson, если установлен) | orjson | stdlib
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")
+
+# Сжатие HTTP-ответов и предсжатая статика
+HTTP_COMPRESS_MIN_BYTES = int(os.getenv("HTTP_COMPRESS_MIN_BYTES", "1024"))
+HTTP_GZIP_LEVEL = int(os.getenv("HTTP_GZIP_LEVEL", "6"))
+HTTP_BROTLI_QUALITY = int(os.getenv("HTTP_BROTLI_QUALITY", "5"))
+
+# WebSocket-рассылка: очередь на клиента, таймаут отправки, отставание до отключения, лимит подписок
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "64"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+WS_MAX_LAG_DROPS = int(os.getenv("WS_MAX_LAG_DROPS", str(WS_QUEUE_SIZE)))
+WS_MAX_TOPICS = int(os.getenv("WS_MAX_TOPICS", "50"))
+
+# Фоновая отправка уведомлений: воркеры, лимит бота (сообщ./сек), интервал в один чат (сек)
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "8"))
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))
+NOTIFY_CHAT_INTERVAL = float(os.getenv("NOTIFY_CHAT_INTERVAL", "1"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "3"))
+NOTIFY_MAX_PENDING = int(os.getenv("NOTIFY_MAX_PENDING", "10000"))
+
+# Рассылка /broadcast: параллельных отправок, размер пачки, как часто обновлять прогресс (сек)
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "100"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+
+# Рассылки userbot-аккаунтов: сообщений в минуту на аккаунт и сколько можно подряд (token bucket),
+# пауза между отправками аккаунта (сек, uniform | triangular | exponential), за сколько секунд
+# до отправки показывать «печатает», сколько чатов одной рассылки готовить параллельно
+MAILING_SEND_RATE = float(os.getenv("MAILING_SEND_RATE", "12"))
+MAILING_SEND_BURST = int(os.getenv("MAILING_SEND_BURST", "3"))
+MAILING_JITTER_MIN = float(os.getenv("MAILING_JITTER_MIN", "2"))
+MAILING_JITTER_MAX = float(os.getenv("MAILING_JITTER_MAX", "6"))
+MAILING_JITTER_DIST = os.getenv("MAILING_JITTER_DIST", "uniform")
+MAILING_TYPING_LEAD = float(os.getenv("MAILING_TYPING_LEAD", "2"))
+MAILING_PREPARE_CONCURRENCY = int(os.getenv("MAILING_PREPARE_CONCURRENCY", "5"))
+
+# FloodWait / SlowmodeWait в рассылках: темп аккаунта после FloodWait (множитель, не ниже доли),
+# прибавка к доле за удачную отправку; паузы до max_wait (сек) пережидаются внутри запуска,
+# длиннее — чат откладывается до отдельного повтора, сколько раз повторять один чат за запуск
+MAILING_FLOOD_BACKOFF = float(os.getenv("MAILING_FLOOD_BACKOFF", "0.5"))
+MAILING_FLOOD_MIN_FACTOR = float(os.getenv("MAILING_FLOOD_MIN_FACTOR", "0.1"))
+MAILING_FLOOD_RECOVERY = float(os.getenv("MAILING_FLOOD_RECOVERY", "0.05"))
+MAILING_FLOOD_MAX_WAIT = float(os.getenv("MAILING_FLOOD_MAX_WAIT", "120"))
+MAILING_FLOOD_RETRIES = int(os.getenv("MAILING_FLOOD_RETRIES", "2"))
+
+# Умная проверка рассылки: сколько секунд верить запомненному последнему сообщению чата
+# (без get_chat_history), сколько чатов помнить
+MAILING_ACTIVITY_TTL = float(os.getenv("MAILING_ACTIVITY_TTL", "600"))
+MAILING_ACTIVITY_SIZE = int(os.getenv("MAILING_ACTIVITY_SIZE", "20000"))
+
+# Кэш курсов: сколько секунд данные считаются свежими, пауза после неудачного запроса
+RATES_OFFICIAL_TTL = float(os.getenv("RATES_OFFICIAL_TTL", "600"))
+RATES_P2P_TTL = float(os.getenv("RATES_P2P_TTL", "120"))
+RATES_RETRY_AFTER = float(os.getenv("RATES_RETRY_AFTER", "60"))
+
+# HTTP-запросы курсов (FastForex, Binance P2P)
+RATES_HTTP_POOL_SIZE = int(os.getenv("RATES_HTTP_POOL_SIZE", "20"))
+RATES_HTTP_TIMEOUT = float(os.getenv("RATES_HTTP_TIMEOUT", "8"))
+BINANCE_P2P_FIATS = [x.strip() for x in os.getenv("BINANCE_P2P_FIATS", "UZS,RUB,KZT,KGS").split(",") if x.strip()]
+BINANCE_P2P_DEPTH = int(os.getenv("BINANCE_P2P_DEPTH", "5"))
+
+# История курсов: сколько дней хранить сырые точки и агрегаты (0 — всегда), период чистки (сек)
+RATES_RETENTION_RAW_DAYS = float(os.getenv("RATES_RETENTION_RAW_DAYS", "7"))
+RATES_RETENTION_1M_DAYS = float(os.getenv("RATES_RETENTION_1M_DAYS", "7"))
+RATES_RETENTION_1H_DAYS = float(os.getenv("RATES_RETENTION_1H_DAYS", "180"))
+RATES_RETENTION_1D_DAYS = float(os.getenv("RATES_RETENTION_1D_DAYS", "0"))
+RATES_PRUNE_INTERVAL = float(os.getenv("RATES_PRUNE_INTERVAL", "3600"))
+
+# Матрица кросс-курсов: валюты, приоритет источников (street = уличный средний), когда уличный курс устарел (сек)
+RATES_MATRIX_CURRENCIES = [x.strip().upper() for x in os.getenv("RATES_MATRIX_CURRENCIES", "USD,EGP,EUR,RUB,UZS,KGS,KZT").split(",") if x.strip()]
+RATES_MATRIX_PRECEDENCE = [x.strip() for x in os.getenv("RATES_MATRIX_PRECEDENCE", "street,p2p,official").split(",") if x.strip()]
+RATES_STREET_STALE_AFTER = float(os.getenv("RATES_STREET_STALE_AFTER", "10800"))
+
+# Сбор уличных курсов из отслеживаемых чатов (userbot): период опроса (сек), сообщений за опрос,
+# размер очереди на разбор, размер пачки, параллельных разборов
+RATES_INGEST_ENABLED = os.getenv("RATES_INGEST_ENABLED", "1") not in ("0", "false", "no")
+RATES_INGEST_POLL_INTERVAL = float(os.getenv("RATES_INGEST_POLL_INTERVAL", "60"))
+RATES_INGEST_FETCH_LIMIT = int(os.getenv("RATES_INGEST_FETCH_LIMIT", "100"))
+RATES_INGEST_QUEUE_SIZE = int(os.getenv("RATES_INGEST_QUEUE_SIZE", "1000"))
+RATES_INGEST_BATCH_SIZE = int(os.getenv("RATES_INGEST_BATCH_SIZE", "50"))
+RATES_INGEST_PARSE_CONCURRENCY = int(os.getenv("RATES_INGEST_PARSE_CONCURRENCY", "8"))
+
+# Разбор курсов через Mistral (когда регулярки не справились): адрес (можно локальную заглушку), модель,
+# кэш по тексту (записей, сек), пачка (сообщений, ожидание сек), параллельных запросов, таймаут (сек),
+# предохранитель: ошибок подряд и пауза (сек)
+MISTRAL_API_URL = os.getenv("MISTRAL_API_URL", "https://api.mistral.ai/v1/chat/completions")
+MISTRAL_MODEL = os.getenv("MISTRAL_MODEL", "mistral-tiny")
+AI_PARSE_CACHE_SIZE = int(os.getenv("AI_PARSE_CACHE_SIZE", "5000"))
+AI_PARSE_CACHE_TTL = float(os.getenv("AI_PARSE_CACHE_TTL", "86400"))
+AI_PARSE_BATCH_SIZE = int(os.getenv("AI_PARSE_BATCH_SIZE", "10"))
+AI_PARSE_BATCH_WAIT = float(os.getenv("AI_PARSE_BATCH_WAIT", "0.2"))
+AI_PARSE_CONCURRENCY = int(os.getenv("AI_PARSE_CONCURRENCY", "2"))
+AI_PARSE_TIMEOUT = float(os.getenv("AI_PARSE_TIMEOUT", "15"))
+AI_PARSE_BREAKER_FAILURES = int(os.getenv("AI_PARSE_BREAKER_FAILURES", "5"))
+AI_PARSE_BREAKER_COOLDOWN = float(os.getenv("AI_PARSE_BREAKER_COOLDOWN", "300"))
@@ -2,18 +2,29 @@ import asyncio
 import logging
 from aiogram import Bot, Dispatcher
 from aiohttp import web
-from bot.database.database import create_tables
+from bot.database.database import create_tables, close_db, check_hot_query_plans
 from bot.services.scheduler import scheduler, start_scheduler, load_scheduled_mailings
 from bot.web_app import init_web_app
-from config import BOT_TOKEN
+from bot.services.notifier import notifier
+from bot.services.broadcast import resume_broadcasts, stop_broadcasts
+from bot.services.rates_cache import rates_cache
+from bot.services import rate_history
+from bot.services.rate_matrix import rate_matrix
+from bot.services.rate_ingest import rate_ingestor
+from bot.services.rates_api import close_session as close_rates_session
+from bot.services.parser import ai_parser
+from bot.services.ws_hub import hub
+from config import BOT_TOKEN, RATES_INGEST_ENABLED
 
 logging.basicConfig(level=logging.INFO)
 
 
-async def main():
+async def run_bot(runtime: dict):
     await create_tables()
+    for query, scans in (await check_hot_query_plans()).items():
+        logging.warning(f"Query plan regression in {query}: {'; '.join(scans)}")
 
-    bot = Bot(token=BOT_TOKEN)
+    bot = runtime["bot"] = Bot(token=BOT_TOKEN)
     dp = Dispatcher()
 
     # Routers
@@ -42,11 +53,19 @@ async def main():
     # Background jobs
     start_scheduler()
     await load_scheduled_mailings()
+    rate_history.start()
+    rate_matrix.start()
+    rates_cache.start()
+    if RATES_INGEST_ENABLED:
+        rate_ingestor.start()
+    resumed = await resume_broadcasts(bot)
+    if resumed:
+        logging.info(f"Resumed {resumed} unfinished broadcast(s)")
 
     # Start Web App Server
     try:
         app = await init_web_app(bot)
-        runner = web.AppRunner(app)
+        runner = runtime["runner"] = web.AppRunner(app)
         await runner.setup()
         site = web.TCPSite(runner, '0.0.0.0', 8080)
         await site.start()
@@ -65,12 +84,58 @@ async def main():
         else:
             # If polling stops gracefully (e.g. via signal), break the loop
             break
-            
-    await bot.session.close()
+
+
+async def _stop_scheduler():
     if scheduler.running:
         scheduler.shutdown(wait=False)
-    # Cleanup web app
-    await runner.cleanup()
+
+
+def shutdown_steps(bot=None, runner=None) -> list:
+    """
+    Что закрывать при остановке — в порядке зависимостей: сначала то, что порождает
+    работу (планировщик, сбор и обновление курсов), потом то, чем она пользуется
+    (HTTP-сессия, очередь уведомлений, сессия бота, веб-сервер), и в конце БД —
+    очередь записи сбрасывается до закрытия пула.
+    """
+    steps = [
+        ("scheduler", _stop_scheduler),
+        ("rate ingestion", rate_ingestor.close),
+        ("rates cache", rates_cache.close),
+        ("rate history", rate_history.close),
+        ("AI parser", ai_parser.close),
+        ("rates HTTP session", close_rates_session),
+        # Unfinished broadcasts keep status 'running' and resume on next start
+        ("broadcasts", stop_broadcasts),
+        # Send whatever notifications are still queued before the bot session goes away
+        ("notifier", notifier.close),
+    ]
+    if runner is not None:
+        # on_cleanup веб-приложения закрывает и WebSocket-хаб
+        steps.append(("web app", runner.cleanup))
+    steps.append(("WebSocket hub", hub.close))
+    if bot is not None:
+        steps.append(("bot session", bot.session.close))
+    # write queue, then pooled connections (they keep worker threads alive)
+    steps.append(("database", close_db))
+    return steps
+
+
+async def shutdown(bot=None, runner=None):
+    """Каждый шаг выполняется, даже если предыдущий упал."""
+    for name, close in shutdown_steps(bot, runner):
+        try:
+            await close()
+        except Exception as e:
+            logging.error(f"Shutdown: closing {name} failed: {e}")
+
+
+async def main():
+    runtime = {}
+    try:
+        await run_bot(runtime)
+    finally:
+        await shutdown(runtime.get("bot"), runtime.get("runner"))
 
 
 if __name__ == "__main__":
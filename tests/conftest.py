@@ -0,0 +1,32 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """bot.database.database на отдельном файле БД; соединения закрываются после каждого run()."""
+    from bot.database import database
+
+    monkeypatch.setattr(database.pool, "db_path", str(tmp_path / "bot.db"))
+    return database
+
+
+@pytest.fixture
+def run(db):
+    """run(coro) — выполнить корутину в новом loop'е и закрыть пул и очередь записи."""
+
+    def runner(coro):
+        async def wrapper():
+            try:
+                return await coro
+            finally:
+                await db.close_db()
+
+        return asyncio.run(wrapper())
+
+    return runner
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import re
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from bot.services import rates_api
+from bot.services.ai_parser import AIRateParser
+
+MESSAGE_RE = re.compile(r"^\s*(\d+): (\".*\")$", re.M)
+
+
+class _Endpoint:
+    """Заглушка chat/completions: по числу в каждом сообщении отвечает курсом USD/UZS."""
+
+    def __init__(self):
+        self.batches = []  # тексты каждого запроса
+        self.fail = False
+
+    async def handle(self, request):
+        payload = await request.json()
+        texts = [json.loads(raw) for _, raw in MESSAGE_RE.findall(payload["messages"][0]["content"])]
+        self.batches.append(texts)
+        if self.fail:
+            return web.Response(status=503, text="overloaded")
+        rates = [
+            {"i": i, "pair": "USD/UZS", "rate": float(number)}
+            for i, text in enumerate(texts) for number in re.findall(r"\d{4,}", text)
+        ]
+        content = "```json\n" + json.dumps(rates) + "\n```"
+        return web.json_response({"choices": [{"message": {"content": content}}]})
+
+
+def _run(scenario, **options):
+    """scenario(parser, endpoint) против локальной заглушки; сессия rates_api закрывается после."""
+    endpoint = _Endpoint()
+
+    async def wrapper():
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", endpoint.handle)
+        async with TestServer(app) as server:
+            settings = {"batch_wait": 0.01, **options}
+            parser = AIRateParser("key", ["USD/UZS"], str(server.make_url("/v1/chat/completions")), "test", **settings)
+            try:
+                return await scenario(parser, endpoint)
+            finally:
+                await parser.close()
+                await rates_api.close_session()
+
+    return asyncio.run(wrapper()), endpoint
+
+
+def test_repeated_text_is_served_from_cache_until_ttl():
+    async def scenario(parser, endpoint):
+        first = await parser.parse("Dollar 12650 bor")
+        again = await parser.parse("  dollar   12650 BOR ")  # тот же текст после нормализации
+        await asyncio.sleep(0.15)  # TTL истёк
+        expired = await parser.parse("Dollar 12650 bor")
+        return first, again, expired, parser.stats()
+
+    (first, again, expired, stats), endpoint = _run(scenario, cache_ttl=0.1)
+    assert first == again == expired == [("USD/UZS", 12650.0)]
+    assert len(endpoint.batches) == 2
+    assert (stats["requests"], stats["cache_hits"]) == (2, 1)
+
+
+def test_concurrent_messages_share_batched_requests():
+    texts = [f"usd {12600 + i}" for i in range(5)]
+
+    async def scenario(parser, endpoint):
+        return await asyncio.gather(*(parser.parse(text) for text in [*texts, texts[0]])), parser.stats()
+
+    (results, stats), endpoint = _run(scenario, batch_size=3)
+    assert [len(batch) for batch in endpoint.batches] == [3, 2]
+    assert results == [[("USD/UZS", 12600.0 + i)] for i in range(5)] + [[("USD/UZS", 12600.0)]]
+    assert stats["shared"] == 1
+
+
+def test_breaker_opens_after_failures_and_recovers():
+    async def scenario(parser, endpoint):
+        endpoint.fail = True
+        failed = [await parser.parse("usd 12650"), await parser.parse("usd 12660")]
+        opened = parser.is_open()
+        skipped = await parser.parse("usd 12670")  # предохранитель открыт — запроса нет
+        requests_while_open = len(endpoint.batches)
+        endpoint.fail = False
+        await asyncio.sleep(0.25)
+        recovered = await parser.parse("usd 12650")  # ошибка не кэшировалась
+        return failed, opened, skipped, requests_while_open, recovered, parser.stats()
+
+    (failed, opened, skipped, requests_while_open, recovered, stats), _ = _run(
+        scenario, breaker_failures=2, breaker_cooldown=0.2,
+    )
+    assert failed == [[], []] and opened
+    assert skipped == [] and requests_while_open == 2
+    assert recovered == [("USD/UZS", 12650.0)]
+    assert (stats["errors"], stats["short_circuited"], stats["breaker_open"]) == (2, 1, False)
+    assert stats["cached"] == 1
+
+
+def test_disabled_without_api_key():
+    parser = AIRateParser(None, ["USD/UZS"], "http://127.0.0.1:9/unused", "test")
+    assert not parser.enabled
+    assert asyncio.run(parser.parse("usd 12650")) == []
@@ -0,0 +1,118 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from bot.services import broadcast
+from bot.services.notifier import NotificationDispatcher
+
+ADMIN_ID = 999
+
+
+class _Bot:
+    """Получатели из hold ждут gate; edits — тексты обновлений прогресса."""
+
+    def __init__(self, hold=()):
+        self.sent = []
+        self.edits = []
+        self.hold = set(hold)
+        self.gate = asyncio.Event()
+        self.waiting = asyncio.Event()
+
+    async def send_message(self, chat_id, text):
+        if chat_id == ADMIN_ID:
+            return SimpleNamespace(message_id=1)
+        if chat_id in self.hold:
+            self.waiting.set()
+            await self.gate.wait()
+        self.sent.append(chat_id)
+        return SimpleNamespace(message_id=len(self.sent) + 1)
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        self.edits.append(text)
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    """Быстрая очередь уведомлений и маленькие пачки, чтобы было что возобновлять."""
+    monkeypatch.setattr(broadcast, "notifier", NotificationDispatcher(workers=4, global_rate=1000, chat_interval=0))
+    monkeypatch.setattr(broadcast, "BROADCAST_BATCH_SIZE", 2)
+    monkeypatch.setattr(broadcast, "BROADCAST_CONCURRENCY", 1)
+    monkeypatch.setattr(broadcast, "_running", {})
+    return broadcast
+
+
+async def _seed(db, users=5):
+    await db.create_tables()
+    for uid in range(1, users + 1):
+        await db.add_user(uid, "ru")
+
+
+async def _finish(job_id):
+    task = broadcast._running.get(job_id)
+    if task is not None:
+        await asyncio.gather(task, return_exceptions=True)
+    await broadcast.notifier.close(timeout=0.2)  # удержанная отправка так и не завершится
+    return await broadcast.get_broadcast_job(job_id)
+
+
+def test_resume_skips_recipients_already_saved(db, run, engine):
+    bot = _Bot()
+
+    async def scenario():
+        await _seed(db)
+        job_id = await db.create_broadcast_job(ADMIN_ID, "hello")
+        # до перезапуска успела сохраниться первая пачка
+        await db.save_broadcast_results(job_id, [(1, 1, "sent", None), (2, 2, "blocked", "blocked")], 2)
+        resumed = await broadcast.resume_broadcasts(bot)
+        return resumed, await _finish(job_id)
+
+    resumed, job = run(scenario())
+    assert resumed == 1
+    assert sorted(bot.sent) == [3, 4, 5]
+    assert (job["status"], job["cursor"], job["sent"], job["blocked"]) == ("done", 5, 4, 1)
+
+
+def test_cancel_keeps_what_was_sent_and_stops(db, run, engine):
+    bot = _Bot(hold={2})
+
+    async def scenario():
+        await _seed(db)
+        job_id = await broadcast.start_broadcast(bot, ADMIN_ID, "hello")
+        await asyncio.wait_for(bot.waiting.wait(), 5)  # первый получатель уже отправлен, второй в процессе
+        cancelled = await broadcast.cancel_broadcast(bot, job_id)
+        job = await _finish(job_id)
+        again = await broadcast.cancel_broadcast(bot, job_id)
+        pending = await db.get_broadcast_batch(job_id, 0, 10)
+        return cancelled, again, job, pending, broadcast.running_broadcasts()
+
+    cancelled, again, job, pending, running = run(scenario())
+    assert cancelled and not again
+    assert (job["status"], job["sent"]) == ("cancelled", 1)
+    assert [telegram_id for _, telegram_id in pending] == [2, 3, 4, 5]
+    assert running == []
+    assert bot.sent == [1]
+    assert "остановлена" in bot.edits[-1]
+
+
+def test_unexpected_error_marks_the_job_failed(db, run, engine, monkeypatch):
+    bot = _Bot()
+    save = broadcast.save_broadcast_results
+
+    async def broken_save(job_id, results, cursor):
+        if cursor > 2:
+            raise RuntimeError("disk full")
+        await save(job_id, results, cursor)
+
+    monkeypatch.setattr(broadcast, "save_broadcast_results", broken_save)
+
+    async def scenario():
+        await _seed(db)
+        job_id = await broadcast.start_broadcast(bot, ADMIN_ID, "hello")
+        job = await _finish(job_id)
+        return job, await db.get_running_broadcast_jobs()
+
+    job, running = run(scenario())
+    assert (job["status"], job["cursor"], job["sent"]) == ("failed", 2, 2)
+    assert running == []
+    assert "прервана" in bot.edits[-1]
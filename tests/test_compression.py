@@ -0,0 +1,91 @@
+import asyncio
+import gzip
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from bot import web_app
+from bot.services import compression
+from bot.services.json_codec import json_response
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, deflate, br", "br"),
+    ("gzip;q=1.0, br;q=0", "gzip"),
+    ("br;q=0.5", "br"),
+    ("*", "br"),
+    ("identity", None),
+    ("gzip;q=bogus", None),
+    ("", None),
+])
+def test_choose_encoding(monkeypatch, header, expected):
+    monkeypatch.setattr(compression, "available_encodings", lambda: ["br", "gzip"])
+    assert compression.choose_encoding(header) == expected
+
+
+def test_choose_encoding_without_brotli(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert compression.choose_encoding("br, gzip") == "gzip"
+    assert compression.choose_encoding("br") is None
+
+
+def _feed_app(state):
+    async def feed(request):
+        return json_response(state["items"], headers={"X-Next-Cursor": "abc"})
+
+    app = web.Application(middlewares=[web_app.compress_responses, web_app.conditional_get])
+    app.router.add_get("/api/market", feed)
+    return app
+
+
+def _requests(state, *calls):
+    """Выполнить по очереди GET /api/market с заголовками из calls; вернуть (status, headers, body)."""
+    async def scenario():
+        async with TestClient(TestServer(_feed_app(state))) as client:
+            results = []
+            for headers in calls:
+                if callable(headers):
+                    headers = headers(results)
+                response = await client.get("/api/market", headers=headers, auto_decompress=False)
+                results.append((response.status, response.headers, await response.read()))
+            return results
+
+    return asyncio.run(scenario())
+
+
+def test_compressed_etag_gets_encoding_suffix_and_revalidates(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    state = {"items": [{"id": i, "description": "x" * 40} for i in range(50)]}
+    gzip_only = {"Accept-Encoding": "gzip"}
+
+    first, revalidated = _requests(
+        state, gzip_only, lambda results: {**gzip_only, "If-None-Match": results[0][1]["ETag"]},
+    )
+    status, headers, body = first
+    assert status == 200 and headers["Content-Encoding"] == "gzip"
+    assert headers["ETag"].endswith('-gzip"')
+    assert gzip.decompress(body).startswith(b'[{"id":0')
+
+    status, headers, body = revalidated
+    assert status == 304 and body == b""
+    assert headers["ETag"] == first[1]["ETag"]  # тот же тег, что закэширован у клиента
+    assert headers["X-Next-Cursor"] == "abc"
+
+
+def test_plain_etag_matches_compressed_one_and_changes_with_content(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    state = {"items": [{"id": i, "description": "x" * 40} for i in range(50)]}
+
+    def change_then_revalidate(results):
+        state["items"] = state["items"][1:]
+        return {"If-None-Match": results[0][1]["ETag"]}
+
+    first, same, changed = _requests(
+        state,
+        {"Accept-Encoding": "gzip"},
+        lambda results: {"Accept-Encoding": "identity", "If-None-Match": results[0][1]["ETag"]},
+        change_then_revalidate,
+    )
+    assert same[0] == 304  # суффикс кодировки при сравнении не важен
+    assert changed[0] == 200 and changed[1]["ETag"] != first[1]["ETag"]
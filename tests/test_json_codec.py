@@ -0,0 +1,47 @@
+import datetime
+import decimal
+import json
+import sqlite3
+
+import pytest
+
+from bot.services import json_codec
+
+
+def test_default_handles_types_json_does_not():
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("SELECT 1 AS id, 'USD' AS currency").fetchone()
+
+    assert json_codec._default(datetime.datetime(2024, 1, 2, 3, 4, 5)) == "2024-01-02T03:04:05"
+    assert json_codec._default(datetime.date(2024, 1, 2)) == "2024-01-02"
+    assert json_codec._default(datetime.time(3, 4)) == "03:04:00"
+    assert json_codec._default(row) == {"id": 1, "currency": "USD"}
+    assert json_codec._default(decimal.Decimal("12650.5")) == 12650.5
+    assert sorted(json_codec._default({3, 1, 2})) == [1, 2, 3]
+    assert json_codec._default((1, 2)) == [1, 2]
+
+
+def test_default_rejects_unknown_types():
+    with pytest.raises(TypeError, match="object"):
+        json_codec._default(object())
+
+
+@pytest.mark.parametrize("backend", ["stdlib", "orjson"])
+def test_backends_agree(backend):
+    name, dumps_bytes, loads = json_codec._select_backend(backend)
+    if backend == "orjson" and name != "orjson":
+        pytest.skip("orjson is not installed")
+    data = {"when": datetime.date(2024, 1, 2), "rate": decimal.Decimal("1.5"), "text": "курс"}
+    encoded = dumps_bytes(data)
+    assert isinstance(encoded, bytes)
+    assert loads(encoded) == json.loads(json_codec._stdlib_dumps(data)) == {
+        "when": "2024-01-02", "rate": 1.5, "text": "курс",
+    }
+
+
+def test_json_response_encodes_once_as_utf8():
+    response = json_codec.json_response({"text": "курс"}, status=201)
+    assert response.status == 201
+    assert response.content_type == "application/json" and response.charset == "utf-8"
+    assert json.loads(response.body.decode("utf-8")) == {"text": "курс"}
@@ -0,0 +1,268 @@
+import asyncio
+import datetime
+import time
+from types import SimpleNamespace
+
+import pytest
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from pyrogram.errors import FloodWait, SlowmodeWait
+
+from bot.services import poster, scheduler
+from bot.services.chat_activity import ChatActivityCache
+from bot.services.poster import MailingResult
+from bot.services.send_pacer import SendPacer
+from bot.services.template_cache import TemplatePayload
+
+
+def _pacer(**kwargs) -> SendPacer:
+    options = {"rate_per_minute": 600, "burst": 10, "jitter_min": 0, "jitter_max": 0}
+    return SendPacer(**{**options, **kwargs})
+
+
+# ---------- SendPacer ----------
+
+def test_reserve_spaces_sends_after_burst():
+    pacer = _pacer(rate_per_minute=60, burst=2)
+    slots = [pacer.reserve(1) for _ in range(4)]
+    assert slots[1] - slots[0] == pytest.approx(0, abs=0.01)
+    assert slots[2] - slots[0] == pytest.approx(1.0, abs=0.01)
+    assert slots[3] - slots[2] == pytest.approx(1.0, abs=0.01)
+    # у другого аккаунта свой bucket
+    assert pacer.reserve(2) == pytest.approx(time.monotonic(), abs=0.01)
+
+
+def test_flood_wait_pauses_account_and_slows_it_down():
+    pacer = _pacer(rate_per_minute=60, backoff=0.5, recovery=0.25)
+    until = pacer.on_flood_wait(1, 30)
+    assert until == pytest.approx(time.monotonic() + 30, abs=0.01)
+    assert pacer.ready_at(1) == until
+    assert pacer.reserve(1) >= until
+    assert pacer._buckets[1].factor == 0.5
+    pacer.on_success(1)
+    assert pacer._buckets[1].factor == 0.75
+    assert pacer.stats()["flood_waits"] == 1
+    assert pacer.ready_at(2) == 0.0
+
+
+def test_slowmode_blocks_only_that_chat():
+    pacer = _pacer()
+    until = pacer.on_slowmode_wait(-100, 60)
+    assert pacer.ready_at(1, -100) == until
+    assert pacer.ready_at(1, -200) == 0.0
+    assert pacer.ready_at(1) == 0.0
+
+
+# ---------- MailingResult ----------
+
+def test_mailing_result_truthiness_and_deactivation():
+    assert not MailingResult() and not MailingResult().should_deactivate
+    assert MailingResult(sent=1, failed=2) and not MailingResult(sent=1, failed=2).should_deactivate
+    assert MailingResult(failed=2).should_deactivate
+    assert not MailingResult(failed=1, deferred=[5]).should_deactivate
+    assert not MailingResult(skipped=3).should_deactivate
+
+
+# ---------- run_mailing_task ----------
+
+class _Client:
+    def __init__(self, errors: dict | None = None):
+        self.errors = errors or {}  # chat_id -> исключение первой отправки
+        self.sent = []
+
+    async def resolve_peer(self, chat_id):
+        return chat_id
+
+    async def get_me(self):
+        return SimpleNamespace(id=999)
+
+    async def get_chat_history(self, chat_id, limit):
+        return
+        yield
+
+    async def send_chat_action(self, chat_id, action):
+        return True
+
+    async def send_message(self, chat_id, text, **kwargs):
+        error = self.errors.pop(chat_id, None)
+        if error is not None:
+            raise error
+        self.sent.append(chat_id)
+        return SimpleNamespace(id=len(self.sent))
+
+
+@pytest.fixture
+def mailing(monkeypatch):
+    """Окружение run_mailing_task без Telegram и БД: state — что вызывалось."""
+    state = SimpleNamespace(
+        client=_Client(), payload=TemplatePayload(7, "text", "hello", None, []), deactivated=[], download=None,
+    )
+
+    async def get_user(user_id):
+        return (1, user_id, "ru", "session")
+
+    async def get_template_payload(template_id):
+        return state.payload
+
+    async def get_client(user_id, session_string):
+        if isinstance(state.client, Exception):
+            raise state.client
+        return state.client
+
+    async def deactivate_task(task_id):
+        state.deactivated.append(task_id)
+
+    async def get_uploaded_media(*args):
+        return None
+
+    async def download_media(file_id, media_type):
+        return state.download
+
+    monkeypatch.setattr(poster, "get_user", get_user)
+    monkeypatch.setattr(poster, "get_template_payload", get_template_payload)
+    monkeypatch.setattr(poster, "get_client", get_client)
+    monkeypatch.setattr(poster, "deactivate_task", deactivate_task)
+    monkeypatch.setattr(poster, "get_uploaded_media", get_uploaded_media)
+    monkeypatch.setattr(poster, "_download_media", download_media)
+    monkeypatch.setattr(poster, "send_pacer", _pacer())
+    monkeypatch.setattr(poster, "chat_activity", ChatActivityCache())
+    monkeypatch.setattr(poster, "MAILING_TYPING_LEAD", 0)
+    return state
+
+
+def test_all_chats_sent(mailing):
+    result = asyncio.run(poster.run_mailing_task(1, 7, [-1, "-2:5"], task_id=3))
+    assert (result.sent, result.failed, result.deferred) == (2, 0, [])
+    assert sorted(mailing.client.sent) == [-2, -1]
+
+
+def test_media_download_failure_returns_a_result(mailing):
+    mailing.payload = TemplatePayload(7, "photo", "bot-file-id", None, [])
+    result = asyncio.run(poster.run_mailing_task(1, 7, [-1, -2], task_id=3))
+    assert isinstance(result, MailingResult)
+    assert (result.sent, result.failed) == (0, 2)
+    assert result.should_deactivate
+    assert mailing.deactivated == [3]
+
+
+def test_flood_wait_on_connect_defers_everything(mailing):
+    mailing.client = FloodWait(value=600)
+    result = asyncio.run(poster.run_mailing_task(1, 7, [-1, -2], task_id=3))
+    assert result.deferred == [-1, -2]
+    assert result.retry_in == 600
+    assert not result.should_deactivate and mailing.deactivated == []
+    assert poster.send_pacer.ready_at(1) > time.monotonic() + 500
+
+    # пока аккаунт на паузе, следующий запуск даже не подключается
+    mailing.client = _Client()
+    again = asyncio.run(poster.run_mailing_task(1, 7, [-1], task_id=3))
+    assert again.deferred == [-1] and mailing.client.sent == []
+
+
+def test_long_flood_wait_while_sending_defers_the_chat(mailing):
+    mailing.client = _Client({-1: FloodWait(value=600)})
+    result = asyncio.run(poster.run_mailing_task(1, 7, [-1, -2], task_id=3))
+    assert -1 in result.deferred
+    assert result.sent + len(result.deferred) == 2
+    assert result.retry_in == pytest.approx(600, abs=1)
+    assert not result.should_deactivate and mailing.deactivated == []
+
+
+def test_slowmode_defers_only_that_chat(mailing):
+    mailing.client = _Client({-1: SlowmodeWait(value=600)})
+    result = asyncio.run(poster.run_mailing_task(1, 7, [-1, -2], task_id=3))
+    assert result.deferred == [-1]
+    assert mailing.client.sent == [-2]
+    assert result.sent == 1
+
+
+def test_short_flood_wait_is_retried_in_place(mailing):
+    mailing.client = _Client({-1: FloodWait(value=0)})
+    result = asyncio.run(poster.run_mailing_task(1, 7, [-1], task_id=3))
+    assert (result.sent, result.deferred) == (1, [])
+
+
+# ---------- планировщик ----------
+
+@pytest.fixture
+def jobs(monkeypatch):
+    """Свежий планировщик (на паузе) и подменённые зависимости _mailing_job."""
+    state = SimpleNamespace(results=[], deactivated=[], last_run=[])
+
+    async def run_mailing_task(user_id, template_id, target_groups, task_id=None):
+        return state.results.pop(0)
+
+    async def deactivate_task(task_id):
+        state.deactivated.append(task_id)
+
+    async def update_last_run(task_id):
+        state.last_run.append(task_id)
+
+    monkeypatch.setattr(scheduler, "run_mailing_task", run_mailing_task)
+    monkeypatch.setattr(scheduler, "deactivate_task", deactivate_task)
+    monkeypatch.setattr(scheduler, "update_last_run", update_last_run)
+    monkeypatch.setattr(scheduler, "scheduler", AsyncIOScheduler())
+    monkeypatch.setattr(scheduler, "_within_window", lambda start, end: True)
+    return state
+
+
+def _with_scheduler(coro):
+    async def wrapper():
+        scheduler.scheduler.start(paused=True)
+        try:
+            return await coro
+        finally:
+            scheduler.scheduler.shutdown(wait=False)
+
+    return asyncio.run(wrapper())
+
+
+def test_deferred_chats_are_merged_into_the_pending_retry(jobs):
+    jobs.results = [
+        MailingResult(sent=1, deferred=[-1, -2], retry_in=300),
+        MailingResult(deferred=[-2, "-3:7"], retry_in=60),
+    ]
+
+    async def scenario():
+        await scheduler._mailing_job(3, 1, 7, [-1, -2, -4], "09:00", "18:00")
+        first = scheduler.scheduler.get_job("mailing_3_retry").next_run_time
+        await scheduler._mailing_job(3, 1, 7, [-2, "-3:7"], "09:00", "18:00", retry=True)
+        job = scheduler.scheduler.get_job("mailing_3_retry")
+        return first, job.next_run_time, job.args
+
+    first, second, args = _with_scheduler(scenario())
+    assert args[3] == [-1, -2, "-3:7"]
+    assert args[6] is True
+    assert second < first  # более ранний срок из двух
+    assert jobs.last_run == [3]
+
+
+def test_failed_run_deactivates_but_failed_retry_does_not(jobs):
+    jobs.results = [MailingResult(failed=2), MailingResult(failed=2)]
+
+    async def scenario():
+        scheduler.schedule_mailing_task(3, 1, 7, [-1, -2], "09:00", "18:00", 5)
+        await scheduler._mailing_job(3, 1, 7, [-1, -2], "09:00", "18:00", retry=True)
+        kept = scheduler.scheduler.get_job("mailing_3") is not None
+        await scheduler._mailing_job(3, 1, 7, [-1, -2], "09:00", "18:00")
+        return kept, scheduler.scheduler.get_job("mailing_3")
+
+    kept, job = _with_scheduler(scenario())
+    assert kept and job is None
+    assert jobs.deactivated == [3]
+
+
+def test_retry_outside_window_moves_to_the_next_window(jobs, monkeypatch):
+    monkeypatch.setattr(scheduler, "_within_window", lambda start, end: False)
+
+    async def scenario():
+        await scheduler._mailing_job(3, 1, 7, [-1, -2], "09:00", "18:00", retry=True)
+        await scheduler._mailing_job(4, 1, 7, [-5], "09:00", "18:00")
+        return scheduler.scheduler.get_job("mailing_3_retry"), scheduler.scheduler.get_job("mailing_4_retry")
+
+    job, skipped = _with_scheduler(scenario())
+    assert skipped is None  # обычный запуск вне окна просто пропускается
+    assert job.args[3] == [-1, -2] and job.args[6] is True
+    expected = datetime.datetime.now().astimezone() + datetime.timedelta(seconds=scheduler._seconds_until("09:00"))
+    assert abs((job.next_run_time - expected).total_seconds()) < 5
+    assert job.next_run_time.astimezone().strftime("%H:%M") == "09:00"
+    assert jobs.results == [] and jobs.last_run == []
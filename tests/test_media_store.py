@@ -0,0 +1,99 @@
+import asyncio
+import json
+
+import pytest
+
+from bot import web_app
+from bot.services import media_store
+from tests.test_migrations import PNG_DATA_URL
+
+EXTERNAL_URL = "https://example.com/images/cat.png"
+
+
+class _Request:
+    def __init__(self, data: dict, match_info: dict | None = None):
+        self._data = data
+        self.match_info = match_info or {}
+
+    async def json(self):
+        return self._data
+
+
+@pytest.fixture
+def media_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(media_store, "MEDIA_DIR", str(tmp_path / "media"))
+    return tmp_path / "media"
+
+
+def test_store_image_rewrites_only_data_urls(media_dir):
+    key = asyncio.run(media_store.store_image(PNG_DATA_URL))
+    assert media_store.is_valid_key(key)
+    assert asyncio.run(media_store.store_image(media_store.media_url(key))) == key
+    assert asyncio.run(media_store.store_image(media_store.thumb_url(key))) == key
+    assert asyncio.run(media_store.store_image(EXTERNAL_URL)) == EXTERNAL_URL
+    assert asyncio.run(media_store.store_image("")) is None
+    with pytest.raises(media_store.MediaError):
+        asyncio.run(media_store.store_image("data:text/plain;base64,aGVsbG8="))
+
+
+def test_store_image_accepts_data_urls_in_any_case(media_dir):
+    upper = "DATA:IMAGE/PNG;BASE64," + PNG_DATA_URL.split(",", 1)[1]
+    assert asyncio.run(media_store.store_image(upper)) == asyncio.run(media_store.store_image(PNG_DATA_URL))
+
+
+@pytest.mark.parametrize("value, error", [
+    (PNG_DATA_URL.split(",", 1)[1], "unsupported_image_ref"),  # голый base64
+    ("/media/not-a-key.png", "unsupported_image_ref"),
+    ("javascript:alert(1)", "unsupported_image_ref"),
+    ("ftp://example.com/cat.png", "unsupported_image_ref"),
+    ("https://example.com/cat png", "unsupported_image_ref"),
+    ("https://example.com/" + "a" * 5000, "image_url_too_long"),
+])
+def test_store_image_rejects_everything_else(media_dir, value, error):
+    with pytest.raises(media_store.MediaError, match=error):
+        asyncio.run(media_store.store_image(value))
+
+
+def test_image_urls():
+    key = "a" * 64 + ".png"
+    assert media_store.image_urls(key) == (media_store.media_url(key), media_store.thumb_url(key))
+    assert media_store.image_urls(EXTERNAL_URL) == (EXTERNAL_URL, EXTERNAL_URL)
+
+
+def test_create_and_update_post_keep_external_urls(db, run, media_dir):
+    post = {
+        "user_id": 1, "type": "sell", "amount": 100, "currency": "USD", "rate": 12650,
+        "location": "Tashkent", "description": "post", "image_data": EXTERNAL_URL,
+    }
+
+    async def scenario():
+        await db.create_tables()
+        created = await web_app.handle_create_post(_Request(post))
+        [stored] = await db.get_market_posts()
+        updated = await web_app.handle_update_post(
+            _Request({**post, "image_data": PNG_DATA_URL}, {"id": str(stored["id"])})
+        )
+        [replaced] = await db.get_market_posts()
+        return created, stored, updated, replaced
+
+    created, stored, updated, replaced = run(scenario())
+    assert created.status == 200 and json.loads(created.body)["status"] == "ok"
+    assert stored["image_data"] == stored["image_thumb"] == EXTERNAL_URL
+    assert updated.status == 200
+    assert replaced["image_data"].startswith(media_store.MEDIA_URL_PREFIX)
+
+
+def test_create_post_rejects_raw_image_strings(db, run, media_dir):
+    post = {
+        "user_id": 1, "type": "sell", "amount": 100, "currency": "USD", "rate": 12650,
+        "location": "Tashkent", "description": "post", "image_data": "x" * 100_000,
+    }
+
+    async def scenario():
+        await db.create_tables()
+        response = await web_app.handle_create_post(_Request(post))
+        return response, await db.get_market_posts()
+
+    response, posts = run(scenario())
+    assert response.status == 400 and json.loads(response.body)["error"] == "unsupported_image_ref"
+    assert posts == []
@@ -0,0 +1,162 @@
+import base64
+import os
+import sqlite3
+import time
+
+import pytest
+
+from bot.database import migrations
+from bot.services import media_store
+
+# 1x1 PNG
+PNG_DATA_URL = "data:image/png;base64," + base64.b64encode(bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)).decode()
+
+
+async def _versions(db):
+    async with db.execute("SELECT version FROM schema_version ORDER BY version") as cursor:
+        return [row[0] for row in await cursor.fetchall()]
+
+
+async def _columns(db, table):
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        return {row[1] for row in await cursor.fetchall()}
+
+
+def test_versions_are_append_only():
+    versions = [version for version, _, _ in migrations.MIGRATIONS]
+    assert versions == list(range(1, len(versions) + 1))
+    assert migrations.LATEST_VERSION == versions[-1]
+
+
+def test_fresh_database_reaches_latest_and_rerun_is_noop(db, run):
+    async def scenario():
+        async with db.pool.write() as conn:
+            first = await migrations.migrate(conn)
+            second = await migrations.migrate(conn)
+            return first, second, await _versions(conn)
+
+    first, second, versions = run(scenario())
+    assert first == migrations.LATEST_VERSION
+    assert second == 0
+    assert versions == list(range(1, migrations.LATEST_VERSION + 1))
+
+
+def test_steps_can_be_replayed(db, run):
+    # шаги идемпотентны: база, у которой потерялась часть записей schema_version, догоняется без ошибок
+    async def scenario():
+        async with db.pool.write() as conn:
+            await migrations.migrate(conn)
+            await conn.execute("DELETE FROM schema_version WHERE version > 1")
+            await conn.commit()
+            replayed = await migrations.migrate(conn)
+            return replayed, await _versions(conn)
+
+    replayed, versions = run(scenario())
+    assert replayed == migrations.LATEST_VERSION - 1
+    assert versions == list(range(1, migrations.LATEST_VERSION + 1))
+
+
+def test_legacy_database_is_upgraded(db, run, tmp_path, monkeypatch):
+    monkeypatch.setattr(media_store, "MEDIA_DIR", str(tmp_path / "media"))
+    legacy = sqlite3.connect(db.pool.db_path)
+    legacy.executescript("""
+        CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, telegram_id INTEGER UNIQUE, language TEXT);
+        CREATE TABLE market_posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, type TEXT, amount REAL, currency TEXT,
+            rate REAL, location TEXT, description TEXT, image_data TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    legacy.execute("INSERT INTO users (telegram_id, language) VALUES (1, 'ru')")
+    legacy.execute(
+        "INSERT INTO market_posts (user_id, type, image_data) VALUES (1, 'sell', ?)", (PNG_DATA_URL,)
+    )
+    legacy.commit()
+    legacy.close()
+
+    async def scenario():
+        async with db.pool.write() as conn:
+            await migrations.migrate(conn)
+            async with conn.execute("SELECT image_key, image_data FROM market_posts") as cursor:
+                post = await cursor.fetchone()
+            return await _columns(conn, "users"), post
+
+    users_columns, (image_key, image_data) = run(scenario())
+    assert {"role", "rating", "bot_blocked_at"} <= users_columns
+    assert image_data is None
+    assert media_store.is_valid_key(image_key)
+    assert os.path.exists(media_store.media_path(image_key))
+
+
+def test_failed_step_rolls_back(db, run, monkeypatch):
+    async def broken(conn):
+        await conn.execute("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("boom")
+
+    latest = migrations.LATEST_VERSION + 1
+    monkeypatch.setattr(migrations, "MIGRATIONS", [*migrations.MIGRATIONS, (latest, "broken", broken)])
+    monkeypatch.setattr(migrations, "LATEST_VERSION", latest)
+
+    async def scenario():
+        async with db.pool.write() as conn:
+            with pytest.raises(RuntimeError):
+                await migrations.migrate(conn)
+            async with conn.execute("SELECT name FROM sqlite_master WHERE name IN ('half_done', 'schema_version')") as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+    assert run(scenario()) == []
+
+
+def test_street_rates_are_backfilled_into_history(db, run):
+    now = int(time.time())
+    hour = now - now % 3600
+
+    async def scenario():
+        async with db.pool.write() as conn:
+            await migrations.migrate(conn)
+            # курсы, записанные до истории (только market_rates), и одна точка, уже попавшая в обе таблицы
+            await conn.executemany(
+                "INSERT INTO market_rates (currency_pair, rate_buy, rate_sell, timestamp) VALUES (?, ?, ?, datetime(?, 'unixepoch'))",
+                [("USD/UZS", 12600, None, hour - 7200), ("USD/UZS", None, 13000, hour - 7100),
+                 ("USD/UZS", 12800, None, hour - 3600), ("RUB/UZS", 138, None, now - 5 * 86400)],
+            )
+            await conn.execute("DELETE FROM schema_version WHERE version >= 9")
+            await conn.commit()
+        await db.add_rate_points([("street", "USD/UZS", hour - 3600, 12800)])
+        async with db.pool.write() as conn:
+            applied = await migrations.migrate(conn)
+        history = await db.get_rate_history("street", "USD/UZS", "1d", 0, now + 86400)
+        return applied, dict((pair, avg) for pair, avg, _ in await db.get_average_rates()), history
+
+    applied, averages, history = run(scenario())
+    assert applied == migrations.LATEST_VERSION - 8
+    # средний курс — только покупка за 24 часа; в историю попадают обе стороны
+    assert averages == {"USD/UZS": pytest.approx((12600 + 12800) / 2)}
+    assert sum(bucket["count"] for bucket in history) == 3
+
+
+def test_media_uploads_key_column_is_renamed(db, run):
+    async def scenario():
+        async with db.pool.write() as conn:
+            await migrations.migrate(conn)
+            # база до миграции 11: колонка ещё media_hash
+            await conn.execute("ALTER TABLE media_uploads RENAME COLUMN file_key TO media_hash")
+            await conn.execute(
+                "INSERT INTO media_uploads (account_id, template_id, media_hash, media_type, file_id) VALUES (1, 7, 'k', 'photo', 'F1')"
+            )
+            await conn.execute("DELETE FROM schema_version WHERE version >= 11")
+            await conn.commit()
+            await migrations.migrate(conn)
+            columns = await _columns(conn, "media_uploads")
+        kept = await db.get_uploaded_media(1, 7, "k")
+        await db.save_uploaded_media(1, 7, "k2", "photo", "F2")
+        return columns, kept, await db.get_uploaded_media(1, 7, "k"), await db.get_uploaded_media(1, 7, "k2")
+
+    columns, kept, old, new = run(scenario())
+    assert "file_key" in columns and "media_hash" not in columns
+    assert kept == "F1"
+    assert old is None  # файл шаблона сменился — старая загрузка удалена
+    assert new == "F2"
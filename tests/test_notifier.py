@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from bot.services.notifier import NotificationDispatcher
+
+
+class _Bot:
+    """send_message записывает (chat_id, text, время); errors[chat_id] — ошибки первых попыток."""
+
+    def __init__(self, errors: dict | None = None):
+        self.errors = errors or {}
+        self.calls = []
+
+    async def send_message(self, chat_id, text):
+        now = time.monotonic()
+        pending = self.errors.get(chat_id)
+        if pending:
+            raise pending.pop(0)
+        self.calls.append((chat_id, text, now))
+        return text
+
+
+def _dispatch(dispatcher, bot, messages, timeout=5.0):
+    async def scenario():
+        start = time.monotonic()
+        results = await asyncio.gather(
+            *(dispatcher.call(bot, "send_message", chat_id, text=text) for chat_id, text in messages),
+            return_exceptions=True,
+        )
+        await dispatcher.close(timeout)
+        return start, results
+
+    return asyncio.run(scenario())
+
+
+def _retry_after(seconds):
+    return TelegramRetryAfter(SendMessage(chat_id=1, text="x"), "Too Many Requests", seconds)
+
+
+def _immediate_requeue(dispatcher):
+    """_requeue_later без задержки: экспоненциальный backoff в тестах не ждём."""
+    original = dispatcher._requeue_later
+    return lambda job, delay: original(job, 0)
+
+
+def test_token_bucket_allows_a_burst_then_holds_the_rate():
+    dispatcher = NotificationDispatcher(workers=8, global_rate=20, chat_interval=0)
+    bot = _Bot()
+    start, _ = _dispatch(dispatcher, bot, [(chat_id, "hi") for chat_id in range(1, 26)])
+    offsets = sorted(t - start for _, _, t in bot.calls)
+    assert len(offsets) == 25
+    assert offsets[19] < 0.1  # полный bucket — 20 сразу
+    assert offsets[-1] == pytest.approx(5 / 20, abs=0.08)  # остальные 5 — по 1/20 с
+
+
+def test_messages_to_one_chat_keep_the_interval():
+    dispatcher = NotificationDispatcher(workers=4, global_rate=100, chat_interval=0.1)
+    bot = _Bot()
+    _dispatch(dispatcher, bot, [(1, "a"), (1, "b"), (1, "c"), (2, "x")])
+    times = [t for chat_id, _, t in bot.calls if chat_id == 1]
+    assert len(times) == 3
+    assert all(later - earlier >= 0.09 for earlier, later in zip(times, times[1:]))
+    # другой чат этим интервалом не задерживается
+    assert [chat_id for chat_id, _, _ in bot.calls][:2] in ([1, 2], [2, 1])
+
+
+def test_retry_after_pauses_all_sends_and_retries():
+    dispatcher = NotificationDispatcher(workers=2, global_rate=100, chat_interval=0)
+    bot = _Bot({1: [_retry_after(1)]})
+
+    async def scenario():
+        start = time.monotonic()
+        first = asyncio.create_task(dispatcher.call(bot, "send_message", 1, text="a"))
+        await asyncio.sleep(0.05)  # флуд-лимит уже получен
+        second = await dispatcher.call(bot, "send_message", 2, text="b")
+        result = await first
+        await dispatcher.close()
+        return start, result, second
+
+    start, result, second = asyncio.run(scenario())
+    assert (result, second) == ("a", "b")
+    assert all(t - start >= 0.95 for _, _, t in bot.calls)  # пауза общая для всех чатов
+    assert dispatcher.rate_limited == 1 and dispatcher.sent == 2
+
+
+def test_transient_errors_are_retried_and_permanent_ones_are_not(monkeypatch):
+    dispatcher = NotificationDispatcher(workers=2, global_rate=100, chat_interval=0, max_retries=1)
+    forbidden = TelegramForbiddenError(SendMessage(chat_id=2, text="x"), "bot was blocked by the user")
+    bot = _Bot({1: [TelegramNetworkError(SendMessage(chat_id=1, text="x"), "reset")], 2: [forbidden]})
+    monkeypatch.setattr(dispatcher, "_requeue_later", _immediate_requeue(dispatcher))
+
+    _, results = _dispatch(dispatcher, bot, [(1, "a"), (2, "b")])
+    assert results[0] == "a"
+    assert results[1] is forbidden
+    assert (dispatcher.retried, dispatcher.failed, dispatcher.sent) == (1, 1, 1)
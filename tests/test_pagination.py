@@ -0,0 +1,46 @@
+import json
+
+from bot import web_app
+
+
+class _Request:
+    def __init__(self, query: dict):
+        self.query = query
+
+
+async def _seed_tied_orders(db, count):
+    await db.create_tables()
+    for _ in range(count):
+        await db.create_order(7, 100, "USD", "Tashkent", "pickup")
+    async with db.pool.write() as conn:
+        # все заявки с одним created_at — порядок держится только на id
+        await conn.execute("UPDATE orders SET created_at = '2024-01-01 12:00:00'")
+        await conn.commit()
+
+
+def test_pages_walk_through_created_at_ties(db, run):
+    async def scenario():
+        await _seed_tied_orders(db, 7)
+        pages, cursor = [], None
+        while True:
+            query = {"user_id": "7", "limit": "3", **({"cursor": cursor} if cursor else {})}
+            response = await web_app.handle_get_my_orders(_Request(query))
+            assert response.headers["Access-Control-Expose-Headers"] == "X-Next-Cursor"
+            pages.append([order["id"] for order in json.loads(response.body)])
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                return pages
+
+    pages = run(scenario())
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert sum(pages, []) == list(range(7, 0, -1))
+
+
+def test_my_endpoints_are_unpaginated_without_limit(db, run):
+    async def scenario():
+        await _seed_tied_orders(db, web_app.DEFAULT_PAGE_SIZE + 5)
+        return await web_app.handle_get_my_orders(_Request({"user_id": "7"}))
+
+    response = run(scenario())
+    assert len(json.loads(response.body)) == web_app.DEFAULT_PAGE_SIZE + 5
+    assert "X-Next-Cursor" not in response.headers
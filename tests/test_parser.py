@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from bot.services import parser
+from bot.services.parser import ALLOWED_RANGES, extract_rates, parse_market_message, _filter_and_average
+from bot.services.parser_bench import SAMPLE_CORPUS, legacy_extract, benchmark
+
+# Что должно находиться в каждом сообщении корпуса (после _filter_and_average)
+EXPECTED = {
+    "USD 12650 sotaman": [("USD/UZS", "sell", 12650.0)],
+    "$ 12 600 olaman, Chilonzor": [("USD/UZS", "buy", 12600.0)],
+    "Dollar olaman 12.650 tezkor": [("USD/UZS", "buy", 12650.0)],
+    "Куплю доллар 12640, центр, срочно": [("USD/UZS", "buy", 12640.0)],
+    "Продам USDT 12700\nКуплю $ 12620": [("USDT/UZS", "sell", 12700.0), ("USD/UZS", "buy", 12620.0)],
+    "Доллар 12,650 сўм, рубль 140": [("USD/UZS", None, 12650.0), ("RUB/UZS", None, 140.0)],
+    "Assalomu alaykum! Kim dollar sotadi? 12 630 dan olaman, Yunusobod": [("USD/UZS", "buy", 12630.0)],
+    "RUB 138 беру, от 100 000 рублей": [("RUB/UZS", "buy", 138.0)],
+    "usd/uzs 12 650 / 12 700": [("USD/UZS", None, 12675.0)],
+    "Всем привет, кто сегодня работает?": [],
+    "salom 2024 yil 5 ta joy bor": [],
+    "Tenge: USDT 505 KZT, сом 89": [("USDT/KZT", None, 505.0), ("USDT/KGS", None, 89.0)],
+    "Долларни 12660 га оламан": [("USD/UZS", "buy", 12660.0)],
+    "Евро 0.92, доллар 12650, рубль 141 — обмен в офисе, звоните +998 90 123 45 67": [
+        ("USD/UZS", None, 12650.0), ("RUB/UZS", None, 141.0),
+    ],
+    "Продаю $ 12 710, Сергели, доставка": [("USD/UZS", "sell", 12710.0)],
+    "1$ = 12650 sum": [("USD/UZS", None, 12650.0)],
+    "1 usd = 12700": [("USD/UZS", None, 12700.0)],
+    "sotaman 1 dona 12800": [("USD/UZS", "sell", 12800.0)],
+    "100$ bor 12650 dan": [("USD/UZS", None, 12650.0)],
+    "RUB 138 беру": [("RUB/UZS", "buy", 138.0)],
+}
+
+# Старый разбор здесь ошибался: "0.92" читал как 92 (USD/EGP), количество "100$" — как курс
+LEGACY_MISREADS = {
+    ("Евро 0.92, доллар 12650, рубль 141 — обмен в офисе, звоните +998 90 123 45 67", 92.0),
+    ("100$ bor 12650 dan", 100.0),
+}
+
+
+def test_corpus_is_covered():
+    assert set(EXPECTED) == set(SAMPLE_CORPUS)
+
+
+@pytest.mark.parametrize("text", SAMPLE_CORPUS)
+def test_extract_rates(text):
+    assert _filter_and_average(extract_rates(text)) == EXPECTED[text]
+
+
+@pytest.mark.parametrize("text", SAMPLE_CORPUS)
+def test_parity_with_legacy_parser(text):
+    # всё, что старый разбор находил верно, новый тоже находит — с тем же значением
+    # (до усреднения: старый разбор сводил USDT и USD одной строки в один USD/UZS)
+    found = {rate for _, _, rate in extract_rates(text)}
+    for pair, _, rate in legacy_extract(text):
+        low, high = ALLOWED_RANGES[pair]
+        if low <= rate <= high and (text, rate) not in LEGACY_MISREADS:
+            assert rate in found, (pair, rate)
+
+
+@pytest.mark.parametrize("text, rate", [
+    ("1$ = 12650 sum", 1.0),
+    ("1 usd = 12700", 1.0),
+    ("sotaman 1 dona 12800", 1.0),
+    ("100$ bor 12650 dan", 100.0),
+])
+def test_quantities_are_not_rates(text, rate):
+    assert rate not in {r for _, _, r in extract_rates(text)}
+
+
+def test_explicit_currency_beats_default_order():
+    assert extract_rates("RUB 138 беру") == [("RUB/UZS", "buy", 138.0)]
+    assert extract_rates("138 rub") == [("USD/RUB", None, 138.0)]
+    # без валют — как раньше, по DEFAULT_PAIR_ORDER
+    assert extract_rates("50 olaman") == [("USD/EGP", "buy", 50.0)]
+
+
+def test_parse_market_message_without_ai(monkeypatch):
+    monkeypatch.setattr(parser.ai_parser, "api_key", None)
+    assert asyncio.run(parse_market_message("1$ = 12650 sum")) == [("USD/UZS", None, 12650.0)]
+
+
+def test_benchmark_counts_only_plausible_rates():
+    result = benchmark(rounds=1)
+    assert result["compiled"]["rates_found"] == sum(len(rates) for rates in EXPECTED.values())
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+import main
+from bot.database.pool import ConnectionPool, parse_pragmas
+
+
+def test_parse_pragmas():
+    assert parse_pragmas("busy_timeout=5000, cache_size=-8000,bad,=x") == {
+        "busy_timeout": "5000",
+        "cache_size": "-8000",
+    }
+
+
+def test_readers_are_bounded_and_reused(tmp_path):
+    async def scenario():
+        pool = ConnectionPool(str(tmp_path / "p.db"), size=2, acquire_timeout=0.2)
+        async with pool.read() as a, pool.read() as b:
+            assert a is not b
+            with pytest.raises(TimeoutError):
+                async with pool.read():
+                    pass
+        async with pool.read() as c:
+            assert c in (a, b)
+        assert pool._opened == 2
+        await pool.close()
+        assert pool._all == []
+
+    asyncio.run(scenario())
+
+
+def test_writer_is_serialized_and_rolled_back(tmp_path):
+    async def scenario():
+        pool = ConnectionPool(str(tmp_path / "p.db"))
+        async with pool.write() as db:
+            await db.execute("CREATE TABLE t (v INTEGER)")
+            await db.commit()
+
+        order = []
+
+        async def writer(n):
+            async with pool.write() as db:
+                order.append(("in", n))
+                await asyncio.sleep(0.01)
+                await db.execute("INSERT INTO t VALUES (?)", (n,))
+                await db.commit()
+                order.append(("out", n))
+
+        await asyncio.gather(writer(1), writer(2))
+        assert order in ([("in", 1), ("out", 1), ("in", 2), ("out", 2)],
+                         [("in", 2), ("out", 2), ("in", 1), ("out", 1)])
+
+        # незакоммиченная запись не переживает возврат соединения в пул
+        async with pool.write() as db:
+            await db.execute("INSERT INTO t VALUES (3)")
+        async with pool.read() as db:
+            async with db.execute("SELECT COUNT(*) FROM t") as cursor:
+                assert (await cursor.fetchone())[0] == 2
+        await pool.close()
+
+    asyncio.run(scenario())
+
+
+class _FakeBot:
+    class session:
+        @staticmethod
+        async def close():
+            pass
+
+
+def test_shutdown_runs_every_step_in_order(monkeypatch):
+    names = [name for name, _ in main.shutdown_steps(bot=_FakeBot(), runner=None)]
+    # производители работы закрываются раньше того, чем они пользуются; БД — последней
+    assert names.index("rate ingestion") < names.index("AI parser") < names.index("rates HTTP session")
+    assert names.index("broadcasts") < names.index("notifier") < names.index("bot session")
+    assert names[-1] == "database"
+
+    called = []
+
+    def step(name, fail=False):
+        async def close():
+            called.append(name)
+            if fail:
+                raise RuntimeError("boom")
+        return name, close
+
+    monkeypatch.setattr(main, "shutdown_steps", lambda bot, runner: [step("a"), step("b", fail=True), step("c")])
+    asyncio.run(main.shutdown())
+    assert called == ["a", "b", "c"]
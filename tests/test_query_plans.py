@@ -0,0 +1,144 @@
+import ast
+import re
+import time
+
+import pytest
+
+from bot.database import database
+
+SQL_RE = re.compile(r"^\s*(SELECT|UPDATE|DELETE|INSERT|REPLACE|WITH)\b", re.IGNORECASE)
+
+# Запросы, которые намеренно читают всю (маленькую) таблицу
+FULL_SCANS = {
+    "get_categories": "весь справочник категорий",
+    "get_rate_ingest_chats": "все отслеживаемые чаты с живой сессией владельца",
+    "get_rate_ingest_stats": "строка на чат, сортировка по счётчику",
+}
+
+# SQL, собранный в коде из частей, — представительный вариант для EXPLAIN
+DYNAMIC_QUERIES = {
+    "update_market_post": "UPDATE market_posts SET amount = ?, image_key = ?, image_data = NULL WHERE id = ? AND user_id = ?",
+}
+
+
+def _docstrings(tree):
+    nodes = [tree, *(n for n in ast.walk(tree) if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)))]
+    return {
+        id(node.body[0].value) for node in nodes
+        if node.body and isinstance(node.body[0], ast.Expr) and isinstance(node.body[0].value, ast.Constant)
+    }
+
+
+def _module_queries():
+    """
+    Все SQL-литералы database.py: [(функция, sql)].
+    f-строки вычисляются в пространстве имён модуля; те, что зависят от локальных переменных, — в DYNAMIC_QUERIES.
+    Страничные шаблоны проверяются на первой странице ({page} -> 1).
+    """
+    tree = ast.parse(open(database.__file__, encoding="utf-8").read())
+    skip = _docstrings(tree)
+    owners = {}
+    for fn in ast.walk(tree):
+        if isinstance(fn, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            for node in ast.walk(fn):
+                owners.setdefault(id(node), fn.name)
+
+    queries, unresolved = [], set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.JoinedStr):
+            skip.update(id(part) for part in node.values)
+            try:
+                sql = eval(compile(ast.Expression(node), database.__file__, "eval"), vars(database))
+            except NameError:
+                if SQL_RE.match(node.values[0].value if isinstance(node.values[0], ast.Constant) else ""):
+                    unresolved.add(owners.get(id(node), "<module>"))
+                continue
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str) and id(node) not in skip:
+            sql = node.value
+        else:
+            continue
+        if SQL_RE.match(sql):
+            queries.append((owners.get(id(node), "<module>"), sql.replace("{page}", "1")))
+    return queries, unresolved
+
+
+async def _scans(conn, sql):
+    async with conn.execute(f"EXPLAIN QUERY PLAN {sql}", (None,) * sql.count("?")) as cursor:
+        plan = [row[3] for row in await cursor.fetchall()]
+    return [
+        detail for detail in plan
+        if detail.startswith("SCAN ") and " INDEX " not in detail
+        and not detail.startswith(("SCAN (subquery", "SCAN CONSTANT ROW"))
+    ]
+
+
+async def _seed(db):
+    """Немного разнородных данных и ANALYZE — планировщик видит реальную статистику."""
+    await db.create_tables()
+    for uid in range(1, 41):
+        await db.add_user(uid, "ru")
+        order_id = await db.create_order(uid, 100 * uid, "USD", "Tashkent", "pickup")
+        for exchanger in range(41, 44):
+            await db.place_bid(order_id, exchanger, 12600 + uid, "1h", "")
+        await db.create_market_post(uid, "sell", 50, "USD", 12650, "Tashkent", "post")
+        await db.add_review(uid, uid % 5 + 1, 5)
+    now = int(time.time())
+    await db.add_rate_points([("street", "USD/UZS", now - i * 600, 12600 + i) for i in range(50)])
+    await db.create_broadcast_job(1, "hello")
+    async with db.pool.write() as conn:
+        # обменников немного, как и в проде
+        await conn.execute("UPDATE users SET role = 'exchanger' WHERE telegram_id IN (1, 2)")
+        await conn.execute("ANALYZE")
+        await conn.commit()
+
+
+def test_hot_queries_are_registered_by_their_functions(db):
+    # SQL регистрируют сами функции, поэтому список не может разойтись с кодом
+    assert db.HOT_QUERIES["get_order_bids"][0] is db._ORDER_BIDS_SQL
+    assert db.BID_SUMMARY_COLUMNS in db.HOT_QUERIES["get_user_bids"][0]
+    for name in ("get_active_orders", "get_user_orders", "get_user_bids", "get_market_posts", "get_user_market_posts"):
+        assert f"{name} (first page)" in db.HOT_QUERIES
+
+
+def test_hot_queries_use_indexes(db, run):
+    async def plans():
+        await _seed(db)
+        problems = await db.check_hot_query_plans()
+        async with db.pool.read() as conn:
+            scans = {}
+            for name, (sql, params) in db.HOT_QUERIES.items():
+                async with conn.execute(f"EXPLAIN QUERY PLAN {sql}", params) as cursor:
+                    details = [row[3] for row in await cursor.fetchall()]
+                scans[name] = [d for d in details if d.startswith("SCAN ") and " INDEX " not in d]
+        return problems, scans
+
+    problems, scans = run(plans())
+    assert problems == {}
+    assert {name: s for name, s in scans.items() if s} == {}
+
+
+def test_every_query_in_the_module_is_checked():
+    queries, unresolved = _module_queries()
+    assert unresolved == set(DYNAMIC_QUERIES)
+    names = {name for name, _ in queries}
+    # sanity: сборщик видит и простые литералы, и f-строки, и зарегистрированные шаблоны
+    assert {"get_template", "get_user_active_tasks", "get_rate_series", "get_running_broadcast_jobs",
+            "get_rate_ingest_chats", "get_uploaded_media", "get_user_posts", "<module>"} <= names
+    assert set(FULL_SCANS) <= names
+
+
+def test_module_queries_use_indexes(db, run):
+    queries, _ = _module_queries()
+    queries += list(DYNAMIC_QUERIES.items())
+
+    async def plans():
+        await _seed(db)
+        scans = {}
+        async with db.pool.read() as conn:
+            for name, sql in queries:
+                found = await _scans(conn, sql)
+                if found and name not in FULL_SCANS:
+                    scans.setdefault(name, []).extend(found)
+        return scans
+
+    assert run(plans()) == {}
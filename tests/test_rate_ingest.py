@@ -0,0 +1,114 @@
+import asyncio
+from datetime import datetime, timezone
+
+from bot.services import rate_ingest
+
+CHAT = {"chat_id": -100, "chat_title": "Obmen", "user_id": 1, "session_string": "s", "last_message_id": 0}
+
+
+class _Msg:
+    def __init__(self, message_id: int):
+        self.id = message_id
+        self.text = f"usd {12600 + message_id}"
+        self.caption = None
+        self.date = datetime.fromtimestamp(1_700_000_000 + message_id, timezone.utc)
+
+
+class _Client:
+    def __init__(self, newest: int):
+        self.newest = newest
+
+    async def get_chat_history(self, chat_id, limit):
+        for message_id in range(self.newest, max(0, self.newest - limit), -1):
+            yield _Msg(message_id)
+
+
+def _poll(monkeypatch, client, chats, ingestor=None):
+    saved = []
+
+    async def get_client(user_id, session_string):
+        return client
+
+    async def save_progress(progress):
+        saved.extend(progress)
+
+    monkeypatch.setattr(rate_ingest, "get_client", get_client)
+    monkeypatch.setattr(rate_ingest, "save_rate_ingest_progress", save_progress)
+    ingestor = ingestor or rate_ingest.RateIngestor(fetch_limit=100)
+
+    async def scenario():
+        ingestor._queue = asyncio.Queue()
+        for chat in chats:
+            await ingestor._poll_chat(chat)
+        return [ingestor._queue.get_nowait() for _ in range(ingestor._queue.qsize())]
+
+    return ingestor, asyncio.run(scenario()), saved
+
+
+def test_first_poll_only_remembers_the_newest_message(monkeypatch):
+    client = _Client(newest=50)
+    ingestor, queued, saved = _poll(monkeypatch, client, [CHAT])
+    assert queued == []
+    assert ingestor._last_seen[CHAT["chat_id"]] == 50
+    assert saved == [(CHAT["chat_id"], "Obmen", 50, 0, 0, 0, 0, None)]
+
+    client.newest = 52
+    _, queued, _ = _poll(monkeypatch, client, [CHAT], ingestor)
+    assert [item[2] for item in queued] == [51, 52]
+    assert queued[0][4] == 1_700_000_051
+
+
+def test_saved_position_is_resumed_after_restart(monkeypatch):
+    _, queued, saved = _poll(monkeypatch, _Client(newest=53), [{**CHAT, "last_message_id": 50}])
+    assert [item[2] for item in queued] == [51, 52, 53]
+    assert saved == []
+
+
+def test_market_rates_keep_the_message_time(db, run):
+    ts = 1_700_000_000
+
+    async def scenario():
+        await db.create_tables()
+        await db.add_market_rates([("USD/UZS", "buy", 12650.0, "-100", ts), ("USD/UZS", "sell", 12700.0, "-100", ts + 60)])
+        async with db.pool.read() as conn:
+            async with conn.execute(
+                "SELECT rate_buy, rate_sell, CAST(strftime('%s', timestamp) AS INTEGER) FROM market_rates ORDER BY id"
+            ) as cursor:
+                return await cursor.fetchall()
+
+    assert run(scenario()) == [(12650.0, None, ts), (None, 12700.0, ts + 60)]
+
+
+def test_skipped_count_survives_a_failed_write(monkeypatch):
+    saved, attempts = [], []
+
+    async def parse(text):
+        return []
+
+    async def add_rates(rows):
+        attempts.append(rows)
+        if len(attempts) == 1:
+            raise RuntimeError("database is locked")
+
+    async def save_progress(progress):
+        saved.extend(progress)
+
+    monkeypatch.setattr(rate_ingest, "parse_market_message", parse)
+    monkeypatch.setattr(rate_ingest, "add_market_rates", add_rates)
+    monkeypatch.setattr(rate_ingest, "save_rate_ingest_progress", save_progress)
+    ingestor = rate_ingest.RateIngestor()
+    ingestor._pending_skipped[-100] = 40
+    batch = [(-100, "Obmen", 51, "hello", 1_700_000_051)]
+
+    async def scenario():
+        try:
+            await ingestor._process(batch)
+        except RuntimeError:
+            pass
+        kept = dict(ingestor._pending_skipped)
+        await ingestor._process(batch)
+        return kept
+
+    assert asyncio.run(scenario()) == {-100: 40}
+    assert saved == [(-100, "Obmen", 51, 1, 0, 0, 40, None)]
+    assert ingestor._pending_skipped == {}
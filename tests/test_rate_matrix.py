@@ -0,0 +1,39 @@
+import math
+
+import pytest
+
+from bot.services.rate_matrix import RateMatrix
+
+
+@pytest.fixture
+def matrix():
+    return RateMatrix(["USD", "UZS", "RUB", "EUR"], ["official", "p2p", "street"])
+
+
+def test_zero_and_negative_rates_are_ignored_in_both_directions(matrix):
+    cells = matrix._build([
+        ("USD", "UZS", 0, "official", False, 1.0),
+        ("USD", "RUB", -90.0, "official", False, 1.0),
+        ("USD", "EUR", math.nan, "official", False, 1.0),
+        ("EUR", "UZS", None, "street", False, 1.0),
+    ])
+    assert cells == {}
+
+
+def test_bad_quote_does_not_hide_a_good_one(matrix):
+    cells = matrix._build([
+        ("USD", "UZS", 0.0, "official", False, 1.0),
+        ("USD", "UZS", 12650.0, "street", False, 1.0),
+    ])
+    assert cells[("USD", "UZS")].rate == 12650.0
+    assert cells[("UZS", "USD")].rate == pytest.approx(1 / 12650.0)
+
+
+def test_cross_rate_through_usd(matrix):
+    cells = matrix._build([
+        ("USD", "UZS", 12600.0, "official", False, 1.0),
+        ("USD", "RUB", 90.0, "official", False, 2.0),
+    ])
+    cross = cells[("RUB", "UZS")]
+    assert cross.rate == pytest.approx(12600.0 / 90.0)
+    assert cross.via == "USD"
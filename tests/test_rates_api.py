@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from bot.services import rates_api
+from bot.services.rates_api import volume_weighted_price
+
+
+def _adv(price, quantity=None, surplus=None):
+    adv = {"price": str(price)}
+    if quantity is not None:
+        adv["tradableQuantity"] = str(quantity)
+    if surplus is not None:
+        adv["surplusAmount"] = str(surplus)
+    return {"adv": adv}
+
+
+def test_price_is_weighted_by_tradable_volume():
+    advs = [_adv(12700, 100), _adv(12800, 300), _adv(13500, 1)]
+    assert volume_weighted_price(advs, depth=2) == pytest.approx((12700 * 100 + 12800 * 300) / 400)
+
+
+def test_surplus_amount_is_the_fallback_volume():
+    # tradableQuantity = 0 — объявление исчерпано и в среднее не входит
+    advs = [_adv(12700, surplus=100), _adv(12800, surplus=300), _adv(20000, quantity=0, surplus=999)]
+    assert volume_weighted_price(advs, depth=5) == pytest.approx(12775)
+
+
+def test_broken_rows_are_skipped_and_missing_volumes_give_a_plain_mean():
+    advs = [{"adv": {"price": "n/a"}}, {}, _adv(12700, quantity="lots"), _adv(12800)]
+    assert volume_weighted_price(advs, depth=5) == pytest.approx(12750)
+    assert volume_weighted_price([], depth=5) is None
+
+
+def test_p2p_rates_collect_every_fiat_and_side(monkeypatch):
+    calls = []
+
+    async def fetch_side(session, fiat, side, depth):
+        calls.append((fiat, side, depth))
+        return None if (fiat, side) == ("KZT", "SELL") else {"BUY": 1.0, "SELL": 2.0}[side]
+
+    monkeypatch.setattr(rates_api, "_fetch_p2p_side", fetch_side)
+    monkeypatch.setattr(rates_api, "get_session", lambda: None)
+    rates = asyncio.run(rates_api.get_binance_p2p_rates(["UZS", "KZT"], depth=50))
+    assert rates == {"USDT/UZS": {"buy": 1.0, "sell": 2.0}, "USDT/KZT": {"buy": 1.0}}
+    assert sorted(calls) == [("KZT", "BUY", 20), ("KZT", "SELL", 20), ("UZS", "BUY", 20), ("UZS", "SELL", 20)]
@@ -0,0 +1,100 @@
+import asyncio
+
+from bot.services.rates_cache import RatesCache
+
+
+class _Fetch:
+    """Источник курсов: каждый вызов ждёт gate и отдаёт следующее значение из values."""
+
+    def __init__(self, *values):
+        self.values = list(values)
+        self.calls = 0
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.gate.wait()
+        value = self.values.pop(0)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+
+def _cache(fetch, ttl=60.0, retry_after=60.0):
+    cache = RatesCache(retry_after=retry_after)
+    cache.register("official", fetch, ttl)
+    return cache
+
+
+def test_concurrent_cold_reads_share_one_request():
+    async def scenario():
+        fetch = _Fetch({"USD": 12650})
+        fetch.gate.clear()
+        cache = _cache(fetch)
+        readers = [asyncio.create_task(cache.get("official")) for _ in range(5)]
+        await asyncio.sleep(0)
+        readers[0].cancel()  # отмена одного ожидающего не отменяет общий запрос
+        fetch.gate.set()
+        results = await asyncio.gather(*readers[1:])
+        return fetch.calls, results
+
+    calls, results = asyncio.run(scenario())
+    assert calls == 1
+    assert results == [{"USD": 12650}] * 4
+
+
+def test_stale_value_is_served_while_revalidating():
+    async def scenario():
+        fetch = _Fetch({"USD": 12650}, {"USD": 12700})
+        cache = _cache(fetch, ttl=60)
+        seen = []
+
+        async def listener(name, value):
+            seen.append((name, value))
+
+        cache.add_listener(listener)
+        first = await cache.get("official")
+        cache.sources["official"].fetched_at -= 120  # устарело
+        fetch.gate.clear()
+        stale = await asyncio.wait_for(cache.get("official"), 0.1)  # не ждёт источник
+        again = await cache.get("official")  # обновление уже идёт — второй запрос не нужен
+        fetch.gate.set()
+        await cache.sources["official"].inflight
+        return first, stale, again, await cache.get("official"), fetch.calls, seen, cache.is_fresh("official")
+
+    first, stale, again, fresh, calls, seen, is_fresh = asyncio.run(scenario())
+    assert first == stale == again == {"USD": 12650}
+    assert fresh == {"USD": 12700} and is_fresh
+    assert calls == 2
+    assert seen == [("official", {"USD": 12650}), ("official", {"USD": 12700})]
+
+
+def test_failures_keep_the_last_value_and_back_off():
+    async def scenario():
+        fetch = _Fetch({"USD": 12650}, RuntimeError("timeout"), {})
+        cache = _cache(fetch, ttl=60, retry_after=60)
+        await cache.get("official")
+        cache.sources["official"].fetched_at -= 120
+        await cache.get("official")
+        await cache.sources["official"].inflight  # упал
+        kept = await cache.get("official")  # недавняя ошибка — без нового запроса
+        calls_after_failure = fetch.calls
+        cache.sources["official"].failed_at -= 120
+        await cache.get("official")
+        await cache.sources["official"].inflight  # пустой ответ — тоже неудача
+        return kept, calls_after_failure, fetch.calls, cache.stats()["official"]
+
+    kept, calls_after_failure, calls, stats = asyncio.run(scenario())
+    assert kept == {"USD": 12650}
+    assert (calls_after_failure, calls) == (2, 3)
+    assert stats["failing"] and not stats["fresh"]
+
+
+def test_cold_failure_is_not_retried_on_every_read():
+    async def scenario():
+        fetch = _Fetch(RuntimeError("down"))
+        cache = _cache(fetch)
+        return await cache.get("official"), await cache.get("official"), fetch.calls
+
+    assert asyncio.run(scenario()) == ({}, {}, 1)
@@ -0,0 +1,80 @@
+import asyncio
+
+from bot.database.pool import ConnectionPool
+from bot.database.write_queue import WriteQueue
+
+
+async def _setup(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "q.db"))
+    async with pool.write() as db:
+        await db.execute("CREATE TABLE t (k INTEGER PRIMARY KEY, v INTEGER)")
+        await db.commit()
+    return pool, WriteQueue(pool, flush_interval=0.01)
+
+
+async def _rows(pool):
+    async with pool.read() as db:
+        async with db.execute("SELECT k, v FROM t ORDER BY k") as cursor:
+            return await cursor.fetchall()
+
+
+def test_small_writes_are_coalesced_into_one_batch(tmp_path):
+    async def scenario():
+        pool, queue = await _setup(tmp_path)
+        await asyncio.gather(*(queue.submit("INSERT INTO t VALUES (?, ?)", (k, k)) for k in range(20)))
+        assert queue.batches == 1 and queue.writes == 20
+        assert len(await _rows(pool)) == 20
+        await queue.close()
+        await pool.close()
+
+    asyncio.run(scenario())
+
+
+def test_submit_many_is_atomic_within_a_batch(tmp_path):
+    async def scenario():
+        pool, queue = await _setup(tmp_path)
+        await asyncio.gather(
+            queue.submit_many([("INSERT INTO t VALUES (?, ?)", [(1, 1), (2, 2)]),
+                               ("UPDATE t SET v = v * 10 WHERE k = ?", [(1,)])]),
+            queue.submit("INSERT INTO t VALUES (?, ?)", (3, 3)),
+        )
+        assert await _rows(pool) == [(1, 10), (2, 2), (3, 3)]
+        assert queue.batches == 1
+        await queue.close()
+        await pool.close()
+
+    asyncio.run(scenario())
+
+
+def test_failed_batch_falls_back_to_single_writes(tmp_path):
+    async def scenario():
+        pool, queue = await _setup(tmp_path)
+        ok = queue.submit("INSERT INTO t VALUES (?, ?)", (1, 1))
+        bad = queue.submit_many([("INSERT INTO t VALUES (?, ?)", [(2, 2), (2, 3)])])  # дубликат ключа
+        results = await asyncio.gather(ok, bad, return_exceptions=True)
+        assert results[0] is None
+        assert isinstance(results[1], Exception)
+        # неудачная запись откатилась целиком, соседняя сохранилась
+        assert await _rows(pool) == [(1, 1)]
+        assert queue.failed == 1
+        await queue.close()
+        await pool.close()
+
+    asyncio.run(scenario())
+
+
+def test_market_rates_go_through_the_write_queue(run, db):
+    async def scenario():
+        await db.create_tables()
+        before = db.write_queue.writes
+        await asyncio.gather(*(db.add_market_rate("USD/UZS", 12600 + i, "g") for i in range(5)))
+        assert db.write_queue.writes - before == 5
+        async with db.pool.read() as conn:
+            async with conn.execute("SELECT COUNT(*) FROM market_rates") as cursor:
+                assert (await cursor.fetchone())[0] == 5
+            async with conn.execute(
+                "SELECT count, low, high FROM rate_rollups WHERE resolution = '1d' AND source = 'street'"
+            ) as cursor:
+                assert await cursor.fetchall() == [(5, 12600, 12604)]
+
+    run(scenario())
@@ -0,0 +1,137 @@
+import asyncio
+import json
+
+from aiohttp import WSCloseCode
+
+from bot.services.ws_hub import WSHub, topic
+
+
+class _WS:
+    """Сокет, который принимает сообщения, только когда открыт gate."""
+
+    def __init__(self):
+        self.closed = False
+        self.close_code = None
+        self.sent = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def send_str(self, message):
+        await self.gate.wait()
+        self.sent.append(json.loads(message))
+
+    async def close(self, code=None, message=b""):
+        self.closed = True
+        self.close_code = code
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_newer_event_replaces_the_queued_one_with_the_same_key():
+    async def scenario():
+        hub = WSHub(max_queue=8)
+        ws = _WS()
+        client = hub.register(ws)
+        # drain-задача ещё не запускалась — всё ложится в очередь
+        hub.publish("order_update", {"id": 1, "status": "active"}, key="order:1")
+        hub.publish("new_bid", {"order_id": 1})
+        hub.publish("order_update", {"id": 1, "status": "closed"}, key="order:1")
+        depth = len(client.queue)
+        await _settle()
+        await hub.close()
+        return hub, depth, ws.sent
+
+    hub, depth, sent = asyncio.run(scenario())
+    assert depth == 2
+    # заменённое событие сохраняет место в очереди, но несёт свежие данные
+    assert sent == [
+        {"type": "order_update", "data": {"id": 1, "status": "closed"}},
+        {"type": "new_bid", "data": {"order_id": 1}},
+    ]
+    assert (hub.coalesced, hub.delivered, hub.dropped) == (1, 2, 0)
+
+
+def test_stalled_client_is_disconnected_but_a_burst_is_not():
+    async def scenario():
+        hub = WSHub(max_queue=2, send_timeout=5, max_lag_drops=3)
+        slow_ws, busy_ws = _WS(), _WS()
+        slow_ws.gate.clear()
+        slow, busy = hub.register(slow_ws), hub.register(busy_ws)
+        for i in range(2):
+            hub.publish("tick", i)
+        # slow ничего не принимал дольше send_timeout, busy — только что
+        slow.last_progress -= 60
+        for i in range(2, 5):
+            hub.publish("tick", i)
+        flags = (slow.slow, busy.slow, slow.lag_drops, busy.lag_drops)
+        await _settle()
+        after = hub.publish("tick", 5)
+        await _settle()
+        await hub.close()
+        return hub, flags, after, slow_ws, busy_ws
+
+    hub, flags, after, slow_ws, busy_ws = asyncio.run(scenario())
+    assert flags == (True, False, 3, 3)
+    assert slow_ws.closed and slow_ws.close_code == WSCloseCode.TRY_AGAIN_LATER
+    assert slow_ws.sent == []
+    assert hub.slow_disconnects == 1
+    assert after == 1  # отключаемому клиенту больше ничего не ставится
+    # быстрый клиент потерял самые старые события, но остался на связи
+    assert [m["data"] for m in busy_ws.sent] == [3, 4, 5]
+
+
+def test_stuck_send_times_out_and_closes():
+    async def scenario():
+        hub = WSHub(send_timeout=0.01)
+        ws = _WS()
+        ws.gate.clear()
+        hub.register(ws)
+        hub.publish("tick", 1)
+        await asyncio.sleep(0.05)
+        await hub.close()
+        return hub, ws
+
+    hub, ws = asyncio.run(scenario())
+    assert ws.closed and ws.close_code == WSCloseCode.GOING_AWAY
+    assert hub.slow_disconnects == 1
+
+
+def test_unregister_returns_while_a_send_is_finishing():
+    async def scenario():
+        hub = WSHub()
+        ws = _WS()
+        client = hub.register(ws)
+        hub.publish("tick", 1)
+        await asyncio.sleep(0)  # drain внутри wait_for(send_str), отправка уже завершилась
+        # asyncio.wait не отменяет по таймауту — зависание не замаскируется повторным cancel()
+        done, _ = await asyncio.wait({asyncio.create_task(hub.unregister(client))}, timeout=1)
+        return bool(done) and client.task.done(), ws.sent
+
+    assert asyncio.run(scenario()) == (True, [{"type": "tick", "data": 1}])
+
+
+def test_events_reach_only_subscribed_clients_once():
+    async def scenario():
+        hub = WSHub(max_topics=2)
+        a, b, idle = (hub.register(_WS()) for _ in range(3))
+        accepted = hub.subscribe(a, ["Location:Chilonzor ", "currency:USD", "order:1", "bogus", 42])
+        hub.subscribe(b, ["currency:usd"])
+        counts = (
+            hub.publish("new_post", 1, topics=[topic("location", "chilonzor"), topic("currency", "usd")]),
+            hub.publish("new_post", 2, topics=[topic("location", "yunusobod")]),
+            hub.publish("rates", 3),
+        )
+        queued = [[json.loads(m)["data"] for _, m in client.queue] for client in (a, b, idle)]
+        await hub.unregister(a)
+        routes = {name: len(clients) for name, clients in hub.routes.items()}
+        await hub.close()
+        return accepted, counts, queued, routes
+
+    accepted, counts, queued, routes = asyncio.run(scenario())
+    assert accepted == ["location:chilonzor", "currency:usd"]  # max_topics=2, мусор отброшен
+    assert counts == (2, 0, 3)
+    assert queued == [[1, 3], [1, 3], [3]]
+    assert routes == {"currency:usd": 1}  # отключённый сокет убран из маршрутов